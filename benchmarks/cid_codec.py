@@ -0,0 +1,58 @@
+"""
+Per-CID cost of the CID codec in test_utils.ipfs_utils.
+
+    python -m benchmarks.cid_codec [num_cids]
+
+Compares the original base58/binascii conversion with the batch API, cold
+(empty LRU) and warm (every CID already cached).
+"""
+import binascii
+import os
+import sys
+import time
+
+from test_utils import ipfs_utils
+
+
+def legacy_to_hex(cid):
+    import base58
+    return binascii.b2a_hex(base58.b58decode(cid)[2:]).decode("utf-8")
+
+
+def legacy_to_cid(hexstr):
+    import base58
+    return base58.b58encode(b'\x12 ' + binascii.a2b_hex(hexstr)).decode("utf-8")
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("{:<32} {:>10.2f} us/cid".format(label, elapsed / count * 1e6))
+
+
+def clear_caches():
+    ipfs_utils.cid_to_digest.cache_clear()
+    ipfs_utils.digest_to_cidv0.cache_clear()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    digests = [os.urandom(32) for _ in range(count)]
+    cids = ipfs_utils.digests_to_cids(digests)
+    hexes = [d.hex() for d in digests]
+    buffer = b"".join(digests)
+
+    try:
+        import base58  # noqa: F401
+        timed("legacy ipfscidv0 -> hex", lambda: [legacy_to_hex(c) for c in cids], count)
+        timed("legacy hex -> ipfscidv0", lambda: [legacy_to_cid(h) for h in hexes], count)
+    except ImportError:
+        print("base58 not installed, skipping the legacy baseline")
+
+    clear_caches()
+    timed("cids_to_digests (cold)", lambda: ipfs_utils.cids_to_digests(cids, as_buffer=True), count)
+    timed("cids_to_digests (warm)", lambda: ipfs_utils.cids_to_digests(cids, as_buffer=True), count)
+    clear_caches()
+    timed("digests_to_cids (cold)", lambda: ipfs_utils.digests_to_cids(buffer), count)
+    timed("digests_to_cids (warm)", lambda: ipfs_utils.digests_to_cids(buffer), count)
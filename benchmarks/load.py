@@ -0,0 +1,250 @@
+"""
+Sales per second of the step_01 listing -> purchase -> close flow under load.
+
+    python -m benchmarks.load [--sales 200] [--concurrency 16] [--rate 0] [--files 1] [--json load.json]
+
+Every worker is one seller/buyer pair leased from the wallet pool, running
+sales back to back: deploy_ipfs, the setup calls of upload_listing, the grouped
+payment + NoOp purchase, then a read of the closed sale's global state. --rate
+caps how many sales start per second, 0 starts them as fast as workers free up.
+
+Without --algod the run goes against an in-process test_utils.local_algod with
+a block per submission, so the numbers are those of our client and contract
+code; with --algod it uses that node and the fund_account_mnemonic account.
+Reports sales/s, latency percentiles per stage, fees and failure causes.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk import encoding
+from algosdk.future import transaction
+
+from test_utils import (WalletPool, generate_new_account, get_algod_client, get_global_state, sign_txn,
+                        wait_for_txns_confirm)
+from contracts.ipfs_transfer.deploy import deploy_ipfs, upload_listing
+from contracts.ipfs_transfer.purchase import purchase_cost
+from contracts.ipfs_transfer.step_01 import compile_ipfs
+
+STAGES = ("deploy", "setup", "purchase", "close")
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+TOTAL_ITEM_COST = 300000
+# The purchase pays the app the price and its minimum balance
+APP_MIN_BALANCE = 100000
+# Notes one purchase call can send within its own opcode budget
+MAX_FILES = 30
+# Minimum balance a created sale app adds to its seller, with room for the slots
+SALE_APP_MIN_BALANCE = 100000 + 3 * 28500 + 60 * 50000
+TXID_RE = re.compile(r"\b[A-Z2-7]{52,58}\b")
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": ordered[-1],
+    }
+
+
+def failure_cause(error):
+    # Ids and addresses make every message unique, keep what went wrong
+    return "{}: {}".format(type(error).__name__, TXID_RE.sub("<id>", str(error)))[:160]
+
+
+class LoadRun:
+    def __init__(self, client, address, token, num_files, rate):
+        self.client = client
+        self.address = address
+        self.token = token
+        self.keys = [TEST_IPFS_KEYS[i % len(TEST_IPFS_KEYS)] for i in range(num_files)]
+        self.rate = rate
+        self.latencies = defaultdict(list)
+        self.fees = Counter()
+        self.failures = Counter()
+        self.succeeded = 0
+        self._lock = threading.Lock()
+        self._next_start = None
+
+    def _wait_turn(self):
+        if not self.rate:
+            return
+        with self._lock:
+            # Sales start 1 / rate apart, late workers don't make up for lost time
+            start = max(self._next_start or 0, time.perf_counter())
+            self._next_start = start + 1 / self.rate
+        delay = start - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _timed(self, stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        with self._lock:
+            self.latencies[stage].append(time.perf_counter() - start)
+        return result
+
+    def sale(self, seller, buyer):
+        self._wait_turn()
+        start = time.perf_counter()
+        try:
+            fees = self._sale(seller, buyer)
+        except Exception as e:
+            with self._lock:
+                self.failures[failure_cause(e)] += 1
+            return
+        with self._lock:
+            self.latencies["sale"].append(time.perf_counter() - start)
+            self.fees.update(fees)
+            self.succeeded += 1
+
+    def _sale(self, seller, buyer):
+        client = self.client
+        app_id = self._timed("deploy", lambda: deploy_ipfs(
+            self.address, self.token, seller["mnemonic"], len(self.keys), TOTAL_ITEM_COST, self.keys
+        ))
+        params = client.suggested_params()
+        setup_txns = self._timed("setup", lambda: upload_listing(
+            client, seller["priv_key"], app_id, buyer["address"], TOTAL_ITEM_COST, self.keys
+        ))
+
+        app_address = encoding.encode_address(encoding.checksum(b"appID" + app_id.to_bytes(8, "big")))
+        txn_pay = transaction.PaymentTxn(buyer["address"], params, app_address, TOTAL_ITEM_COST + APP_MIN_BALANCE)
+        txn_noop = transaction.ApplicationNoOpTxn(buyer["address"], params, app_id, accounts=[seller["address"]])
+        txn_noop.fee = purchase_cost(len(self.keys), params.min_fee)[0]
+        transaction.assign_group_id([txn_pay, txn_noop])
+
+        def purchase():
+            client.send_transactions([sign_txn(txn_pay, buyer["priv_key"]), sign_txn(txn_noop, buyer["priv_key"])])
+            return wait_for_txns_confirm(client, [txn_pay.get_txid(), txn_noop.get_txid()], 5)
+
+        self._timed("purchase", purchase)
+        closed = self._timed("close", lambda: get_global_state(client, seller["address"], app_id))
+        if closed is not None:
+            raise AssertionError("sale {} still has state after the purchase".format(app_id))
+        return {
+            "deploy": params.min_fee,
+            "setup": sum(txn.fee for txn in setup_txns),
+            "purchase": txn_pay.fee + txn_noop.fee,
+        }
+
+    def report(self, config, elapsed):
+        sales = self.succeeded + sum(self.failures.values())
+        return {
+            "config": config,
+            "sales": sales,
+            "succeeded": self.succeeded,
+            "failed": sales - self.succeeded,
+            "elapsed_s": elapsed,
+            "sales_per_s": self.succeeded / elapsed if elapsed else 0,
+            "latency_s": {stage: percentiles(self.latencies[stage]) for stage in STAGES + ("sale",)},
+            "fees": {
+                "total": sum(self.fees.values()),
+                "per_sale": sum(self.fees.values()) / self.succeeded if self.succeeded else 0,
+                "by_stage": dict(self.fees),
+            },
+            "failures": dict(self.failures.most_common()),
+        }
+
+
+def run_load(address, token, funder_mnemonic, sales=200, concurrency=16, rate=0, num_files=1, pool_path=None):
+    """
+    Run sales sales over concurrency seller/buyer pairs.
+    Returns:
+        dict: the report, see LoadRun.report
+    """
+    if num_files > MAX_FILES:
+        raise ValueError("purchases of more than {} files need an extra budget call".format(MAX_FILES))
+    client = get_algod_client(token, address)
+    compile_ipfs(client, num_files)
+    min_fee = client.suggested_params().min_fee
+    rounds = -(-sales // concurrency)
+    # Enough for every sale a pair runs: the buyer pays price, app minimum balance
+    # and fees, the seller locks a sale app's minimum balance
+    per_sale = TOTAL_ITEM_COST + APP_MIN_BALANCE + SALE_APP_MIN_BALANCE + 20 * min_fee
+    pool = WalletPool(client, funder_mnemonic, balance=per_sale * rounds,
+                      **({"path": pool_path} if pool_path else {}))
+    run = LoadRun(client, address, token, num_files, rate)
+    config = {"algod": address, "sales": sales, "concurrency": concurrency, "rate": rate, "num_files": num_files}
+
+    with pool.leased(2 * concurrency) as wallets:
+        pairs = [(wallets[2 * i], wallets[2 * i + 1]) for i in range(concurrency)]
+
+        def worker(index):
+            seller, buyer = pairs[index]
+            for _ in range(index, sales, concurrency):
+                run.sale(seller, buyer)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return run.report(config, elapsed)
+
+
+def format_report(report):
+    lines = [
+        "{succeeded}/{sales} sales in {elapsed_s:.2f}s: {sales_per_s:.1f} sales/s".format(**report),
+        "{:<10} {:>7} {:>9} {:>9} {:>9} {:>9}".format("stage", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"),
+    ]
+    for stage, stats in report["latency_s"].items():
+        if stats:
+            lines.append("{:<10} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                stage, stats["count"], *(stats[key] * 1000 for key in ("p50", "p90", "p99", "max"))
+            ))
+    lines.append("fees: {total} microalgos, {per_sale:.0f} per sale {by_stage}".format(**report["fees"]))
+    for cause, count in report["failures"].items():
+        lines.append("failed {}x: {}".format(count, cause))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the step_01 sale flow")
+    parser.add_argument("--sales", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent seller/buyer pairs")
+    parser.add_argument("--rate", type=float, default=0, help="sales started per second, 0 for no limit")
+    parser.add_argument("--files", type=int, default=1, help="IPFS keys per sale, up to {}".format(MAX_FILES))
+    parser.add_argument("--algod", help="algod address, an in-process local algod if not set")
+    parser.add_argument("--token", default="a" * 64)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    # deploy_ipfs prints every app it deploys
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    if args.algod:
+        with quiet:
+            report = run_load(args.algod, args.token, os.getenv("fund_account_mnemonic"),
+                              args.sales, args.concurrency, args.rate, args.files)
+    else:
+        from test_utils.local_algod import GENESIS_FUNDS, LocalAlgod
+        funder_mnemonic, _, funder_address = generate_new_account()
+        # Accounts of an in-memory ledger are gone with it, so is their pool
+        with LocalAlgod(genesis={funder_address: GENESIS_FUNDS}) as algod, tempfile.TemporaryDirectory() as pool_path, quiet:
+            report = run_load(algod.address, args.token, funder_mnemonic,
+                              args.sales, args.concurrency, args.rate, args.files, pool_path)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as h:
+            json.dump(report, h, indent=2)
+        print("wrote " + args.json, file=sys.stderr)
@@ -0,0 +1,63 @@
+"""
+Per-transaction cost of signing a batch ready to send.
+
+    python -m benchmarks.signing [num_txns] [processes]
+
+Compares the per-transaction helpers (sign_txn, then get_txid and the encoding
+send_transactions does) with test_utils.BatchSigner in process and over a
+process pool. Transactions are payments from 8 senders, like a funding run.
+"""
+import base64
+import os
+import sys
+import time
+
+from algosdk import account, encoding
+from algosdk.future import transaction
+
+from test_utils import BatchSigner, sign_txn
+
+SENDERS = 8
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("{:<32} {:>10.2f} us/txn".format(label, elapsed / count * 1e6))
+
+
+def build(count):
+    params = transaction.SuggestedParams(0, 1, 1000, base64.b64encode(bytes(32)).decode(), "sandnet-v1", min_fee=1000)
+    keys = [account.generate_account() for _ in range(SENDERS)]
+    receiver = account.generate_account()[1]
+    txns, private_keys = [], []
+    for i in range(count):
+        private_key, address = keys[i % SENDERS]
+        txns.append(transaction.PaymentTxn(address, params, receiver, 1000 + i))
+        private_keys.append(private_key)
+    return txns, private_keys
+
+
+def per_txn(txns, private_keys):
+    for txn, private_key in zip(txns, private_keys):
+        signed = sign_txn(txn, private_key)
+        signed.transaction.get_txid()
+        base64.b64decode(encoding.msgpack_encode(signed))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    txns, private_keys = build(count)
+
+    timed("sign_txn + get_txid + encode", lambda: per_txn(txns, private_keys), count)
+    with BatchSigner(processes=1) as signer:
+        timed("BatchSigner in process", lambda: signer.sign(txns, private_keys), count)
+    if processes > 1:
+        with BatchSigner(processes=processes, min_batch=1) as signer:
+            # Start the workers before timing
+            signer.sign(txns[:processes], private_keys[:processes])
+            timed("BatchSigner {} processes".format(processes), lambda: signer.sign(txns, private_keys), count)
+    else:
+        print("1 core, skipping the process pool")
@@ -6,4 +6,7 @@ rm -f ./build/*.teal
 
 set -e # die on error
 
-python3 ./compile.py "$1" ./build/approval.teal ./build/clear.teal
+# Unchanged contracts are served from the compile cache instead of being rebuilt
+export IPFS_SC_CACHE_DIR="${IPFS_SC_CACHE_DIR:-./.compile_cache}"
+
+python3 ./cli.py compile "$1" ./build/approval.teal ./build/clear.teal
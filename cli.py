@@ -0,0 +1,284 @@
+"""
+One entry point for compiling, signing, deploying and buying.
+
+    python cli.py compile [module [approval_out [clear_out]]] [--files 1]
+    python cli.py sign module outfile [args ...]
+    python cli.py deploy price cid [cid ...] [--buyer address]
+    python cli.py list app_id buyer price cid [cid ...]
+    python cli.py buy app_id [app_id ...] [--budget-app id] [--checkout]
+    python cli.py state app_id
+
+compile without a module builds the step_01 sale to ./build/ipfs_transfer.artifact
+for deploy. Accounts come from --mnemonic, the fund_account_mnemonic env by
+default, and algod from test_utils/test_config.json unless --algod is given.
+
+Only the standard library is imported up front: pyteal, algosdk and test_utils
+are imported by the subcommands that use them, and state reads algod without
+algosdk at all. --timings prints startup and per-phase times to stderr.
+"""
+import time
+
+# CPU the interpreter spent before running this file
+STARTUP_CPU = time.process_time()
+START = time.perf_counter()
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import sys
+
+DEFAULT_CONFIG = "./test_utils/test_config.json"
+# Value type of a bytes global state entry, see test_utils.state
+TEAL_BYTES = 1
+# The only address a sale keeps, its other named keys hold ints
+BUYER_KEY = b"buyer"
+
+
+class Timings:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - START
+        totals = {}
+        for name, seconds in self.phases:
+            totals[name] = totals.get(name, 0) + seconds
+        # Argument parsing, output and the standard library imports of this file
+        totals["other"] = elapsed - sum(totals.values())
+        rows = [("startup", STARTUP_CPU)] + list(totals.items()) + [("total", STARTUP_CPU + elapsed)]
+        for name, seconds in rows:
+            print("{:<10} {:>8.1f} ms".format(name, seconds * 1000), file=sys.stderr)
+
+
+def algod_config(args):
+    if args.algod:
+        return args.algod, args.token
+    with open(args.config) as f:
+        config = json.load(f)
+    return config["algod_address"], args.token or config["algod_token"]
+
+
+def private_key(args, timings):
+    if not args.mnemonic:
+        raise ValueError("no account, pass --mnemonic or set fund_account_mnemonic")
+    with timings.phase("import"):
+        from algosdk import mnemonic
+    return mnemonic.to_private_key(args.mnemonic)
+
+
+def algod_client(args, timings):
+    with timings.phase("import"):
+        from test_utils import get_algod_client
+    address, token = algod_config(args)
+    return get_algod_client(token or "a" * 64, address)
+
+
+def cmd_compile(args, timings):
+    with timings.phase("import"):
+        from pyteal_helpers.cache import CompileCache
+    cache = CompileCache()
+    if args.module is None:
+        with timings.phase("import"):
+            from contracts.ipfs_transfer.step_01 import compile_ipfs
+        client = algod_client(args, timings) if args.check_with_algod else None
+        with timings.phase("compile"):
+            compile_ipfs(client, args.files, cache, args.check_with_algod)
+        print("wrote ./build/ipfs_transfer.artifact")
+    else:
+        with timings.phase("import"):
+            import importlib
+            from pyteal_helpers import program
+            contract = importlib.import_module(args.module)
+        with timings.phase("compile"):
+            approval_teal = cache.teal(contract.approval, render=lambda fn: program.application(fn()))
+            clear_teal = cache.teal(contract.clear, render=lambda fn: program.application(fn())) if args.clear_out else None
+        if args.approval_out is None:
+            print(approval_teal)
+        else:
+            with open(args.approval_out, "w") as h:
+                h.write(approval_teal)
+        if clear_teal is not None:
+            with open(args.clear_out, "w") as h:
+                h.write(clear_teal)
+    print(cache.stats, file=sys.stderr)
+
+
+def cmd_sign(args, timings):
+    with timings.phase("import"):
+        import importlib
+        from pyteal_helpers import program
+        from pyteal_helpers.cache import CompileCache
+        contract = importlib.import_module(args.module)
+    cache = CompileCache()
+    client = algod_client(args, timings) if args.check_with_algod else None
+    with timings.phase("compile"):
+        teal = cache.teal(contract.create, args.contract_args, render=lambda fn, a: program.logic_signature(fn(a)))
+        sig = program.signature(client, teal, cache, args.check_with_algod)
+    print(f"Logic Signature Address: {sig.address}")
+    print(cache.stats, file=sys.stderr)
+    with open(args.outfile, "w") as h:
+        h.write(sig.teal)
+
+
+def cmd_deploy(args, timings):
+    priv_key = private_key(args, timings)
+    client = algod_client(args, timings)
+    with timings.phase("import"):
+        from contracts.ipfs_transfer.deploy import mass_deploy_ipfs
+    listing = (priv_key, args.price, args.cids) + ((args.buyer,) if args.buyer else ())
+    with timings.phase("deploy"):
+        app_id, = mass_deploy_ipfs(client, [listing])
+    print(app_id)
+
+
+def cmd_list(args, timings):
+    priv_key = private_key(args, timings)
+    client = algod_client(args, timings)
+    with timings.phase("import"):
+        from contracts.ipfs_transfer.deploy import upload_listing
+    with timings.phase("list"):
+        txns = upload_listing(client, priv_key, args.app_id, args.buyer, args.price, args.cids)
+    print("\n".join(txn.get_txid() for txn in txns))
+
+
+def cmd_buy(args, timings):
+    priv_key = private_key(args, timings)
+    client = algod_client(args, timings)
+    with timings.phase("import"):
+        from algosdk import account
+        from contracts.ipfs_transfer.purchase import Order, PurchaseClient
+    buyer = account.address_from_private_key(priv_key)
+    purchases = PurchaseClient(client, args.budget_app)
+    orders = [Order(app_id, buyer, priv_key) for app_id in args.app_ids]
+    with timings.phase("buy"):
+        results = purchases.checkout(orders) if args.checkout else purchases.buy(orders)
+    for result in results:
+        if result.confirmed:
+            print("{} confirmed in round {}: {}".format(result.order.app_id, result.confirmed_round, " ".join(result.cids)))
+        else:
+            print("{} failed: {}".format(result.order.app_id, result.error))
+    return 0 if all(result.confirmed for result in results) else 1
+
+
+def address(raw):
+    checksum = hashlib.new("sha512_256", raw).digest()[-4:]
+    return base64.b32encode(raw + checksum).decode().rstrip("=")
+
+
+def state_key(key):
+    # Slot keys are one byte, the slot index; every named key is longer
+    if len(key) == 1:
+        return str(key[0])
+    return key.decode(errors="replace")
+
+
+def state_value(key, value):
+    if value["type"] != TEAL_BYTES:
+        return value["uint"]
+    if key == BUYER_KEY:
+        return address(base64.b64decode(value["bytes"]))
+    return value["bytes"]
+
+
+def cmd_state(args, timings):
+    # A plain GET: importing algosdk would cost more than the request
+    import urllib.error
+    import urllib.request
+    algod, token = algod_config(args)
+    request = urllib.request.Request(
+        "{}/v2/applications/{}".format(algod.rstrip("/"), args.app_id),
+        headers={"X-Algo-API-Token": token or "a" * 64},
+    )
+    with timings.phase("algod"):
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                info = json.load(response)
+        except urllib.error.HTTPError as e:
+            raise ValueError("app {}: {}".format(args.app_id, e.read().decode() or e.reason)) from None
+    state = {}
+    for key_value in info["params"].get("global-state", []):
+        key = base64.b64decode(key_value["key"])
+        state[state_key(key)] = state_value(key, key_value["value"])
+    print(json.dumps({"app_id": args.app_id, "creator": info["params"]["creator"], "global_state": state}, indent=2))
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--algod", help="algod address, read from --config if not set")
+    common.add_argument("--token", help="algod token, read from --config if not set")
+    common.add_argument("--config", default=DEFAULT_CONFIG)
+    common.add_argument("--mnemonic", default=os.getenv("fund_account_mnemonic"), help="account signing the transactions")
+    common.add_argument("--timings", action="store_true", help="print startup and per-phase times to stderr")
+
+    cli = argparse.ArgumentParser(prog="cli.py", description="Compile, deploy and buy IPFS sales")
+    commands = cli.add_subparsers(dest="command", required=True)
+
+    compile_ = commands.add_parser("compile", parents=[common], help="PyTeal to TEAL, or the sale artifact")
+    compile_.add_argument("module", nargs="?", help="module with approval() and clear(), the step_01 sale if not set")
+    compile_.add_argument("approval_out", nargs="?", help="printed if not set")
+    compile_.add_argument("clear_out", nargs="?")
+    compile_.add_argument("--files", type=int, default=1, help="IPFS keys the sale's global schema has room for")
+    compile_.add_argument("--check-with-algod", action="store_true", default=os.getenv("CHECK_WITH_ALGOD") == "1")
+    compile_.set_defaults(run=cmd_compile)
+
+    sign = commands.add_parser("sign", parents=[common], help="compile a logic signature")
+    sign.add_argument("module", help="module with create(args)")
+    sign.add_argument("outfile")
+    sign.add_argument("contract_args", nargs="*")
+    sign.add_argument("--check-with-algod", action="store_true", default=os.getenv("CHECK_WITH_ALGOD") == "1")
+    sign.set_defaults(run=cmd_sign)
+
+    deploy = commands.add_parser("deploy", parents=[common], help="deploy a step_01 sale")
+    deploy.add_argument("price", type=int, help="microalgos")
+    deploy.add_argument("cids", nargs="+")
+    deploy.add_argument("--buyer", help="also set the sale up for this buyer")
+    deploy.set_defaults(run=cmd_deploy)
+
+    list_ = commands.add_parser("list", parents=[common], help="set a deployed sale up for a buyer")
+    list_.add_argument("app_id", type=int)
+    list_.add_argument("buyer")
+    list_.add_argument("price", type=int, help="microalgos")
+    list_.add_argument("cids", nargs="+")
+    list_.set_defaults(run=cmd_list)
+
+    buy = commands.add_parser("buy", parents=[common], help="buy sales set up for this account")
+    buy.add_argument("app_ids", type=int, nargs="+")
+    buy.add_argument("--budget-app", type=int, help="app called for extra opcode budget")
+    buy.add_argument("--checkout", action="store_true", help="buy every sale in one atomic group")
+    buy.set_defaults(run=cmd_buy)
+
+    state = commands.add_parser("state", parents=[common], help="print the global state of an app")
+    state.add_argument("app_id", type=int)
+    state.set_defaults(run=cmd_state)
+    return cli
+
+
+def main(argv=None):
+    cli = parser()
+    args = cli.parse_args(argv)
+    timings = Timings(args.timings)
+    try:
+        code = args.run(args, timings)
+    except (FileNotFoundError, ValueError) as e:
+        timings.report()
+        cli.exit(1, "{} {}: error: {}\n".format(cli.prog, args.command, e))
+    timings.report()
+    return code or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
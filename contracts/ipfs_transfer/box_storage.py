@@ -0,0 +1,183 @@
+from pyteal import *
+from pyteal_helpers.cache import CompileCache
+from pyteal_helpers.program import event
+from test_utils import dump_teal, compile_contract, DIGEST_SIZE, DIGESTS_PER_BOX, BOX_SIZE, MAX_GROUP_SIZE
+
+# Same sale as step_01, but the file list lives in application boxes instead of
+# global state, so a listing is no longer capped by the 64 global state entries.
+#
+# setup:     creator, args [price, num_files], accounts [buyer]
+# put_chunk: creator, args ["put_chunk", box index, up to 32 packed digests]
+# box_refs:  anyone, args ["box_refs"], only carries extra box references for the group
+# purchase:  buyer, accounts [seller], right after its payment to the app
+#
+# The price and the box minimum balance go to the creator, the seller account
+# is only listed so that the inner payments can reach it
+
+def approval():
+
+    buyer = Bytes("buyer")
+    payment_amount = Bytes("payment_amount")
+    num_files = Bytes("num_files")
+    i = ScratchVar(TealType.uint64)
+
+    # Box names are the box index as 2 bytes
+    def box_name(index):
+        return Extract(Itob(index), Int(6), Int(2))
+
+    def box_count():
+        return (App.globalGet(num_files) + Int(DIGESTS_PER_BOX - 1)) / Int(DIGESTS_PER_BOX)
+
+    # Every box is full except the last one, which holds the remaining digests
+    def box_length(index):
+        return If(
+            index < box_count() - Int(1),
+            Int(BOX_SIZE),
+            App.globalGet(num_files) * Int(DIGEST_SIZE) - index * Int(BOX_SIZE)
+        )
+
+    @Subroutine(TealType.none)
+    def transfer_funds_to_owner():
+        return Seq(
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: Global.creator_address(),
+                    TxnField.amount: App.globalGet(payment_amount),
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            ),
+            InnerTxnBuilder.Submit()
+        )
+
+    # One inner payment per box, each box is read straight into a note; an
+    # inner group holds 16 of them at most, so the notes may take several
+    @Subroutine(TealType.none)
+    def send_files():
+        contents = App.box_get(box_name(i.load()))
+        return Seq(
+                InnerTxnBuilder.Begin(),
+                For(i.store(Int(0)), i.load() < box_count(), i.store(i.load() + Int(1)))
+                .Do(
+                    Seq(
+                        contents,
+                        Assert(contents.hasValue()),
+                        If(i.load() % Int(MAX_GROUP_SIZE) == Int(0))
+                        .Then(
+                            If(i.load() > Int(0), Seq(InnerTxnBuilder.Submit(), InnerTxnBuilder.Begin()))
+                        )
+                        .Else(
+                            InnerTxnBuilder.Next()
+                        ),
+                        InnerTxnBuilder.SetFields(
+                            {
+                                TxnField.type_enum: TxnType.Payment,
+                                TxnField.receiver: Txn.accounts[0],
+                                TxnField.amount: Int(0),
+                                TxnField.note: contents.value(),
+                                TxnField.fee: Int(0)  # use fee pooling
+                            }
+                        ),
+                    )
+                ),
+                InnerTxnBuilder.Submit()
+            )
+
+    # Deleting the boxes frees their minimum balance, which goes back to the seller
+    @Subroutine(TealType.none)
+    def close_sale():
+        return Seq(
+            For(i.store(Int(0)), i.load() < box_count(), i.store(i.load() + Int(1)))
+            .Do(
+                Pop(App.box_delete(box_name(i.load())))
+            ),
+            App.globalDel(num_files),
+            App.globalDel(payment_amount),
+            App.globalDel(buyer),
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: Global.creator_address(),
+                    TxnField.amount: Balance(Global.current_application_address())
+                        - MinBalance(Global.current_application_address()),
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            ),
+            InnerTxnBuilder.Submit()
+        )
+
+    setup_shop = Seq(
+        [
+            App.globalPut(buyer, Txn.accounts[1]),
+            App.globalPut(payment_amount, Btoi(Txn.application_args[0])),
+            App.globalPut(num_files, Btoi(Txn.application_args[1])),
+            Approve()
+        ]
+    )
+
+    put_chunk = Seq(
+        [
+            i.store(Btoi(Txn.application_args[1])),
+            Assert(
+                And(
+                    i.load() < box_count(),
+                    Len(Txn.application_args[2]) == box_length(i.load())
+                )
+            ),
+            App.box_put(box_name(i.load()), Txn.application_args[2]),
+            Approve()
+        ]
+    )
+
+    payment = Gtxn[Txn.group_index() - Int(1)]
+    handle_purchase = Seq(
+            [
+                Assert(
+                    And(
+                        # The transaction right before the call pays the app
+                        Txn.group_index() > Int(0),
+                        payment.type_enum() == TxnType.Payment,
+                        payment.sender() == Txn.sender(),
+                        payment.receiver() == Global.current_application_address(),
+                        payment.amount() >= App.globalGet(payment_amount),
+                        # app call + seller payment + one note per box + refund
+                        Txn.fee() >= Global.min_txn_fee() * (box_count() + Int(3))
+                    )
+                ),
+                transfer_funds_to_owner(),
+                send_files(),
+                close_sale(),
+                Approve()
+            ]
+        )
+
+    event_loop = event(
+        init=Seq(
+        [
+            Approve()
+        ]
+    ), no_op=Cond(
+        [Txn.application_args.length() == Int(1), Return(Txn.application_args[0] == Bytes("box_refs"))],
+        [Txn.accounts[0] == Global.creator_address(),
+            If(Txn.application_args.length() == Int(3), put_chunk, setup_shop)],
+        [Txn.accounts[0] == App.globalGet(buyer), handle_purchase]
+    ))
+    return compileTeal(event_loop, Mode.Application, version=MAX_TEAL_VERSION)
+
+def clear():
+    return compileTeal(Reject(), Mode.Application, version=MAX_TEAL_VERSION)
+
+def compile_ipfs_boxes(client, cache=None, check_with_algod=False):
+    if cache is None:
+        cache = CompileCache()
+
+    approval_teal = cache.teal(approval)
+    clear_teal = cache.teal(clear)
+
+    dump_teal('ipfs_boxes_approval.teal', approval_teal)
+    dump_teal('ipfs_boxes_clear.teal', clear_teal)
+
+    # The file list lives in boxes, so the schema no longer depends on num_files
+    compile_contract(client, approval_teal, clear_teal, 'ipfs_boxes.artifact', (2, 1), (0, 0), cache, check_with_algod)
@@ -1,7 +1,19 @@
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from algosdk import account, encoding, mnemonic
 from algosdk.future import transaction
-from test_utils import get_algod_client, app_signed_txn, wait_for_txn_confirm, load_compiled, load_schema, ipfscidv0_to_byte32
+from test_utils import get_algod_client, app_signed_txn, sign_txn, wait_for_txn_confirm, wait_for_txns_confirm, load_artifact, pack_digests, num_slots, MAX_GROUP_SIZE
+from test_utils import box_name, box_min_balance, num_boxes, pack_box_chunks, DIGESTS_PER_SLOT, MerkleTree
+from test_utils import cids_to_digests, listing_box_name, listing_box_size, listing_min_balance, DIGEST_SIZE, DIGESTS_PER_BOX
+
+MAX_APP_ARGS = 16
+# Slots one setup or append call stores within its own opcode budget, see
+# contracts.ipfs_transfer.profile.slots_per_call; its args would carry 14
+SLOTS_PER_CALL = 11
+# Foreign references (accounts, apps, assets and boxes) allowed on one app call
+MAX_APP_CALL_REFS = 8
 
 def deploy_ipfs_app(client, priv_key, approval_prog, clear_prog, global_schema, local_schema, app_args):
     
@@ -43,22 +55,34 @@ def deploy_ipfs_app(client, priv_key, approval_prog, clear_prog, global_schema,
     return app_id
     
 
-def deploy_ipfs(algod_address, algod_token, creator_mnemonic, num_items, sum_item_cost, list_ipfs_keys):
+@lru_cache(maxsize=None)
+def load_sale_template():
+    """
+    Compiled step_01 programs and local schema, read from ./build/ipfs_transfer.artifact
+    once per process
+    
+    Returns:
+        tuple: (approval program, clear program, local schema)
+    """
+    artifact = load_artifact('ipfs_transfer.artifact')
+    return artifact.approval, artifact.clear, artifact.local_schema
+
+def sale_global_schema(num_files):
+    # payment_amount, num_files, uploaded / buyer and the digest slots, as written by compile_ipfs
+    return transaction.StateSchema(3, num_slots(num_files) + 1)
+
+def deploy_ipfs(algod_address, algod_token, creator_mnemonic, num_items, sum_item_cost, list_ipfs_keys, buyer_address=None):
     priv_key = mnemonic.to_private_key(creator_mnemonic)
     algod_client = get_algod_client(algod_token, algod_address)
     
-    approval_prog = load_compiled(file_path='ipfs_transfer_approval.compiled')
-    clear_prog = load_compiled(file_path='ipfs_transfer_clear.compiled')
-    
-    global_schema = load_schema(file_path='global_schema')
-    local_schema = load_schema(file_path='local_schema')
+    approval_prog, clear_prog, local_schema = load_sale_template()
+    # Sized for this listing, the artifact's schema only fits the num_files it was compiled for
+    global_schema = sale_global_schema(len(list_ipfs_keys))
     
+    # The keys are uploaded by the setup/append calls, they'd only hit the arg limit here
     app_args = []
     app_args.append(num_items)
     app_args.append(sum_item_cost)
-
-    for file_key in list_ipfs_keys:
-        app_args.append(ipfscidv0_to_byte32(file_key))
     print(app_args)
     
     app_id = deploy_ipfs_app(
@@ -71,4 +95,534 @@ def deploy_ipfs(algod_address, algod_token, creator_mnemonic, num_items, sum_ite
         app_args
     )
     
-    return app_id
\ No newline at end of file
+    if buyer_address is not None:
+        upload_listing(algod_client, priv_key, app_id, buyer_address, sum_item_cost, list_ipfs_keys)
+    
+    return app_id
+
+def mass_deploy_ipfs(client, listings, timeout=5, max_workers=8):
+    """
+    Deploys one step_01 sale app per listing: up to 16 app creations per atomic
+    group, every group submitted concurrently, then one wait for all of them.
+    Listings that name a buyer are then set up the same way, with the calls of
+    one listing never split over two groups
+    
+    Args:
+        client (AlgodClient): algod client, shared by the submitting threads
+        listings (list): (seller private key, price, IPFS CIDs) tuples, with the
+            buyer address as an optional fourth item
+        timeout (int): rounds to wait for the groups
+        max_workers (int): groups submitted at the same time
+    Returns:
+        list: app ids, in listing order
+    """
+    approval_prog, clear_prog, local_schema = load_sale_template()
+    params = client.suggested_params()
+    
+    creates = []
+    for listing in listings:
+        priv_key, sum_item_cost, list_ipfs_keys = listing[:3]
+        creates.append((priv_key, transaction.ApplicationCreateTxn(
+            account.address_from_private_key(priv_key),
+            params,
+            transaction.OnComplete.NoOpOC.real,
+            approval_prog,
+            clear_prog,
+            sale_global_schema(len(list_ipfs_keys)),
+            local_schema,
+            [len(list_ipfs_keys), sum_item_cost],
+            # Otherwise identical listings of one seller would have the same txid
+            note=os.urandom(8)
+        )))
+    groups = [creates[start:start + MAX_GROUP_SIZE] for start in range(0, len(creates), MAX_GROUP_SIZE)]
+    confirmed = wait_for_txns_confirm(client, submit_groups(client, groups, max_workers), timeout, params.first)
+    app_ids = [confirmed[txn.get_txid()].info['application-index'] for _, txn in creates]
+    
+    setups = []
+    for app_id, listing in zip(app_ids, listings):
+        if len(listing) > 3 and listing[3] is not None:
+            priv_key, sum_item_cost, list_ipfs_keys, buyer_address = listing
+            seller_address = account.address_from_private_key(priv_key)
+            txns = listing_txns(params, seller_address, app_id, buyer_address, sum_item_cost, list_ipfs_keys)
+            setups.append([(priv_key, txn) for txn in txns])
+    groups = []
+    for calls in setups:
+        if not groups or len(groups[-1]) + len(calls) > MAX_GROUP_SIZE:
+            groups.append([])
+        groups[-1].extend(calls)
+    if groups:
+        wait_for_txns_confirm(client, submit_groups(client, groups, max_workers), timeout, params.first)
+    return app_ids
+
+def submit_groups(client, groups, max_workers=8):
+    """
+    Signs and submits atomic groups from a thread pool, each transaction with
+    its own sender's key
+    
+    Args:
+        client (AlgodClient): algod client
+        groups (list): lists of (private key, unsigned transaction) tuples
+        max_workers (int): groups submitted at the same time
+    Returns:
+        list: ids of every submitted transaction
+    """
+    signed_groups = []
+    for group in groups:
+        txns = [txn for _, txn in group]
+        if len(txns) > 1:
+            transaction.assign_group_id(txns)
+        signed_groups.append([sign_txn(txn, priv_key) for priv_key, txn in group])
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(client.send_transactions, signed_groups))
+    return [signed.transaction.get_txid() for group in signed_groups for signed in group]
+
+def listing_txns(params, seller_address, app_id, buyer_address, sum_item_cost, list_ipfs_keys):
+    """
+    Splits a listing into a setup call followed by as many append calls as needed
+    
+    Args:
+        params (SuggestedParams): parameters obtained from algod
+        seller_address (str): creator of the app
+        app_id (int): sale app
+        buyer_address (str): only account allowed to buy
+        sum_item_cost (int): price of the whole listing
+        list_ipfs_keys (list): IPFS CIDs to sell
+    Returns:
+        list: unsigned NoOp transactions, setup first
+    """
+    slots = pack_digests(list_ipfs_keys)
+    # Every call pays for its own slots, a setup sent alone has no budget to pool
+    per_call = SLOTS_PER_CALL
+    
+    txns = [transaction.ApplicationNoOpTxn(
+        seller_address,
+        params,
+        app_id,
+        [sum_item_cost, len(list_ipfs_keys)] + slots[:per_call],
+        [buyer_address]
+    )]
+    for start in range(per_call, len(slots), per_call):
+        txns.append(transaction.ApplicationNoOpTxn(
+            seller_address,
+            params,
+            app_id,
+            ["append", start * DIGESTS_PER_SLOT] + slots[start:start + per_call]
+        ))
+    return txns
+
+def upload_listing(client, priv_key, app_id, buyer_address, sum_item_cost, list_ipfs_keys):
+    """
+    Sets up a sale with any number of keys, see listing_txns
+    
+    Returns:
+        list: the transactions sent, confirmed
+    """
+    seller_address = account.address_from_private_key(priv_key)
+    txns = listing_txns(
+        client.suggested_params(),
+        seller_address,
+        app_id,
+        buyer_address,
+        sum_item_cost,
+        list_ipfs_keys
+    )
+    send_grouped(client, priv_key, txns)
+    return txns
+
+def send_grouped(client, priv_key, txns, timeout=5):
+    """
+    Signs txns in atomic groups of up to 16 and submits every group back to back
+    before waiting, so that a whole upload lands in as few blocks as possible
+    
+    Args:
+        client (AlgodClient): algod client
+        priv_key (str): private key of the sender of every txn
+        txns (list): unsigned transactions, in order
+        timeout (int): rounds to wait for each group
+    Returns:
+        list: ids of the last transaction of every group
+    """
+    groups = [txns[start:start + MAX_GROUP_SIZE] for start in range(0, len(txns), MAX_GROUP_SIZE)]
+    return send_groups(client, priv_key, groups, timeout)
+
+def send_groups(client, priv_key, groups, timeout=5):
+    """
+    send_grouped for groups that are already split, e.g. because each one has to
+    carry its own box references
+    
+    Args:
+        groups (list): lists of unsigned transactions, one per atomic group
+    Returns:
+        list: ids of the last transaction of every group
+    """
+    last_ids = []
+    for group in groups:
+        if len(group) > 1:
+            transaction.assign_group_id(group)
+        signed_group = [sign_txn(txn, priv_key) for txn in group]
+        client.send_transactions(signed_group)
+        last_ids.append(signed_group[-1].transaction.get_txid())
+    
+    # One block watcher for all groups instead of polling each id in turn
+    submitted_round = min((group[0].first_valid_round for group in groups), default=None)
+    wait_for_txns_confirm(client, last_ids, timeout, submitted_round)
+    return last_ids
+
+# Box storage variant (box_storage.py)
+# Base minimum balance of the app account itself
+APP_ACCOUNT_MIN_BALANCE = 100000
+
+def deploy_ipfs_boxes(algod_address, algod_token, creator_mnemonic):
+    return deploy_variant(algod_address, algod_token, creator_mnemonic, 'ipfs_boxes')
+
+def deploy_variant(algod_address, algod_token, creator_mnemonic, prefix):
+    """
+    Deploys a contract variant compiled to ./build/<prefix>.artifact
+    """
+    priv_key = mnemonic.to_private_key(creator_mnemonic)
+    algod_client = get_algod_client(algod_token, algod_address)
+    
+    artifact = load_artifact(prefix + '.artifact')
+    
+    return deploy_ipfs_app(
+        algod_client,
+        priv_key,
+        artifact.approval,
+        artifact.clear,
+        artifact.global_schema,
+        artifact.local_schema,
+        []
+    )
+
+def app_address(app_id):
+    return encoding.encode_address(encoding.checksum(b'appID' + app_id.to_bytes(8, 'big')))
+
+# Boxes one purchase group references: the purchase call's next to the seller
+# account and the rest on "box_refs" calls after it
+MAX_PURCHASE_BOXES = MAX_APP_CALL_REFS - 1 + (MAX_GROUP_SIZE - 2) * MAX_APP_CALL_REFS
+
+def box_references(num_files):
+    """
+    Box references for every box holding the file list, relative to the called app
+    
+    Args:
+        num_files (int): number of files in the listing
+    Returns:
+        list: (0, box name) tuples
+    """
+    return [(0, box_name(index)) for index in range(num_boxes(num_files))]
+
+def setup_box_shop(client, priv_key, app_id, buyer_address, sum_item_cost, list_ipfs_keys):
+    """
+    Lists the files of a box storage sale: funds the box minimum balance, sets up the
+    sale and uploads one box per call, in groups of up to 16 transactions
+    
+    Args:
+        client (AlgodClient): algod client
+        priv_key (str): private key of the app creator (seller)
+        app_id (int): box storage sale app
+        buyer_address (str): only account allowed to buy
+        sum_item_cost (int): price of the whole listing
+        list_ipfs_keys (list): IPFS CIDs to sell
+    Returns:
+        list: ids of the last transaction of every group
+    Raises:
+        ValueError: if the purchase could not reference every box
+    """
+    seller_address = account.address_from_private_key(priv_key)
+    params = client.suggested_params()
+    num_files = len(list_ipfs_keys)
+    if num_boxes(num_files) > MAX_PURCHASE_BOXES:
+        raise ValueError('{} files need more box references than one group can carry'.format(num_files))
+    
+    txns = [
+        transaction.PaymentTxn(
+            seller_address,
+            params,
+            app_address(app_id),
+            APP_ACCOUNT_MIN_BALANCE + box_min_balance(num_files)
+        ),
+        transaction.ApplicationNoOpTxn(
+            seller_address,
+            params,
+            app_id,
+            [sum_item_cost, num_files],
+            [buyer_address]
+        ),
+    ]
+    for index, chunk in enumerate(pack_box_chunks(list_ipfs_keys)):
+        txns.append(transaction.ApplicationNoOpTxn(
+            seller_address,
+            params,
+            app_id,
+            ["put_chunk", index, chunk],
+            boxes=[(0, box_name(index))]
+        ))
+    
+    return send_grouped(client, priv_key, txns)
+
+def box_purchase_txns(params, buyer_address, seller_address, app_id, sum_item_cost, num_files, payment_extra=0):
+    """
+    Builds the grouped purchase of a box storage sale, adding "box_refs" calls
+    when the box references don't fit on the purchase call itself
+    
+    Args:
+        params (SuggestedParams): parameters obtained from algod
+        buyer_address (str): buyer, must match the app's buyer
+        seller_address (str): receives the payment
+        app_id (int): box storage sale app
+        sum_item_cost (int): price of the listing
+        num_files (int): number of files in the listing
+        payment_extra (int): paid on top of the price, e.g. to fund the app account
+    Returns:
+        list: unsigned transactions with the group id set, [payment, purchase, refs...]
+    """
+    boxes = box_references(num_files)
+    # The seller account takes one of the purchase call's references
+    first = MAX_APP_CALL_REFS - 1
+    
+    txn_pay = transaction.PaymentTxn(buyer_address, params, app_address(app_id), sum_item_cost + payment_extra)
+    txn_noop = transaction.ApplicationNoOpTxn(
+        buyer_address,
+        params,
+        app_id,
+        accounts=[seller_address],
+        boxes=boxes[:first]
+    )
+    txns = [txn_pay, txn_noop]
+    for start in range(first, len(boxes), MAX_APP_CALL_REFS):
+        txns.append(transaction.ApplicationNoOpTxn(
+            buyer_address,
+            params,
+            app_id,
+            ["box_refs"],
+            boxes=boxes[start:start + MAX_APP_CALL_REFS]
+        ))
+    if len(txns) > MAX_GROUP_SIZE:
+        raise ValueError('{} files need more box references than one group can carry'.format(num_files))
+    
+    # Purchase call pays for itself, the seller payment, one note per box and the refund
+    txn_noop.fee = max(params.min_fee, params.fee) * (len(boxes) + 3)
+    transaction.assign_group_id(txns)
+    return txns
+
+
+# Merkle root commitment variant (merkle_root.py)
+
+def deploy_ipfs_merkle(algod_address, algod_token, creator_mnemonic):
+    return deploy_variant(algod_address, algod_token, creator_mnemonic, 'ipfs_merkle')
+
+def setup_merkle_shop(client, priv_key, app_id, buyer_address, sum_item_cost, list_ipfs_keys):
+    """
+    Commits a listing by its Merkle root, a single call whatever the number of keys
+    
+    Args:
+        client (AlgodClient): algod client
+        priv_key (str): private key of the app creator (seller)
+        app_id (int): merkle root sale app
+        buyer_address (str): only account allowed to buy
+        sum_item_cost (int): price of the whole listing
+        list_ipfs_keys (list): IPFS CIDs to sell
+    Returns:
+        MerkleTree: the committed tree, to hand the list and proofs over off-chain
+    """
+    seller_address = account.address_from_private_key(priv_key)
+    tree = MerkleTree(list_ipfs_keys)
+    txn = transaction.ApplicationNoOpTxn(
+        seller_address,
+        client.suggested_params(),
+        app_id,
+        [sum_item_cost, tree.num_leaves, tree.root],
+        [buyer_address]
+    )
+    send_grouped(client, priv_key, [txn])
+    return tree
+
+
+# Marketplace variant (marketplace.py)
+# Bytes of box reads and writes each box reference pays for
+BOX_IO_PER_REF = 1024
+# App args are limited to 2KB in total, leaving room for 63 digests next to
+# "list"/"put" and their integer arguments
+DIGESTS_PER_LISTING_CALL = 63
+
+def deploy_ipfs_marketplace(algod_address, algod_token, creator_mnemonic):
+    """
+    Deploys the marketplace once and funds the minimum balance of its account,
+    listings are then added with create_listing without any further deploy
+    """
+    app_id = deploy_variant(algod_address, algod_token, creator_mnemonic, 'ipfs_marketplace')
+    priv_key = mnemonic.to_private_key(creator_mnemonic)
+    client = get_algod_client(algod_token, algod_address)
+    funding = transaction.PaymentTxn(
+        account.address_from_private_key(priv_key),
+        client.suggested_params(),
+        app_address(app_id),
+        APP_ACCOUNT_MIN_BALANCE
+    )
+    send_grouped(client, priv_key, [funding])
+    return app_id
+
+def listing_box_refs(num_files):
+    """
+    Box references a group touching a listing needs, every one naming the listing
+    box since the I/O budget they grant is pooled over the group
+    """
+    return -(-listing_box_size(num_files) // BOX_IO_PER_REF)
+
+def with_listing_refs(params, sender, app_id, listing_id, num_files, calls, first_group=()):
+    """
+    Splits listing calls into atomic groups that each carry enough references
+    to the listing box, adding "box_refs" calls where the calls alone fall short
+    
+    Args:
+        params (SuggestedParams): parameters for the added "box_refs" calls
+        sender (str): sender of the added calls
+        app_id (int): marketplace app
+        listing_id (int): listing the calls touch
+        num_files (int): number of files in the listing
+        calls (list): (app call, references it can still carry) tuples, in order
+        first_group (list): transactions to put ahead of the first group, e.g. payments
+    Returns:
+        list: groups of unsigned transactions
+    """
+    needed = listing_box_refs(num_files)
+    name = listing_box_name(listing_id)
+    
+    def close(group, refs):
+        while refs < needed:
+            count = min(MAX_APP_CALL_REFS, needed - refs)
+            group.append(transaction.ApplicationNoOpTxn(
+                sender, params, app_id, ["box_refs"], boxes=[(0, name)] * count
+            ))
+            refs += count
+        return group
+    
+    groups = []
+    group, refs = list(first_group), 0
+    for call, capacity in calls:
+        count = min(capacity, max(needed - refs, 1))
+        carriers = -(-max(needed - refs - count, 0) // MAX_APP_CALL_REFS)
+        if group and len(group) + 1 + carriers > MAX_GROUP_SIZE:
+            groups.append(close(group, refs))
+            group, refs = [], 0
+            count = min(capacity, needed)
+        call.boxes = transaction.BoxReference.translate_box_references([(0, name)] * count, [], app_id)
+        group.append(call)
+        refs += count
+    groups.append(close(group, refs))
+    for group in groups:
+        if len(group) > MAX_GROUP_SIZE:
+            raise ValueError('{} files need more box references than one group can carry'.format(num_files))
+    return groups
+
+def listing_groups(params, seller_address, app_id, listing_id, buyer_address, price, list_ipfs_keys):
+    """
+    Builds the groups create_listing sends: the payment of the listing box
+    minimum balance and the "list" call, then "put" calls for the digests that
+    don't fit the first call
+    
+    Args:
+        params (SuggestedParams): parameters obtained from algod
+        seller_address (str): seller of the listing
+        app_id (int): marketplace app
+        listing_id (int): unused listing id
+        buyer_address (str): only account allowed to buy, None lets anyone buy
+        price (int): price of the whole listing
+        list_ipfs_keys (list): IPFS CIDs to sell
+    Returns:
+        list: groups of unsigned transactions
+    """
+    num_files = len(list_ipfs_keys)
+    digests = cids_to_digests(list_ipfs_keys, as_buffer=True)
+    chunk = DIGESTS_PER_LISTING_CALL * DIGEST_SIZE
+    if buyer_address is None:
+        buyer_address = encoding.encode_address(bytes(32))
+    
+    funding = transaction.PaymentTxn(seller_address, params, app_address(app_id), listing_min_balance(num_files))
+    # The buyer account takes one of the list call's references
+    calls = [(transaction.ApplicationNoOpTxn(
+        seller_address,
+        params,
+        app_id,
+        ["list", listing_id, price, num_files, digests[:chunk]],
+        [buyer_address]
+    ), MAX_APP_CALL_REFS - 1)]
+    for start in range(chunk, len(digests), chunk):
+        calls.append((transaction.ApplicationNoOpTxn(
+            seller_address,
+            params,
+            app_id,
+            ["put", listing_id, start // DIGEST_SIZE, digests[start:start + chunk]]
+        ), MAX_APP_CALL_REFS))
+    
+    return with_listing_refs(params, seller_address, app_id, listing_id, num_files, calls, [funding])
+
+def create_listing(client, priv_key, app_id, listing_id, buyer_address, price, list_ipfs_keys):
+    """
+    Lists files on the marketplace, see listing_groups.
+    Up to 63 files take a single group of two transactions
+    
+    Args:
+        client (AlgodClient): algod client
+        priv_key (str): private key of the seller
+        app_id (int): marketplace app
+        listing_id (int): unused listing id
+        buyer_address (str): only account allowed to buy, None lets anyone buy
+        price (int): price of the whole listing
+        list_ipfs_keys (list): IPFS CIDs to sell
+    Returns:
+        list: ids of the last transaction of every group
+    """
+    seller_address = account.address_from_private_key(priv_key)
+    groups = listing_groups(client.suggested_params(), seller_address, app_id, listing_id, buyer_address, price,
+        list_ipfs_keys)
+    return send_groups(client, priv_key, groups)
+
+def listing_purchase_txns(params, buyer_address, seller_address, app_id, listing_id, price, num_files):
+    """
+    Builds the purchase of a marketplace listing, the payment followed by the
+    "buy" call and any "box_refs" calls it needs. The group id is not set, so
+    purchases can be combined in one group
+    
+    Args:
+        params (SuggestedParams): parameters obtained from algod
+        buyer_address (str): buyer, must match the listing's buyer unless it is open
+        seller_address (str): seller of the listing
+        app_id (int): marketplace app
+        listing_id (int): listing to buy
+        price (int): price of the listing
+        num_files (int): number of files in the listing
+    Returns:
+        list: unsigned transactions, [payment, buy, refs...]
+    """
+    txn_pay = transaction.PaymentTxn(buyer_address, params, app_address(app_id), price)
+    txn_buy = transaction.ApplicationNoOpTxn(
+        buyer_address,
+        params,
+        app_id,
+        ["buy", listing_id],
+        [seller_address]
+    )
+    # buy call + seller payment + one note per 32 files + refund
+    txn_buy.fee = max(params.min_fee, params.fee) * (-(-num_files // DIGESTS_PER_BOX) + 3)
+    # The seller account takes one of the buy call's references
+    groups = with_listing_refs(params, buyer_address, app_id, listing_id, num_files,
+        [(txn_buy, MAX_APP_CALL_REFS - 1)], [txn_pay])
+    if len(groups) > 1:
+        raise ValueError('{} files need more box references than one group can carry'.format(num_files))
+    return groups[0]
+
+def cancel_listing(client, priv_key, app_id, listing_id, num_files):
+    """
+    Takes a listing down and refunds its box minimum balance to the seller
+    """
+    seller_address = account.address_from_private_key(priv_key)
+    params = client.suggested_params()
+    txn_cancel = transaction.ApplicationNoOpTxn(seller_address, params, app_id, ["cancel", listing_id])
+    # cancel call + refund
+    txn_cancel.fee = max(params.min_fee, params.fee) * 2
+    groups = with_listing_refs(params, seller_address, app_id, listing_id, num_files,
+        [(txn_cancel, MAX_APP_CALL_REFS)])
+    return send_groups(client, priv_key, groups)
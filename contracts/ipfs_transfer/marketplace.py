@@ -0,0 +1,263 @@
+from pyteal import *
+from pyteal_helpers.cache import CompileCache
+from pyteal_helpers.program import event
+from test_utils import dump_teal, compile_contract, DIGEST_SIZE, DIGESTS_PER_BOX, BOX_SIZE, \
+    BOX_FLAT_MIN_BALANCE, BOX_BYTE_MIN_BALANCE, LISTING_NAME_SIZE, LISTING_HEADER_SIZE, MAX_GROUP_SIZE
+
+# Marketplace variant of step_01: one deployed app holds any number of concurrent
+# listings, each in its own box named by an 8 byte listing id (see
+# test_utils.ipfs_utils for the layout). Listing, buying and cancelling are
+# single app calls, no app is created or deleted per sale.
+#
+# list:     seller, args ["list", listing id, price, num_files, first digests],
+#           accounts [buyer], the zero address lets anyone buy; grouped right
+#           after the seller's payment of the listing box minimum balance
+# put:      seller, args ["put", listing id, first file index, packed digests],
+#           continuing where the previous list or put call stopped
+# buy:      buyer, args ["buy", listing id], accounts [seller]; grouped right
+#           after its payment of the price to the app account, once every
+#           digest is uploaded
+# cancel:   seller, args ["cancel", listing id]
+# box_refs: anyone, args ["box_refs"], only carries extra box references for the group
+
+SELLER_OFFSET = 0
+BUYER_OFFSET = 32
+PRICE_OFFSET = 64
+NUM_FILES_OFFSET = 72
+UPLOADED_OFFSET = 80
+
+def approval():
+
+    listing = ScratchVar(TealType.bytes)
+    num_files = ScratchVar(TealType.uint64)
+    i = ScratchVar(TealType.uint64)
+
+    def header(offset, length):
+        return App.box_extract(listing.load(), Int(offset), Int(length))
+
+    def seller():
+        return header(SELLER_OFFSET, 32)
+
+    def buyer():
+        return header(BUYER_OFFSET, 32)
+
+    def price():
+        return Btoi(header(PRICE_OFFSET, 8))
+
+    def uploaded():
+        return Btoi(header(UPLOADED_OFFSET, 8))
+
+    def note_count():
+        return (num_files.load() + Int(DIGESTS_PER_BOX - 1)) / Int(DIGESTS_PER_BOX)
+
+    # Every note is full except the last one, which holds the remaining digests
+    def note_length(index):
+        return If(
+            index < note_count() - Int(1),
+            Int(BOX_SIZE),
+            num_files.load() * Int(DIGEST_SIZE) - index * Int(BOX_SIZE)
+        )
+
+    def listing_min_balance():
+        return Int(BOX_FLAT_MIN_BALANCE) + Int(BOX_BYTE_MIN_BALANCE) * (
+            Int(LISTING_NAME_SIZE + LISTING_HEADER_SIZE) + num_files.load() * Int(DIGEST_SIZE)
+        )
+
+    # Loads the listing named by args[1], failing if there is none
+    @Subroutine(TealType.none)
+    def load_listing():
+        length = App.box_length(listing.load())
+        return Seq(
+            listing.store(Txn.application_args[1]),
+            Assert(Len(listing.load()) == Int(LISTING_NAME_SIZE)),
+            length,
+            Assert(length.hasValue()),
+            num_files.store(Btoi(header(NUM_FILES_OFFSET, 8)))
+        )
+
+    # Writes packed digests from file index first onwards, within the listing,
+    # and counts them as uploaded; first has to be the count so far
+    @Subroutine(TealType.none)
+    def put_digests(first, digests):
+        return Seq(
+            Assert(
+                And(
+                    first == uploaded(),
+                    Len(digests) % Int(DIGEST_SIZE) == Int(0),
+                    first * Int(DIGEST_SIZE) + Len(digests) <= num_files.load() * Int(DIGEST_SIZE)
+                )
+            ),
+            App.box_replace(listing.load(), Int(LISTING_HEADER_SIZE) + first * Int(DIGEST_SIZE), digests),
+            App.box_replace(listing.load(), Int(UPLOADED_OFFSET), Itob(first + Len(digests) / Int(DIGEST_SIZE)))
+        )
+
+    # Deletes the listing and gives its box minimum balance back to the seller,
+    # inside the inner group already begun
+    @Subroutine(TealType.none)
+    def close_listing(receiver):
+        return Seq(
+            Pop(App.box_delete(listing.load())),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: receiver,
+                    TxnField.amount: listing_min_balance(),
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            )
+        )
+
+    # Moves to the inner transaction at position, submitting the current inner
+    # group first when it is full
+    def next_inner(position):
+        return If(
+            position % Int(MAX_GROUP_SIZE) == Int(0),
+            Seq(InnerTxnBuilder.Submit(), InnerTxnBuilder.Begin()),
+            InnerTxnBuilder.Next()
+        )
+
+    # Seller payment, one note per 32 digests read straight from the box, refund,
+    # in as many inner groups as they take
+    @Subroutine(TealType.none)
+    def deliver(seller_address, amount):
+        return Seq(
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: seller_address,
+                    TxnField.amount: amount,
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            ),
+            For(i.store(Int(0)), i.load() < note_count(), i.store(i.load() + Int(1)))
+            .Do(
+                Seq(
+                    next_inner(i.load() + Int(1)),
+                    InnerTxnBuilder.SetFields(
+                        {
+                            TxnField.type_enum: TxnType.Payment,
+                            TxnField.receiver: Txn.sender(),
+                            TxnField.amount: Int(0),
+                            TxnField.note: App.box_extract(
+                                listing.load(),
+                                Int(LISTING_HEADER_SIZE) + i.load() * Int(BOX_SIZE),
+                                note_length(i.load())
+                            ),
+                            TxnField.fee: Int(0)  # use fee pooling
+                        }
+                    )
+                )
+            ),
+            next_inner(note_count() + Int(1)),
+            close_listing(seller_address),
+            InnerTxnBuilder.Submit()
+        )
+
+    payment = Gtxn[Txn.group_index() - Int(1)]
+    create_listing = Seq(
+        [
+            listing.store(Txn.application_args[1]),
+            num_files.store(Btoi(Txn.application_args[3])),
+            Assert(
+                And(
+                    Len(listing.load()) == Int(LISTING_NAME_SIZE),
+                    num_files.load() > Int(0),
+                    # The seller funds the listing box right before this call
+                    Txn.group_index() > Int(0),
+                    payment.type_enum() == TxnType.Payment,
+                    payment.sender() == Txn.sender(),
+                    payment.receiver() == Global.current_application_address(),
+                    payment.amount() >= listing_min_balance()
+                )
+            ),
+            # Fails if the listing id is taken
+            Assert(App.box_create(listing.load(), Int(LISTING_HEADER_SIZE) + num_files.load() * Int(DIGEST_SIZE))),
+            App.box_replace(
+                listing.load(),
+                Int(SELLER_OFFSET),
+                Concat(
+                    Txn.sender(),
+                    Txn.accounts[1],
+                    Itob(Btoi(Txn.application_args[2])),
+                    Itob(num_files.load())
+                )
+            ),
+            put_digests(Int(0), Txn.application_args[4]),
+            Approve()
+        ]
+    )
+
+    put_listing = Seq(
+        [
+            load_listing(),
+            Assert(Txn.sender() == seller()),
+            put_digests(Btoi(Txn.application_args[2]), Txn.application_args[3]),
+            Approve()
+        ]
+    )
+
+    buy_listing = Seq(
+        [
+            load_listing(),
+            Assert(
+                And(
+                    uploaded() == num_files.load(),
+                    Txn.group_index() > Int(0),
+                    Or(buyer() == Global.zero_address(), buyer() == Txn.sender()),
+                    Txn.accounts[1] == seller(),
+                    # The payment of the price to the app comes right before this call
+                    payment.type_enum() == TxnType.Payment,
+                    payment.sender() == Txn.sender(),
+                    payment.receiver() == Global.current_application_address(),
+                    payment.amount() >= price(),
+                    # buy call + seller payment + one note per 32 files + refund
+                    Txn.fee() >= Global.min_txn_fee() * (note_count() + Int(3))
+                )
+            ),
+            deliver(Txn.accounts[1], price()),
+            Approve()
+        ]
+    )
+
+    cancel_listing = Seq(
+        [
+            load_listing(),
+            Assert(Txn.sender() == seller()),
+            InnerTxnBuilder.Begin(),
+            close_listing(Txn.sender()),
+            InnerTxnBuilder.Submit(),
+            Approve()
+        ]
+    )
+
+    method = Txn.application_args[0]
+    event_loop = event(
+        init=Seq(
+        [
+            Approve()
+        ]
+    ), no_op=Cond(
+        [method == Bytes("box_refs"), Approve()],
+        [method == Bytes("list"), create_listing],
+        [method == Bytes("put"), put_listing],
+        [method == Bytes("buy"), buy_listing],
+        [method == Bytes("cancel"), cancel_listing]
+    ))
+    return compileTeal(event_loop, Mode.Application, version=MAX_TEAL_VERSION)
+
+def clear():
+    return compileTeal(Reject(), Mode.Application, version=MAX_TEAL_VERSION)
+
+def compile_ipfs_marketplace(client, cache=None, check_with_algod=False):
+    if cache is None:
+        cache = CompileCache()
+
+    approval_teal = cache.teal(approval)
+    clear_teal = cache.teal(clear)
+
+    dump_teal('ipfs_marketplace_approval.teal', approval_teal)
+    dump_teal('ipfs_marketplace_clear.teal', clear_teal)
+
+    # Listings live in boxes, the app keeps no state of its own
+    compile_contract(client, approval_teal, clear_teal, 'ipfs_marketplace.artifact', (0, 0), (0, 0), cache, check_with_algod)
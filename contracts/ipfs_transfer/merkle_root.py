@@ -0,0 +1,122 @@
+from pyteal import *
+from pyteal_helpers.cache import CompileCache
+from pyteal_helpers.program import event
+from test_utils import dump_teal, compile_contract, HASH_SIZE
+
+# Same sale as step_01, but the seller only commits the Merkle root of the CID list
+# (see test_utils.merkle) and the file count. On-chain state and opcode cost stay
+# constant however many files the listing has; the full list and its proofs are
+# handed over off-chain and checked against the delivered root.
+#
+# setup:     creator, args [price, num_files, root], accounts [buyer]
+# purchase:  buyer, accounts [seller], right after its payment to the app; a
+#            single inner note delivers root || Itob(num_files)
+#
+# The price goes to the creator, the seller account is only listed so that the
+# inner payment can reach it
+
+def approval():
+
+    buyer = Bytes("buyer")
+    payment_amount = Bytes("payment_amount")
+    num_files = Bytes("num_files")
+    root = Bytes("root")
+
+    @Subroutine(TealType.none)
+    def transfer_funds_to_owner():
+        return Seq(
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: Global.creator_address(),
+                    TxnField.amount: App.globalGet(payment_amount),
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            ),
+            InnerTxnBuilder.Submit()
+        )
+
+    @Subroutine(TealType.none)
+    def send_commitment():
+        return Seq(
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: Txn.accounts[0],
+                    TxnField.amount: Int(0),
+                    TxnField.note: Concat(App.globalGet(root), Itob(App.globalGet(num_files))),
+                    TxnField.fee: Int(0)  # use fee pooling
+                }
+            ),
+            InnerTxnBuilder.Submit()
+        )
+
+    @Subroutine(TealType.none)
+    def close_sale():
+        return Seq(
+            App.globalDel(root),
+            App.globalDel(num_files),
+            App.globalDel(payment_amount),
+            App.globalDel(buyer)
+        )
+
+    setup_shop = Seq(
+        [
+            Assert(Len(Txn.application_args[2]) == Int(HASH_SIZE)),
+            App.globalPut(buyer, Txn.accounts[1]),
+            App.globalPut(payment_amount, Btoi(Txn.application_args[0])),
+            App.globalPut(num_files, Btoi(Txn.application_args[1])),
+            App.globalPut(root, Txn.application_args[2]),
+            Approve()
+        ]
+    )
+
+    payment = Gtxn[Txn.group_index() - Int(1)]
+    handle_purchase = Seq(
+            [
+                Assert(
+                    And(
+                        # The transaction right before the call pays the app
+                        Txn.group_index() > Int(0),
+                        payment.type_enum() == TxnType.Payment,
+                        payment.sender() == Txn.sender(),
+                        payment.receiver() == Global.current_application_address(),
+                        payment.amount() >= App.globalGet(payment_amount),
+                        Txn.fee() >= Global.min_txn_fee() * Int(3)
+                    )
+                ),
+                transfer_funds_to_owner(),
+                send_commitment(),
+                close_sale(),
+                Approve()
+            ]
+        )
+
+    event_loop = event(
+        init=Seq(
+        [
+            Approve()
+        ]
+    ), no_op=Cond(
+        [Txn.accounts[0] == Global.creator_address(), setup_shop],
+        [Txn.accounts[0] == App.globalGet(buyer), handle_purchase]
+    ))
+    return compileTeal(event_loop, Mode.Application, version=MAX_TEAL_VERSION)
+
+def clear():
+    return compileTeal(Reject(), Mode.Application, version=MAX_TEAL_VERSION)
+
+def compile_ipfs_merkle(client, cache=None, check_with_algod=False):
+    if cache is None:
+        cache = CompileCache()
+
+    approval_teal = cache.teal(approval)
+    clear_teal = cache.teal(clear)
+
+    dump_teal('ipfs_merkle_approval.teal', approval_teal)
+    dump_teal('ipfs_merkle_clear.teal', clear_teal)
+
+    # payment_amount, num_files / buyer, root
+    compile_contract(client, approval_teal, clear_teal, 'ipfs_merkle.artifact', (2, 2), (0, 0), cache, check_with_algod)
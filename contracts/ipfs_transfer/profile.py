@@ -0,0 +1,121 @@
+import argparse
+import sys
+
+from pyteal_helpers.cache import CompileCache
+from pyteal_helpers.profiler import format_table, largest_fitting, profile_branches, to_json
+from test_utils import num_slots, DIGESTS_PER_SLOT
+from contracts.ipfs_transfer.deploy import SLOTS_PER_CALL
+from contracts.ipfs_transfer.step_01 import approval, SLOTS_PER_NOTE
+
+# Opcode cost, inner transactions and fee of the step_01 branches as num_files grows
+#
+#   python -m contracts.ipfs_transfer.profile [--json out.json] [--one-per-note]
+
+BRANCHES = ("setup", "append", "purchase")
+# 64 global entries, 4 of them taken by buyer, payment_amount, num_files and uploaded
+MAX_SLOTS = 60
+MAX_FILES = MAX_SLOTS * 3
+# Slots one setup or append call has args for, two of the 16 are taken
+MAX_ARG_SLOTS = 14
+DEFAULT_SIZES = (1, 3, 30, 31, 42, 60, 90, 120, 180)
+
+def num_notes(num_files, batch_delivery=True):
+    if not batch_delivery:
+        return num_files
+    return -(-num_slots(num_files) // SLOTS_PER_NOTE)
+
+def trip_counts(num_files, batch_delivery=True):
+    """
+    Loop iterations of one run of each branch, see pyteal_helpers.profiler.
+    """
+    slots = num_slots(num_files)
+    # A setup or append call stores at most SLOTS_PER_CALL slots, see listing_txns
+    stored = min(slots, SLOTS_PER_CALL)
+    counts = {
+        "closesale:0": slots,
+        "storeslots:0": stored,
+        # slot_length of a full slot, every stored slot but the last one of the listing
+        "storeslots:l5": stored - 1 if slots <= SLOTS_PER_CALL else stored,
+    }
+    # itxn_next, run for every note but the last one
+    if batch_delivery:
+        counts["sendfilesbatched:0"] = num_notes(num_files)
+        counts["sendfilesbatched:1"] = slots
+        counts["sendfilesbatched:l6"] = num_notes(num_files) - 1
+    else:
+        counts["sendfilesonepernote:0"] = num_files
+        counts["sendfilesonepernote:l4"] = num_files - 1
+    return counts
+
+def op_counts(num_files, batch_delivery=True):
+    # itxn_next is skipped on the last note
+    function = "sendfilesbatched" if batch_delivery else "sendfilesonepernote"
+    return {function + ":itxn_next": num_notes(num_files, batch_delivery) - 1}
+
+def slots_per_call(batch_delivery=True, cache=None):
+    """
+    Most slots a setup or append call can store within its own opcode budget,
+    the number listing_txns puts in one call.
+    """
+    if cache is None:
+        cache = CompileCache()
+
+    def counts(slots):
+        # The call stores the last slot, the costlier side of slot_length
+        return dict(trip_counts(slots * DIGESTS_PER_SLOT, batch_delivery), **{"storeslots:0": slots, "storeslots:l5": slots - 1})
+
+    # Sizes are slots stored by the call here, not files
+    reports = profile_branches(cache.teal(approval, batch_delivery), ("setup", "append"), range(1, MAX_ARG_SLOTS + 1), counts)
+    return min(largest_fitting(reports, branch) for branch in ("setup", "append"))
+
+def profile(sizes=DEFAULT_SIZES, batch_delivery=True, cache=None, min_fee=1000):
+    """
+    Returns:
+        tuple: (branch reports for sizes, summary dict)
+    """
+    if cache is None:
+        cache = CompileCache()
+    teal = cache.teal(approval, batch_delivery)
+    reports = profile_branches(
+        teal,
+        BRANCHES,
+        sizes,
+        lambda n: trip_counts(n, batch_delivery),
+        lambda n: op_counts(n, batch_delivery),
+        min_fee
+    )
+    every_size = profile_branches(
+        teal,
+        ("purchase",),
+        range(1, MAX_FILES + 1),
+        lambda n: trip_counts(n, batch_delivery),
+        lambda n: op_counts(n, batch_delivery),
+        min_fee
+    )
+    summary = {
+        "batch_delivery": batch_delivery,
+        "max_files_storage": MAX_FILES,
+        "largest_purchase_single_call": largest_fitting(every_size, "purchase"),
+        "largest_purchase_pooled": largest_fitting(every_size, "purchase", single_call=False),
+        # What handle_purchase asserts today, against what fee pooling needs
+        "purchase_fee_checked": 3 * min_fee,
+        "purchase_fee_needed_max": max(report.fee for report in every_size),
+    }
+    return reports, summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the step_01 approval program")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--one-per-note", action="store_true", help="profile one digest per note delivery")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    args = parser.parse_args()
+
+    reports, summary = profile(args.sizes, batch_delivery=not args.one_per_note)
+    print(format_table(reports))
+    print()
+    for key, value in summary.items():
+        print("{}: {}".format(key, value))
+    if args.json:
+        with open(args.json, "w") as h:
+            h.write(to_json(reports, summary=summary))
+        print("wrote " + args.json, file=sys.stderr)
@@ -0,0 +1,282 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional
+
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from pyteal_helpers.assembler import assemble
+from pyteal_helpers.cache import CompileCache
+from pyteal_helpers.profiler import MAX_GROUP_SIZE, OPCODE_BUDGET, profile_branches
+from test_utils import ConfirmationService, decode_state, delivered_file_keys, sign_txn, wait_for_txns_confirm
+from contracts.ipfs_transfer.profile import op_counts, trip_counts
+from contracts.ipfs_transfer.step_01 import approval
+
+# The purchase pays the app its price and the minimum balance of its account
+APP_MIN_BALANCE = 100000
+# A payment and a NoOp per listing
+MAX_CHECKOUT_LISTINGS = MAX_GROUP_SIZE // 2
+
+@dataclass
+class Order:
+    """
+    One purchase of a step_01 sale. seller, price and num_files are read from
+    the app when left out.
+    """
+    app_id: int
+    buyer: str
+    priv_key: str
+    seller: Optional[str] = None
+    price: Optional[int] = None
+    num_files: Optional[int] = None
+
+@dataclass
+class PurchaseResult:
+    order: Order
+    # payment, NoOp and budget calls, in group order
+    txids: List[str] = field(default_factory=list)
+    confirmed_round: Optional[int] = None
+    cids: Optional[List[str]] = None
+    error: Optional[str] = None
+
+    @property
+    def confirmed(self):
+        return self.confirmed_round is not None
+
+@lru_cache(maxsize=None)
+def purchase_profile(num_files, min_fee=1000, batch_delivery=True):
+    """
+    Static profile of the purchase branch of the approval program for a sale of
+    num_files, see pyteal_helpers.profiler.
+    Returns:
+        BranchReport: opcode cost, inner transactions, fee and app calls
+    """
+    teal = CompileCache().teal(approval, batch_delivery)
+    report, = profile_branches(
+        teal,
+        ("purchase",),
+        (num_files,),
+        lambda n: trip_counts(n, batch_delivery),
+        lambda n: op_counts(n, batch_delivery),
+        min_fee
+    )
+    if not report.fits:
+        raise ValueError('a purchase of {} files does not fit in one group'.format(num_files))
+    return report
+
+def purchase_cost(num_files, min_fee=1000, batch_delivery=True):
+    """
+    Exact fee of the purchase NoOp, which pays for itself, the seller payment and
+    every note, and the number of app calls the group needs for the opcode budget.
+    Returns:
+        tuple: (NoOp fee, app calls)
+    """
+    report = purchase_profile(num_files, min_fee, batch_delivery)
+    return report.fee, report.app_calls
+
+def deploy_budget_app(client, priv_key, timeout=5):
+    """
+    Deploys an app that approves every call, called by purchases that need more
+    opcode budget than the purchase call has on its own.
+    Returns:
+        int: app id
+    """
+    program = assemble("#pragma version 8\nint 1\n").bytecode
+    txn = transaction.ApplicationCreateTxn(
+        account.address_from_private_key(priv_key),
+        client.suggested_params(),
+        transaction.OnComplete.NoOpOC.real,
+        program,
+        program,
+        transaction.StateSchema(0, 0),
+        transaction.StateSchema(0, 0)
+    )
+    client.send_transactions([sign_txn(txn, priv_key)])
+    return wait_for_txns_confirm(client, [txn.get_txid()], timeout)[txn.get_txid()].info['application-index']
+
+class PurchaseClient:
+    """
+    Buys many step_01 sales at once: one suggested params fetch for every group,
+    exact fees, signing in one batch, submissions from a bounded thread pool and
+    one block watcher for all confirmations, so that order throughput is bound
+    by the node rather than by round trips.
+    """
+
+    def __init__(self, client, budget_app_id=None, max_workers=8, timeout=5, batch_delivery=True):
+        """
+        Args:
+            client (AlgodClient): algod client, shared by the submitting threads
+            budget_app_id (int, optional): app called for extra opcode budget, see
+                deploy_budget_app; purchases needing it fail without one
+            max_workers (int): concurrent requests
+            timeout (int): rounds to wait for the purchases
+            batch_delivery (bool): how the sale apps were compiled
+        """
+        self.client = client
+        self.budget_app_id = budget_app_id
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.batch_delivery = batch_delivery
+
+    def _map(self, fn, items):
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(items), 1))) as executor:
+            return list(executor.map(fn, items))
+
+    def resolve(self, orders):
+        """
+        Fill in seller, price and num_files of the orders missing them, reading
+        every app once.
+        Raises:
+            ValueError: when an app has no sale set up
+        """
+        app_ids = list(dict.fromkeys(
+            order.app_id for order in orders
+            if None in (order.seller, order.price, order.num_files)
+        ))
+        infos = dict(zip(app_ids, self._map(self.client.application_info, app_ids)))
+        for order in orders:
+            info = infos.get(order.app_id)
+            if info is None:
+                continue
+            state = decode_state(info['params'].get('global-state', []))
+            if b'num_files' not in state:
+                raise ValueError('app {} has no sale set up'.format(order.app_id))
+            order.seller = order.seller or info['params']['creator']
+            order.price = order.price if order.price is not None else state[b'payment_amount']
+            order.num_files = order.num_files or state[b'num_files']
+        return orders
+
+    def _purchase_txns(self, order, params):
+        app_address = encoding.encode_address(encoding.checksum(b'appID' + order.app_id.to_bytes(8, 'big')))
+        pay = transaction.PaymentTxn(order.buyer, params, app_address, order.price + APP_MIN_BALANCE)
+        pay.fee = params.min_fee
+        noop = transaction.ApplicationNoOpTxn(order.buyer, params, order.app_id, accounts=[order.seller])
+        noop.fee = purchase_cost(order.num_files, params.min_fee, self.batch_delivery)[0]
+        # The contract takes the transaction right before the call as its payment
+        return [pay, noop]
+
+    def _budget_calls(self, sender, params, count):
+        if count > 0 and self.budget_app_id is None:
+            raise ValueError('{} more app calls are needed for the opcode budget and no budget app is set'.format(count))
+        calls = []
+        # Extra calls only add budget, the note tells them apart within a group
+        for index in range(count):
+            call = transaction.ApplicationNoOpTxn(sender, params, self.budget_app_id, note=index.to_bytes(1, 'big'))
+            call.fee = params.min_fee
+            calls.append(call)
+        return calls
+
+    def build(self, orders, params=None):
+        """
+        Args:
+            orders (list): resolved orders
+            params (SuggestedParams, optional): fetched once if None
+        Returns:
+            list: one group of unsigned transactions per order, group ids set
+        """
+        if params is None:
+            params = self.client.suggested_params()
+        groups = []
+        for order in orders:
+            app_calls = purchase_cost(order.num_files, params.min_fee, self.batch_delivery)[1]
+            group = self._purchase_txns(order, params) + self._budget_calls(order.buyer, params, app_calls - 1)
+            transaction.assign_group_id(group)
+            groups.append(group)
+        return groups
+
+    def build_checkout(self, orders, params=None):
+        """
+        One atomic group buying every order: a payment and a NoOp per listing,
+        then the budget calls the listings need together, as the opcode budget is
+        pooled over the app calls of the group.
+        Args:
+            orders (list): up to MAX_CHECKOUT_LISTINGS resolved orders
+            params (SuggestedParams, optional): fetched once if None
+        Returns:
+            list: unsigned transactions, group id set
+        """
+        if params is None:
+            params = self.client.suggested_params()
+        cost = sum(purchase_profile(order.num_files, params.min_fee, self.batch_delivery).cost for order in orders)
+        extra_calls = max(0, -(-cost // OPCODE_BUDGET) - len(orders))
+        if not orders or 2 * len(orders) + extra_calls > MAX_GROUP_SIZE:
+            raise ValueError('{} listings with {} budget calls do not fit in one group'.format(len(orders), extra_calls))
+        group = [txn for order in orders for txn in self._purchase_txns(order, params)]
+        group += self._budget_calls(orders[0].buyer, params, extra_calls)
+        transaction.assign_group_id(group)
+        return group
+
+    def sign(self, groups, orders):
+        """
+        Sign the groups of build, or the group of build_checkout with orders
+        holding every order of the checkout.
+        """
+        keys = {order.buyer: order.priv_key for order in orders}
+        return [[sign_txn(txn, keys[txn.sender]) for txn in group] for group in groups]
+
+    def submit(self, signed_groups):
+        """
+        Send every group, max_workers at a time.
+        Returns:
+            list: None for every accepted group, the error message of the others
+        """
+        def send(group):
+            try:
+                self.client.send_transactions(group)
+            except AlgodHTTPError as e:
+                return str(e)
+            return None
+
+        return self._map(send, signed_groups)
+
+    def _confirm(self, results, submitted_round=None):
+        # The NoOp carries the deliveries and confirms with its group
+        sent = [result for result in results if result.error is None]
+        confirmations = ConfirmationService(self.client, self.timeout).wait(
+            list(dict.fromkeys(result.txids[1] for result in sent)), raise_on_error=False,
+            submitted_round=submitted_round
+        )
+        for result in sent:
+            confirmation = confirmations[result.txids[1]]
+            if confirmation.confirmed:
+                result.confirmed_round = confirmation.confirmed_round
+                result.cids = delivered_file_keys(confirmation.info.get('inner-txns', []))
+            else:
+                result.error = confirmation.pool_error or 'not confirmed after {} rounds'.format(self.timeout)
+        return results
+
+    def buy(self, orders):
+        """
+        Resolve, build, sign, submit and confirm orders, a group each.
+        Returns:
+            list: a PurchaseResult per order, with the delivered CIDs of the confirmed ones
+        """
+        orders = self.resolve(list(orders))
+        groups = self.build(orders)
+        results = [
+            PurchaseResult(order, [txn.get_txid() for txn in group])
+            for order, group in zip(orders, groups)
+        ]
+        errors = self.submit(self.sign(groups, orders))
+        for result, error in zip(results, errors):
+            result.error = error
+        # Groups sent early may land before the round watching starts at
+        return self._confirm(results, min((group[0].first_valid_round for group in groups), default=None))
+
+    def checkout(self, orders):
+        """
+        Buy every order in one atomic group: all of them confirm in the same
+        block, or none does.
+        Returns:
+            list: a PurchaseResult per order, txids holding its payment and NoOp
+        """
+        orders = self.resolve(list(orders))
+        group = self.build_checkout(orders)
+        txids = [txn.get_txid() for txn in group]
+        error, = self.submit(self.sign([group], orders))
+        results = [
+            PurchaseResult(order, txids[2 * index:2 * index + 2], error=error)
+            for index, order in enumerate(orders)
+        ]
+        return self._confirm(results)
@@ -1,13 +1,46 @@
 from pyteal import *
-from test_utils import dump_teal, compile_teal, write_schema
+from pyteal_helpers.cache import CompileCache
+from test_utils import dump_teal, compile_contract, num_slots, DIGEST_SIZE, DIGESTS_PER_SLOT, SLOT_SIZE
 
-def approval():
+# Batched delivery concatenates whole slots into each inner note: 10 slots are
+# 30 digests (960 bytes) of the 1024 byte note limit
+SLOTS_PER_NOTE = 10
+
+def approval(batch_delivery=True):
     
     buyer = Bytes("buyer")
     payment_amount = Bytes("payment_amount")
     num_files = Bytes("num_files")
+    # Slots stored so far, the sale can only be bought once all of them are
+    uploaded = Bytes("uploaded")
     i = ScratchVar(TealType.uint64)
+    j = ScratchVar(TealType.uint64)
+    note = ScratchVar(TealType.bytes)
+    
+    # Digests are packed DIGESTS_PER_SLOT to a slot, keyed by the slot index as a single byte
+    def slot_key(index):
+        return Extract(Itob(index), Int(7), Int(1))
+    
+    def slot_count():
+        return (App.globalGet(num_files) + Int(DIGESTS_PER_SLOT - 1)) / Int(DIGESTS_PER_SLOT)
     
+    # Every slot is full except the last one, which holds the remaining digests
+    def slot_length(index):
+        return If(
+            index < slot_count() - Int(1),
+            Int(SLOT_SIZE),
+            App.globalGet(num_files) * Int(DIGEST_SIZE) - index * Int(SLOT_SIZE)
+        )
+    
+    def file_digest(index):
+        return Extract(
+            App.globalGet(slot_key(index / Int(DIGESTS_PER_SLOT))),
+            (index % Int(DIGESTS_PER_SLOT)) * Int(DIGEST_SIZE),
+            Int(DIGEST_SIZE)
+        )
+    
+    # The seller is the creator, whatever account the buyer passes; the call
+    # still has to list it in its accounts for the payment to reach it
     @Subroutine(TealType.none)
     def transfer_funds_to_owner():
         return Seq(
@@ -15,7 +48,7 @@ def approval():
             InnerTxnBuilder.SetFields(
                 {
                     TxnField.type_enum: TxnType.Payment,
-                    TxnField.receiver: Txn.accounts[1],
+                    TxnField.receiver: Global.creator_address(),
                     TxnField.amount: App.globalGet(payment_amount),
                     TxnField.fee: Int(0)  # use fee pooling
                 }
@@ -23,8 +56,9 @@ def approval():
             InnerTxnBuilder.Submit()
         )
     
+    # One inner payment per file, each note holding a single digest
     @Subroutine(TealType.none)
-    def send_files():
+    def send_files_one_per_note():
         #i = ScratchVar(TealType.uint64)
         return Seq(
                 InnerTxnBuilder.Begin(),
@@ -36,7 +70,7 @@ def approval():
                                 TxnField.type_enum: TxnType.Payment,
                                 TxnField.receiver: Txn.accounts[0],
                                 TxnField.amount: Int(0),
-                                TxnField.note: App.globalGet(Itob(i.load())),
+                                TxnField.note: file_digest(i.load()),
                                 TxnField.fee: Int(0)  # use fee pooling
                             }
                         ),
@@ -48,39 +82,116 @@ def approval():
                 ),
                 InnerTxnBuilder.Submit()
             )
+    
+    # One inner payment per SLOTS_PER_NOTE slots, each note holding up to 30 digests
+    @Subroutine(TealType.none)
+    def send_files_batched():
+        return Seq(
+                InnerTxnBuilder.Begin(),
+                For(i.store(Int(0)), i.load() < slot_count(), i.store(i.load() + Int(SLOTS_PER_NOTE)))
+                .Do(
+                    Seq(
+                        note.store(Bytes("")),
+                        For(
+                            j.store(i.load()),
+                            And(j.load() < i.load() + Int(SLOTS_PER_NOTE), j.load() < slot_count()),
+                            j.store(j.load() + Int(1))
+                        )
+                        .Do(
+                            note.store(Concat(note.load(), App.globalGet(slot_key(j.load()))))
+                        ),
+                        InnerTxnBuilder.SetFields(
+                            {
+                                TxnField.type_enum: TxnType.Payment,
+                                TxnField.receiver: Txn.accounts[0],
+                                TxnField.amount: Int(0),
+                                TxnField.note: note.load(),
+                                TxnField.fee: Int(0)  # use fee pooling
+                            }
+                        ),
+                        If(i.load() + Int(SLOTS_PER_NOTE) < slot_count())
+                        .Then(
+                            InnerTxnBuilder.Next()
+                        ),
+                    )
+                ),
+                InnerTxnBuilder.Submit()
+            )
+    
+    send_files = send_files_batched if batch_delivery else send_files_one_per_note
         
     @Subroutine(TealType.none)
     def close_sale():
         return Seq(
-            For(i.store(Int(0)), i.load() < App.globalGet(num_files), i.store(i.load() + Int(1)))
+            For(i.store(Int(0)), i.load() < slot_count(), i.store(i.load() + Int(1)))
             .Do(
-                App.globalDel(Itob(i.load()))
+                App.globalDel(slot_key(i.load()))
             ),
             App.globalDel(num_files),
+            App.globalDel(uploaded),
             App.globalDel(payment_amount),
             App.globalDel(buyer)
         )
         
+    # Stores application args [first_arg, NumAppArgs) in consecutive slots from first_slot on,
+    # slots are uploaded in order so that the counter can't count one twice
+    @Subroutine(TealType.none)
+    def store_slots(first_slot, first_arg):
+        slot = first_slot + i.load() - first_arg
+        return Seq(
+            Assert(first_slot == App.globalGet(uploaded)),
+            For(i.store(first_arg), i.load() < Txn.application_args.length(), i.store(i.load() + Int(1))).Do(
+                Seq(
+                    Assert(
+                        And(
+                            slot < slot_count(),
+                            Len(Txn.application_args[i.load()]) == slot_length(slot)
+                        )
+                    ),
+                    App.globalPut(slot_key(slot), Txn.application_args[i.load()])
+                )
+            ),
+            App.globalPut(uploaded, first_slot + Txn.application_args.length() - first_arg)
+        )
+        
+    # args [price, num_files, slots...], the slots that don't fit are appended later
     setup_shop = Seq(
         [
+            Comment("branch: setup"),
             App.globalPut(buyer, Txn.accounts[1]),
             App.globalPut(payment_amount, Btoi(Txn.application_args[0])),
             App.globalPut(num_files, Btoi(Txn.application_args[1])),
-            For(i.store(Int(0)), i.load() < App.globalGet(num_files), i.store(i.load() + Int(1)))
-            .Do(
-                App.globalPut(Itob(i.load()), Txn.application_args[i.load() + Int(2)])
-            ),
+            App.globalPut(uploaded, Int(0)),
+            # One argument per slot, each holding up to DIGESTS_PER_SLOT raw digests
+            store_slots(Int(0), Int(2)),
+            Approve()
+        ]
+    )
+    
+    # args ["append", key offset, slots...], the offset has to start a slot
+    append_keys = Seq(
+        [
+            Comment("branch: append"),
+            Assert(Btoi(Txn.application_args[1]) % Int(DIGESTS_PER_SLOT) == Int(0)),
+            store_slots(Btoi(Txn.application_args[1]) / Int(DIGESTS_PER_SLOT), Int(2)),
             Approve()
         ]
     )
     
+    # Every call pays with the transaction right before it, so that several
+    # sales can be bought in one group
+    payment = Gtxn[Txn.group_index() - Int(1)]
     handle_purchase = Seq(
             [   
+                Comment("branch: purchase"),
                 Assert(
                     And(
-                        # Make sure the first transaction is the payment
-                        Gtxn[0].type_enum() == TxnType.Payment,
-                        Gtxn[0].amount() >= App.globalGet(payment_amount),
+                        Txn.group_index() > Int(0),
+                        payment.type_enum() == TxnType.Payment,
+                        payment.sender() == Txn.sender(),
+                        payment.receiver() == Global.current_application_address(),
+                        payment.amount() >= App.globalGet(payment_amount),
+                        App.globalGet(uploaded) == slot_count(),
                         Txn.fee() >= Global.min_txn_fee() * Int(3)
                     )
                 ),
@@ -97,7 +208,8 @@ def approval():
             Approve()
         ]
     ), no_op=Cond(
-        [Txn.accounts[0] == Global.creator_address(), setup_shop],
+        [Txn.accounts[0] == Global.creator_address(),
+            If(Txn.application_args[0] == Bytes("append"), append_keys, setup_shop)],
         [Txn.accounts[0] == App.globalGet(buyer), handle_purchase]
     ))
     return compileTeal(event_loop, Mode.Application, version=MAX_TEAL_VERSION)
@@ -105,15 +217,18 @@ def approval():
 def clear():
     return compileTeal(Reject(), Mode.Application, version=MAX_TEAL_VERSION)   
 
-def compile_ipfs(client, num_files):
-    dump_teal('ipfs_transfer_approval.teal', approval)
-    dump_teal('ipfs_transfer_clear.teal', clear)
+def compile_ipfs(client, num_files, cache=None, check_with_algod=False, batch_delivery=True):
+    if cache is None:
+        cache = CompileCache()
+    
+    # Build each program once, unchanged contracts come straight from the cache
+    approval_teal = cache.teal(approval, batch_delivery)
+    clear_teal = cache.teal(clear)
     
-    compile_teal(client, approval(), 'ipfs_transfer_approval.compiled')
-    compile_teal(client, clear(), 'ipfs_transfer_clear.compiled')
+    dump_teal('ipfs_transfer_approval.teal', approval_teal)
+    dump_teal('ipfs_transfer_clear.teal', clear_teal)
     
-    write_schema(file_path='local_schema', num_ints=0, num_bytes=0)
-    write_schema(file_path='global_schema', num_ints=2, num_bytes=num_files+1)
+    compile_contract(client, approval_teal, clear_teal, 'ipfs_transfer.artifact', (3, num_slots(num_files)+1), (0, 0), cache, check_with_algod)
     
 def event(
     init: Expr = Reject(),
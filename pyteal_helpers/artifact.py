@@ -0,0 +1,182 @@
+"""
+Single-file build artifact of a contract.
+
+Everything a deploy needs, approval and clear bytecode and both state schemas,
+plus what identifies the build: the sha256 of both TEAL sources and the
+compiler that assembled them. The layout is a fixed little-endian header
+followed by the variable sections:
+
+    magic        8s   b"IPFSART\\0"
+    format       H    FORMAT_VERSION
+    compiler     H    length of the compiler name
+    approval     I    length of the approval bytecode
+    clear        I    length of the clear bytecode
+    schemas      4H   global ints, global bytes, local ints, local bytes
+    extra pages  H
+    teal hashes  2x32s  sha256 of the approval and clear TEAL
+    checksum     32s  sha256 of everything else in the file
+    ---
+    compiler name (utf-8), approval bytecode, clear bytecode
+
+Loading maps the file, checks the header and checksum over memoryviews of the
+map and copies out only the two programs, no pickle involved.
+"""
+import hashlib
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+
+MAGIC = b"IPFSART\0"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHII4HH32s32s32s")
+# The checksum is the last field of the header
+_CHECKSUM_OFFSET = _HEADER.size - 32
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def teal_hash(teal: str) -> bytes:
+    return hashlib.sha256(teal.encode("utf-8")).digest()
+
+
+@dataclass(frozen=True)
+class Artifact:
+    approval: bytes
+    clear: bytes
+    global_ints: int
+    global_bytes: int
+    local_ints: int
+    local_bytes: int
+    approval_teal_hash: bytes
+    clear_teal_hash: bytes
+    compiler: str
+    extra_pages: int = 0
+
+    @classmethod
+    def build(
+        cls,
+        approval_teal: str,
+        clear_teal: str,
+        approval: bytes,
+        clear: bytes,
+        global_schema: tuple,
+        local_schema: tuple,
+        compiler: str,
+        extra_pages: int = 0,
+    ) -> "Artifact":
+        """
+        Args:
+            global_schema (tuple): (num_ints, num_bytes)
+            local_schema (tuple): (num_ints, num_bytes)
+        """
+        return cls(
+            bytes(approval),
+            bytes(clear),
+            *global_schema,
+            *local_schema,
+            teal_hash(approval_teal),
+            teal_hash(clear_teal),
+            compiler,
+            extra_pages,
+        )
+
+    @property
+    def global_schema(self):
+        from algosdk.future.transaction import StateSchema
+
+        return StateSchema(self.global_ints, self.global_bytes)
+
+    @property
+    def local_schema(self):
+        from algosdk.future.transaction import StateSchema
+
+        return StateSchema(self.local_ints, self.local_bytes)
+
+    def built_from(self, approval_teal: str, clear_teal: str) -> bool:
+        """True when the artifact was assembled from exactly these TEAL sources."""
+        return (self.approval_teal_hash, self.clear_teal_hash) == (teal_hash(approval_teal), teal_hash(clear_teal))
+
+    def to_bytes(self) -> bytes:
+        compiler = self.compiler.encode("utf-8")
+        header = _HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            len(compiler),
+            len(self.approval),
+            len(self.clear),
+            self.global_ints,
+            self.global_bytes,
+            self.local_ints,
+            self.local_bytes,
+            self.extra_pages,
+            self.approval_teal_hash,
+            self.clear_teal_hash,
+            bytes(32),
+        )
+        body = compiler + self.approval + self.clear
+        checksum = hashlib.sha256(header[:_CHECKSUM_OFFSET])
+        checksum.update(body)
+        return header[:_CHECKSUM_OFFSET] + checksum.digest() + body
+
+    @classmethod
+    def from_buffer(cls, data) -> "Artifact":
+        """
+        Parse and verify an artifact from any buffer, e.g. a mmap.
+        Raises:
+            ArtifactError: when the data isn't a complete, intact artifact of this format
+        """
+        view = memoryview(data)
+        if len(view) < _HEADER.size:
+            raise ArtifactError("truncated artifact: {} bytes, the header alone is {}".format(len(view), _HEADER.size))
+        (magic, version, compiler_len, approval_len, clear_len, global_ints, global_bytes, local_ints, local_bytes,
+         extra_pages, approval_teal_hash, clear_teal_hash, checksum) = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ArtifactError("not a contract artifact")
+        if version != FORMAT_VERSION:
+            raise ArtifactError("artifact format {}, expected {}".format(version, FORMAT_VERSION))
+        size = _HEADER.size + compiler_len + approval_len + clear_len
+        if len(view) != size:
+            raise ArtifactError("artifact is {} bytes, its header says {}".format(len(view), size))
+
+        expected = hashlib.sha256(view[:_CHECKSUM_OFFSET])
+        expected.update(view[_HEADER.size:])
+        if expected.digest() != checksum:
+            raise ArtifactError("artifact checksum mismatch")
+
+        start = _HEADER.size + compiler_len
+        return cls(
+            bytes(view[start:start + approval_len]),
+            bytes(view[start + approval_len:size]),
+            global_ints,
+            global_bytes,
+            local_ints,
+            local_bytes,
+            approval_teal_hash,
+            clear_teal_hash,
+            str(view[_HEADER.size:start], "utf-8"),
+            extra_pages,
+        )
+
+    def dump(self, file_path: str):
+        tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(self.to_bytes())
+        # Atomic so that a deploy never maps a half written artifact
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "Artifact":
+        """
+        Raises:
+            FileNotFoundError: when there is no artifact at file_path
+            ArtifactError: see from_buffer
+        """
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ArtifactError("empty artifact " + file_path)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return cls.from_buffer(data)
@@ -0,0 +1,732 @@
+"""
+Offline TEAL assembler.
+
+Turns the TEAL that PyTeal emits into the same bytecode `algod.compile` returns,
+without a node: constants are collected into intcblock/bytecblock, sorted by use
+count and constants used only once are pushed inline, exactly like go-algorand's
+assembler does for TEAL v4 and above.
+"""
+import base64
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+from algosdk import encoding
+
+ASSEMBLER_VERSION = "pyteal_helpers-asm-1"
+MAX_SUPPORTED_VERSION = 8
+
+# Versions from which constants are frequency sorted and pushed inline when used once
+OPTIMIZE_CONSTANTS_VERSION = 4
+
+
+class AssembleError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class OpSpec:
+    name: str
+    opcode: int
+    version: int
+    immediates: Tuple[str, ...] = ()
+    cost: int = 1
+
+
+def _ops(version: int, *specs) -> List[OpSpec]:
+    return [OpSpec(name, opcode, version, tuple(imms), cost) for name, opcode, imms, cost in specs]
+
+
+# name, opcode, immediates, cost (v2+ costs; the hash opcodes were cheaper in v1)
+OP_SPECS: List[OpSpec] = (
+    _ops(
+        1,
+        ("err", 0x00, (), 1),
+        ("sha256", 0x01, (), 35),
+        ("keccak256", 0x02, (), 130),
+        ("sha512_256", 0x03, (), 45),
+        ("ed25519verify", 0x04, (), 1900),
+        ("+", 0x08, (), 1),
+        ("-", 0x09, (), 1),
+        ("/", 0x0A, (), 1),
+        ("*", 0x0B, (), 1),
+        ("<", 0x0C, (), 1),
+        (">", 0x0D, (), 1),
+        ("<=", 0x0E, (), 1),
+        (">=", 0x0F, (), 1),
+        ("&&", 0x10, (), 1),
+        ("||", 0x11, (), 1),
+        ("==", 0x12, (), 1),
+        ("!=", 0x13, (), 1),
+        ("!", 0x14, (), 1),
+        ("len", 0x15, (), 1),
+        ("itob", 0x16, (), 1),
+        ("btoi", 0x17, (), 1),
+        ("%", 0x18, (), 1),
+        ("|", 0x19, (), 1),
+        ("&", 0x1A, (), 1),
+        ("^", 0x1B, (), 1),
+        ("~", 0x1C, (), 1),
+        ("mulw", 0x1D, (), 1),
+        ("intcblock", 0x20, ("intcblock",), 1),
+        ("intc", 0x21, ("uint8",), 1),
+        ("intc_0", 0x22, (), 1),
+        ("intc_1", 0x23, (), 1),
+        ("intc_2", 0x24, (), 1),
+        ("intc_3", 0x25, (), 1),
+        ("bytecblock", 0x26, ("bytecblock",), 1),
+        ("bytec", 0x27, ("uint8",), 1),
+        ("bytec_0", 0x28, (), 1),
+        ("bytec_1", 0x29, (), 1),
+        ("bytec_2", 0x2A, (), 1),
+        ("bytec_3", 0x2B, (), 1),
+        ("arg", 0x2C, ("uint8",), 1),
+        ("arg_0", 0x2D, (), 1),
+        ("arg_1", 0x2E, (), 1),
+        ("arg_2", 0x2F, (), 1),
+        ("arg_3", 0x30, (), 1),
+        ("txn", 0x31, ("txn_field",), 1),
+        ("global", 0x32, ("global_field",), 1),
+        ("gtxn", 0x33, ("uint8", "txn_field"), 1),
+        ("load", 0x34, ("uint8",), 1),
+        ("store", 0x35, ("uint8",), 1),
+        ("bnz", 0x40, ("label",), 1),
+        ("pop", 0x48, (), 1),
+        ("dup", 0x49, (), 1),
+    )
+    + _ops(
+        2,
+        ("addw", 0x1E, (), 1),
+        ("txna", 0x36, ("txn_field", "uint8"), 1),
+        ("gtxna", 0x37, ("uint8", "txn_field", "uint8"), 1),
+        ("bz", 0x41, ("label",), 1),
+        ("b", 0x42, ("label",), 1),
+        ("return", 0x43, (), 1),
+        ("dup2", 0x4A, (), 1),
+        ("concat", 0x50, (), 1),
+        ("substring", 0x51, ("uint8", "uint8"), 1),
+        ("substring3", 0x52, (), 1),
+        ("balance", 0x60, (), 1),
+        ("app_opted_in", 0x61, (), 1),
+        ("app_local_get", 0x62, (), 1),
+        ("app_local_get_ex", 0x63, (), 1),
+        ("app_global_get", 0x64, (), 1),
+        ("app_global_get_ex", 0x65, (), 1),
+        ("app_local_put", 0x66, (), 1),
+        ("app_global_put", 0x67, (), 1),
+        ("app_local_del", 0x68, (), 1),
+        ("app_global_del", 0x69, (), 1),
+        ("asset_holding_get", 0x70, ("asset_holding_field",), 1),
+        ("asset_params_get", 0x71, ("asset_params_field",), 1),
+    )
+    + _ops(
+        3,
+        ("gtxns", 0x38, ("txn_field",), 1),
+        ("gtxnsa", 0x39, ("txn_field", "uint8"), 1),
+        ("assert", 0x44, (), 1),
+        ("dig", 0x4B, ("uint8",), 1),
+        ("swap", 0x4C, (), 1),
+        ("select", 0x4D, (), 1),
+        ("getbit", 0x53, (), 1),
+        ("setbit", 0x54, (), 1),
+        ("getbyte", 0x55, (), 1),
+        ("setbyte", 0x56, (), 1),
+        ("min_balance", 0x78, (), 1),
+        ("pushbytes", 0x80, ("bytes",), 1),
+        ("pushint", 0x81, ("varuint",), 1),
+    )
+    + _ops(
+        4,
+        ("divmodw", 0x1F, (), 20),
+        ("gload", 0x3A, ("uint8", "uint8"), 1),
+        ("gloads", 0x3B, ("uint8",), 1),
+        ("gaid", 0x3C, ("uint8",), 1),
+        ("gaids", 0x3D, (), 1),
+        ("callsub", 0x88, ("label",), 1),
+        ("retsub", 0x89, (), 1),
+        ("shl", 0x90, (), 1),
+        ("shr", 0x91, (), 1),
+        ("sqrt", 0x92, (), 4),
+        ("bitlen", 0x93, (), 1),
+        ("exp", 0x94, (), 1),
+        ("expw", 0x95, (), 10),
+        ("b+", 0xA0, (), 10),
+        ("b-", 0xA1, (), 10),
+        ("b/", 0xA2, (), 20),
+        ("b*", 0xA3, (), 20),
+        ("b<", 0xA4, (), 1),
+        ("b>", 0xA5, (), 1),
+        ("b<=", 0xA6, (), 1),
+        ("b>=", 0xA7, (), 1),
+        ("b==", 0xA8, (), 1),
+        ("b!=", 0xA9, (), 1),
+        ("b%", 0xAA, (), 20),
+        ("b|", 0xAB, (), 6),
+        ("b&", 0xAC, (), 6),
+        ("b^", 0xAD, (), 6),
+        ("b~", 0xAE, (), 4),
+        ("bzero", 0xAF, (), 1),
+    )
+    + _ops(
+        5,
+        ("ecdsa_verify", 0x05, ("ecdsa_curve",), 1700),
+        ("ecdsa_pk_decompress", 0x06, ("ecdsa_curve",), 650),
+        ("ecdsa_pk_recover", 0x07, ("ecdsa_curve",), 2000),
+        ("loads", 0x3E, (), 1),
+        ("stores", 0x3F, (), 1),
+        ("cover", 0x4E, ("uint8",), 1),
+        ("uncover", 0x4F, ("uint8",), 1),
+        ("extract", 0x57, ("uint8", "uint8"), 1),
+        ("extract3", 0x58, (), 1),
+        ("extract_uint16", 0x59, (), 1),
+        ("extract_uint32", 0x5A, (), 1),
+        ("extract_uint64", 0x5B, (), 1),
+        ("app_params_get", 0x72, ("app_params_field",), 1),
+        ("log", 0xB0, (), 1),
+        ("itxn_begin", 0xB1, (), 1),
+        ("itxn_field", 0xB2, ("txn_field",), 1),
+        ("itxn_submit", 0xB3, (), 1),
+        ("itxn", 0xB4, ("txn_field",), 1),
+        ("itxna", 0xB5, ("txn_field", "uint8"), 1),
+        ("txnas", 0xC0, ("txn_field",), 1),
+        ("gtxnas", 0xC1, ("uint8", "txn_field"), 1),
+        ("gtxnsas", 0xC2, ("txn_field",), 1),
+        ("args", 0xC3, (), 1),
+    )
+    + _ops(
+        6,
+        ("acct_params_get", 0x73, ("acct_params_field",), 1),
+        ("bsqrt", 0x96, (), 40),
+        ("divw", 0x97, (), 1),
+        ("itxn_next", 0xB6, (), 1),
+        ("gitxn", 0xB7, ("uint8", "txn_field"), 1),
+        ("gitxna", 0xB8, ("uint8", "txn_field", "uint8"), 1),
+        ("gloadss", 0xC4, (), 1),
+        ("itxnas", 0xC5, ("txn_field",), 1),
+        ("gitxnas", 0xC6, ("uint8", "txn_field"), 1),
+    )
+    + _ops(
+        7,
+        ("replace2", 0x5C, ("uint8",), 1),
+        ("replace3", 0x5D, (), 1),
+        ("base64_decode", 0x5E, ("base64_encoding",), 1),
+        ("json_ref", 0x5F, ("json_ref_type",), 25),
+        ("ed25519verify_bare", 0x84, (), 1900),
+        ("sha3_256", 0x98, (), 130),
+        ("vrf_verify", 0xD0, ("vrf_standard",), 5700),
+        ("block", 0xD1, ("block_field",), 1),
+    )
+    + _ops(
+        8,
+        ("bury", 0x45, ("uint8",), 1),
+        ("popn", 0x46, ("uint8",), 1),
+        ("dupn", 0x47, ("uint8",), 1),
+        ("pushbytess", 0x82, ("bytes_list",), 1),
+        ("pushints", 0x83, ("varuint_list",), 1),
+        ("proto", 0x8A, ("uint8", "uint8"), 1),
+        ("frame_dig", 0x8B, ("int8",), 1),
+        ("frame_bury", 0x8C, ("int8",), 1),
+        ("switch", 0x8D, ("labels",), 1),
+        ("match", 0x8E, ("labels",), 1),
+        ("box_create", 0xB9, (), 1),
+        ("box_extract", 0xBA, (), 1),
+        ("box_replace", 0xBB, (), 1),
+        ("box_del", 0xBC, (), 1),
+        ("box_len", 0xBD, (), 1),
+        ("box_get", 0xBE, (), 1),
+        ("box_put", 0xBF, (), 1),
+    )
+)
+
+OPS_BY_NAME: Dict[str, OpSpec] = {spec.name: spec for spec in OP_SPECS}
+OPS_BY_OPCODE: Dict[int, OpSpec] = {spec.opcode: spec for spec in OP_SPECS}
+
+
+def _enum(*names: str) -> Dict[str, int]:
+    return {name: i for i, name in enumerate(names)}
+
+
+TXN_FIELDS = _enum(
+    "Sender", "Fee", "FirstValid", "FirstValidTime", "LastValid", "Note", "Lease",
+    "Receiver", "Amount", "CloseRemainderTo", "VotePK", "SelectionPK", "VoteFirst",
+    "VoteLast", "VoteKeyDilution", "Type", "TypeEnum", "XferAsset", "AssetAmount",
+    "AssetSender", "AssetReceiver", "AssetCloseTo", "GroupIndex", "TxID",
+    "ApplicationID", "OnCompletion", "ApplicationArgs", "NumAppArgs", "Accounts",
+    "NumAccounts", "ApprovalProgram", "ClearStateProgram", "RekeyTo", "ConfigAsset",
+    "ConfigAssetTotal", "ConfigAssetDecimals", "ConfigAssetDefaultFrozen",
+    "ConfigAssetUnitName", "ConfigAssetName", "ConfigAssetURL",
+    "ConfigAssetMetadataHash", "ConfigAssetManager", "ConfigAssetReserve",
+    "ConfigAssetFreeze", "ConfigAssetClawback", "FreezeAsset", "FreezeAssetAccount",
+    "FreezeAssetFrozen", "Assets", "NumAssets", "Applications", "NumApplications",
+    "GlobalNumUint", "GlobalNumByteSlice", "LocalNumUint", "LocalNumByteSlice",
+    "ExtraProgramPages", "Nonparticipation", "Logs", "NumLogs", "CreatedAssetID",
+    "CreatedApplicationID", "LastLog", "StateProofPK", "ApprovalProgramPages",
+    "NumApprovalProgramPages", "ClearStateProgramPages", "NumClearStateProgramPages",
+)
+
+# Fields that take an array index (txna, gtxna, ...)
+TXN_ARRAY_FIELDS = {
+    "ApplicationArgs", "Accounts", "Assets", "Applications", "Logs",
+    "ApprovalProgramPages", "ClearStateProgramPages",
+}
+
+GLOBAL_FIELDS = _enum(
+    "MinTxnFee", "MinBalance", "MaxTxnLife", "ZeroAddress", "GroupSize",
+    "LogicSigVersion", "Round", "LatestTimestamp", "CurrentApplicationID",
+    "CreatorAddress", "CurrentApplicationAddress", "GroupID", "OpcodeBudget",
+    "CallerApplicationID", "CallerApplicationAddress",
+)
+
+ASSET_HOLDING_FIELDS = _enum("AssetBalance", "AssetFrozen")
+
+ASSET_PARAMS_FIELDS = _enum(
+    "AssetTotal", "AssetDecimals", "AssetDefaultFrozen", "AssetUnitName", "AssetName",
+    "AssetURL", "AssetMetadataHash", "AssetManager", "AssetReserve", "AssetFreeze",
+    "AssetClawback", "AssetCreator",
+)
+
+APP_PARAMS_FIELDS = _enum(
+    "AppApprovalProgram", "AppClearStateProgram", "AppGlobalNumUint",
+    "AppGlobalNumByteSlice", "AppLocalNumUint", "AppLocalNumByteSlice",
+    "AppExtraProgramPages", "AppCreator", "AppAddress",
+)
+
+ACCT_PARAMS_FIELDS = _enum(
+    "AcctBalance", "AcctMinBalance", "AcctAuthAddr", "AcctTotalNumUint",
+    "AcctTotalNumByteSlice", "AcctTotalExtraAppPages", "AcctTotalAppsCreated",
+    "AcctTotalAppsOptedIn", "AcctTotalAssetsCreated", "AcctTotalAssets",
+    "AcctTotalBoxes", "AcctTotalBoxBytes",
+)
+
+FIELD_TABLES = {
+    "txn_field": TXN_FIELDS,
+    "global_field": GLOBAL_FIELDS,
+    "asset_holding_field": ASSET_HOLDING_FIELDS,
+    "asset_params_field": ASSET_PARAMS_FIELDS,
+    "app_params_field": APP_PARAMS_FIELDS,
+    "acct_params_field": ACCT_PARAMS_FIELDS,
+    "ecdsa_curve": _enum("Secp256k1", "Secp256r1"),
+    "base64_encoding": _enum("URLEncoding", "StdEncoding"),
+    "json_ref_type": _enum("JSONString", "JSONUint64", "JSONObject"),
+    "vrf_standard": _enum("VrfAlgorand"),
+    "block_field": _enum("BlkSeed", "BlkTimestamp"),
+}
+
+# Named constants accepted by the `int` pseudo-op
+NAMED_INTS = {
+    **_enum("NoOp", "OptIn", "CloseOut", "ClearState", "UpdateApplication", "DeleteApplication"),
+    **_enum("unknown", "pay", "keyreg", "acfg", "axfer", "afrz", "appl"),
+}
+
+# Short forms the assembler swaps in for the generic opcode
+_ARRAY_FORMS = {"txn": "txna", "gtxn": "gtxna", "gtxns": "gtxnsa", "itxn": "itxna", "gitxn": "gitxna"}
+
+
+def encode_varuint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varuint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def parse_int(token: str) -> int:
+    if token in NAMED_INTS:
+        return NAMED_INTS[token]
+    try:
+        # Go's ParseUint(s, 0, 64): 0x hex, 0o/leading 0 octal, 0b binary
+        if len(token) > 1 and token[0] == "0" and token[1].isdigit():
+            value = int(token, 8)
+        else:
+            value = int(token, 0)
+    except ValueError:
+        raise AssembleError("unable to parse integer: {}".format(token))
+    if not 0 <= value < 2 ** 64:
+        raise AssembleError("integer out of range: {}".format(token))
+    return value
+
+
+def _b32decode(text: str) -> bytes:
+    return base64.b32decode(text + "=" * (-len(text) % 8))
+
+
+def parse_bytes(args: List[str]) -> Tuple[bytes, int]:
+    """
+    Parse one byte literal from the start of args.
+
+    Returns:
+        tuple: the bytes and the number of tokens consumed
+    """
+    if not args:
+        raise AssembleError("byte literal expected")
+    head = args[0]
+    if head in ("base64", "b64"):
+        return base64.b64decode(args[1]), 2
+    if head in ("base32", "b32"):
+        return _b32decode(args[1]), 2
+    for prefix, decode in (("base64(", base64.b64decode), ("b64(", base64.b64decode),
+                           ("base32(", _b32decode), ("b32(", _b32decode)):
+        if head.startswith(prefix) and head.endswith(")"):
+            return decode(head[len(prefix):-1]), 1
+    if head.startswith("0x"):
+        return bytes.fromhex(head[2:]), 1
+    if head.startswith('"'):
+        return _parse_string_literal(head), 1
+    raise AssembleError("unable to parse byte literal: {}".format(head))
+
+
+def _parse_string_literal(token: str) -> bytes:
+    body = token[1:-1]
+    out = bytearray()
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char != "\\":
+            out += char.encode("utf-8")
+            i += 1
+            continue
+        escape = body[i + 1]
+        if escape == "x":
+            out.append(int(body[i + 2:i + 4], 16))
+            i += 4
+            continue
+        out += {"n": b"\n", "r": b"\r", "t": b"\t", "\\": b"\\", '"': b'"'}[escape]
+        i += 2
+    return bytes(out)
+
+
+def tokenize(line: str) -> List[str]:
+    """Split a line on whitespace, keeping quoted strings (and their escapes) whole."""
+    tokens = []
+    i = 0
+    while i < len(line):
+        if line[i].isspace():
+            i += 1
+            continue
+        if line.startswith("//", i):
+            break
+        start = i
+        if line[i] == '"':
+            i += 1
+            while i < len(line) and line[i] != '"':
+                i += 2 if line[i] == "\\" else 1
+            if i >= len(line):
+                raise AssembleError("unterminated string literal: {}".format(line[start:]))
+            i += 1
+        else:
+            while i < len(line) and not line[i].isspace():
+                i += 1
+        tokens.append(line[start:i])
+    return tokens
+
+
+@dataclass
+class _Instr:
+    op: str
+    args: List[str]
+    line: int
+    # Filled in for the int/byte pseudo-ops
+    const: Union[int, bytes, None] = None
+
+
+@dataclass
+class AssembledProgram:
+    teal: str
+    bytecode: bytes
+    version: int
+    # label -> pc, handy for the profiler and interpreter
+    labels: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def address(self) -> str:
+        return program_address(self.bytecode)
+
+
+def program_address(bytecode: bytes) -> str:
+    """Hash of a program, i.e. the address of the logic signature it defines."""
+    return encoding.encode_address(encoding.checksum(b"Program" + bytecode))
+
+
+def parse(teal: str) -> Tuple[int, List[Union[_Instr, str]]]:
+    """Split TEAL into its version and a list of instructions and label names."""
+    version = 1
+    program: List[Union[_Instr, str]] = []
+    for lineno, raw in enumerate(teal.splitlines(), start=1):
+        tokens = tokenize(raw.strip())
+        if not tokens:
+            continue
+        if tokens[0] == "#pragma":
+            if len(tokens) != 3 or tokens[1] != "version":
+                raise AssembleError("line {}: unsupported pragma".format(lineno))
+            version = int(tokens[2])
+            if version > MAX_SUPPORTED_VERSION:
+                raise AssembleError("TEAL v{} is not supported".format(version))
+            continue
+        while tokens and tokens[0].endswith(":"):
+            program.append(tokens.pop(0)[:-1])
+        if tokens:
+            program.append(_Instr(tokens[0], tokens[1:], lineno))
+    return version, program
+
+
+def _const_value(instr: _Instr) -> Union[int, bytes, None]:
+    if instr.op == "int":
+        return parse_int(instr.args[0])
+    if instr.op == "byte":
+        value, _ = parse_bytes(instr.args)
+        return value
+    if instr.op == "addr":
+        return encoding.decode_address(instr.args[0])
+    if instr.op == "method":
+        signature, _ = parse_bytes(instr.args)
+        return encoding.checksum(signature)[:4]
+    return None
+
+
+def _const_blocks(version: int, program: List[Union[_Instr, str]]):
+    """
+    Decide the intcblock/bytecblock contents.
+
+    Returns:
+        tuple: (intc list, bytec list); constants left out of the blocks are pushed
+    """
+    blocks = {int: [], bytes: []}
+    counts: Dict[Tuple[type, Union[int, bytes]], int] = {}
+    for instr in program:
+        if isinstance(instr, str) or instr.const is None:
+            continue
+        key = (type(instr.const), instr.const)
+        if key not in counts:
+            counts[key] = 0
+            blocks[type(instr.const)].append(instr.const)
+        counts[key] += 1
+
+    if version < OPTIMIZE_CONSTANTS_VERSION:
+        return blocks[int], blocks[bytes]
+
+    def optimize(values):
+        # sorted() is stable, so ties keep the order of first use
+        ordered = sorted(values, key=lambda v: -counts[(type(v), v)])
+        return [v for v in ordered if counts[(type(v), v)] > 1]
+
+    return optimize(blocks[int]), optimize(blocks[bytes])
+
+
+def _const_ref(instr: _Instr, intc: List[int], bytec: List[bytes]) -> bytes:
+    value = instr.const
+    if isinstance(value, int):
+        if value in intc:
+            index = intc.index(value)
+            if index < 4:
+                return bytes([OPS_BY_NAME["intc_0"].opcode + index])
+            return bytes([OPS_BY_NAME["intc"].opcode, index])
+        return bytes([OPS_BY_NAME["pushint"].opcode]) + encode_varuint(value)
+    if value in bytec:
+        index = bytec.index(value)
+        if index < 4:
+            return bytes([OPS_BY_NAME["bytec_0"].opcode + index])
+        return bytes([OPS_BY_NAME["bytec"].opcode, index])
+    return bytes([OPS_BY_NAME["pushbytes"].opcode]) + encode_varuint(len(value)) + value
+
+
+def _field(kind: str, token: str, lineno: int) -> int:
+    table = FIELD_TABLES[kind]
+    if token not in table:
+        raise AssembleError("line {}: unknown {} {}".format(lineno, kind, token))
+    return table[token]
+
+
+def _encode(instr: _Instr, version: int, pc: int, labels: Optional[Dict[str, int]]) -> bytes:
+    """Encode one instruction; without labels branch offsets are placeholders."""
+    name, args = instr.op, instr.args
+
+    # Generic forms that go-algorand rewrites to a dedicated opcode
+    if name in _ARRAY_FORMS and len(args) == len(OPS_BY_NAME[name].immediates) + 1:
+        name = _ARRAY_FORMS[name]
+    if name == "arg" and args and parse_int(args[0]) < 4:
+        name, args = "arg_{}".format(parse_int(args[0])), []
+
+    spec = OPS_BY_NAME.get(name)
+    if spec is None:
+        raise AssembleError("line {}: unknown opcode {}".format(instr.line, name))
+    if spec.version > version:
+        raise AssembleError(
+            "line {}: {} requires TEAL v{}".format(instr.line, name, spec.version)
+        )
+
+    out = bytearray([spec.opcode])
+    i = 0
+    for kind in spec.immediates:
+        if kind in ("labels", "bytes_list", "varuint_list"):
+            rest = args[i:]
+            i = len(args)
+            if kind == "labels":
+                out.append(len(rest))
+                end = pc + len(out) + 2 * len(rest)
+                for label in rest:
+                    out += _offset(labels, label, end, instr.line)
+            elif kind == "varuint_list":
+                out += encode_varuint(len(rest))
+                for token in rest:
+                    out += encode_varuint(parse_int(token))
+            else:
+                values = []
+                while rest:
+                    value, used = parse_bytes(rest)
+                    values.append(value)
+                    rest = rest[used:]
+                out += encode_varuint(len(values))
+                for value in values:
+                    out += encode_varuint(len(value)) + value
+            continue
+
+        if i >= len(args):
+            raise AssembleError("line {}: {} expects {} immediates".format(
+                instr.line, name, len(spec.immediates)))
+        token = args[i]
+        i += 1
+        if kind == "uint8":
+            value = parse_int(token)
+            if value > 255:
+                raise AssembleError("line {}: {} out of range".format(instr.line, token))
+            out.append(value)
+        elif kind == "int8":
+            value = int(token)
+            if not -128 <= value <= 127:
+                raise AssembleError("line {}: {} out of range".format(instr.line, token))
+            out.append(value & 0xFF)
+        elif kind == "varuint":
+            out += encode_varuint(parse_int(token))
+        elif kind == "label":
+            out += _offset(labels, token, pc + len(out) + 2, instr.line)
+        elif kind == "bytes":
+            value, used = parse_bytes(args[i - 1:])
+            i += used - 1
+            out += encode_varuint(len(value)) + value
+        elif kind == "intcblock":
+            values = [parse_int(t) for t in args]
+            i = len(args)
+            out += encode_varuint(len(values))
+            for value in values:
+                out += encode_varuint(value)
+        elif kind == "bytecblock":
+            values = []
+            rest = args
+            while rest:
+                value, used = parse_bytes(rest)
+                values.append(value)
+                rest = rest[used:]
+            i = len(args)
+            out += encode_varuint(len(values))
+            for value in values:
+                out += encode_varuint(len(value)) + value
+        else:
+            out.append(_field(kind, token, instr.line))
+
+    if i != len(args):
+        raise AssembleError("line {}: too many immediates for {}".format(instr.line, name))
+    return bytes(out)
+
+
+def _offset(labels: Optional[Dict[str, int]], label: str, end: int, lineno: int) -> bytes:
+    if labels is None:
+        return b"\x00\x00"
+    if label not in labels:
+        raise AssembleError("line {}: reference to undefined label {}".format(lineno, label))
+    offset = labels[label] - end
+    if not -0x8000 <= offset < 0x8000:
+        raise AssembleError("line {}: branch to {} is too far".format(lineno, label))
+    return (offset & 0xFFFF).to_bytes(2, "big")
+
+
+def assemble(teal: str) -> AssembledProgram:
+    """
+    Assemble TEAL into bytecode byte-identical to algod's /v2/teal/compile.
+
+    Args:
+        teal (str): TEAL source, as emitted by PyTeal's compileTeal
+    Returns:
+        AssembledProgram: bytecode, version and label offsets
+    """
+    version, program = parse(teal)
+    for instr in program:
+        if isinstance(instr, _Instr) and instr.op in ("int", "byte", "addr", "method"):
+            instr.const = _const_value(instr)
+    intc, bytec = _const_blocks(version, program)
+
+    def encode_all(labels):
+        code = bytearray()
+        positions = {}
+        for instr in program:
+            if isinstance(instr, str):
+                positions[instr] = len(code)
+            elif instr.const is not None:
+                code += _const_ref(instr, intc, bytec)
+            else:
+                code += _encode(instr, version, len(code), labels)
+        return bytes(code), positions
+
+    # Instruction sizes don't depend on label offsets, so two passes are enough
+    _, labels = encode_all(None)
+    code, _ = encode_all(labels)
+
+    header = bytearray(encode_varuint(version))
+    if intc:
+        header.append(OPS_BY_NAME["intcblock"].opcode)
+        header += encode_varuint(len(intc))
+        for value in intc:
+            header += encode_varuint(value)
+    if bytec:
+        header.append(OPS_BY_NAME["bytecblock"].opcode)
+        header += encode_varuint(len(bytec))
+        for value in bytec:
+            header += encode_varuint(len(value)) + value
+
+    # Branches are relative, so prepending the constant blocks keeps them valid
+    offset = len(header)
+    return AssembledProgram(
+        teal=teal,
+        bytecode=bytes(header) + code,
+        version=version,
+        labels={label: pc + offset for label, pc in labels.items()},
+    )
+
+
+def cross_check(algod_client, teal: str, program: Optional[AssembledProgram] = None) -> AssembledProgram:
+    """
+    Assemble locally and compare against algod, raising AssembleError on any difference.
+
+    Args:
+        algod_client (AlgodClient): node used as the reference assembler
+        teal (str): TEAL source
+        program (AssembledProgram, optional): already assembled program to check
+    Returns:
+        AssembledProgram: the verified program
+    """
+    if program is None:
+        program = assemble(teal)
+    response = algod_client.compile(teal)
+    expected = base64.b64decode(response["result"])
+    if expected != program.bytecode:
+        raise AssembleError(
+            "offline assembly differs from algod: {} != {}".format(
+                program.bytecode.hex(), expected.hex()
+            )
+        )
+    if response["hash"] != program.address:
+        raise AssembleError("program hash differs from algod: {}".format(response["hash"]))
+    return program
@@ -0,0 +1,272 @@
+import ast
+import functools
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = os.getenv("IPFS_SC_CACHE_DIR", "./.compile_cache")
+# Modules below this directory are part of the TEAL key, see project_sources
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+PRAGMA_RE = re.compile(r"^\s*#pragma\s+version\s+(\d+)", re.MULTILINE)
+
+
+def teal_version(teal: str) -> int:
+    match = PRAGMA_RE.search(teal)
+    return int(match.group(1)) if match else 1
+
+
+def pyteal_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("pyteal")
+    except Exception:
+        return "unknown"
+
+
+def _locate(name: str) -> Tuple[Optional[str], str]:
+    # File and package of a module, found without importing it: imports inside
+    # functions may not have run yet
+    module = sys.modules.get(name)
+    if module is not None:
+        return getattr(module, "__file__", None), module.__package__ or ""
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None or not spec.has_location:
+        return None, ""
+    return spec.origin, spec.parent
+
+
+def _imported_names(source: str, package: str) -> Iterator[str]:
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                base = importlib.util.resolve_name("." * node.level + base, package)
+            yield base
+            # from package import submodule
+            for alias in node.names:
+                yield base + "." + alias.name
+
+
+def project_sources(module, root: str = PROJECT_ROOT) -> List[Tuple[str, str]]:
+    """
+    Sources of `module` and of every module below `root` it imports, directly
+    or through other project modules, as sorted (name, source) pairs.
+
+    Modules outside the project (pyteal, the standard library) are left out,
+    pyteal_version covers them.
+    """
+    root = os.path.abspath(root) + os.sep
+    sources = {}
+    pending = [module.__name__]
+    while pending:
+        name = pending.pop()
+        if name in sources:
+            continue
+        file_path, package = _locate(name)
+        if file_path is None:
+            continue
+        file_path = os.path.abspath(file_path)
+        if not file_path.startswith(root) or "site-packages" in file_path:
+            continue
+        with open(file_path, encoding="utf-8") as f:
+            sources[name] = f.read()
+        pending.extend(_imported_names(sources[name], package))
+    return sorted(sources.items())
+
+
+def source_version(module, root: str = PROJECT_ROOT) -> str:
+    """
+    Identify code by a hash of the project sources behind it, e.g.
+    "pyteal_helpers.assembler-3f0c9e1a2b4d5c6e". Like the TEAL key, it changes
+    with any edit to the module or to a project module it imports.
+    """
+    h = hashlib.sha256()
+    for name, source in project_sources(module, root):
+        h.update(name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(source.encode("utf-8"))
+        h.update(b"\0")
+    return "{}-{}".format(module.__name__, h.hexdigest()[:16])
+
+
+@functools.lru_cache(maxsize=None)
+def assembler_version() -> str:
+    """
+    Compiler identity of the offline assembler for CompileCache.bytecode, see
+    source_version. Hashed once per process.
+    """
+    from . import assembler
+
+    return source_version(assembler)
+
+
+def algod_build_version(algod_client) -> str:
+    """
+    Identify the compiler behind an algod node, e.g. "algod-3.5.1-c0f2e5c0".
+
+    The result is memoized on the client object so that it costs a single
+    /versions round trip per client.
+    """
+    cached = getattr(algod_client, "_compile_cache_build", None)
+    if cached is None:
+        build = algod_client.versions()["build"]
+        cached = "algod-{}.{}.{}-{}".format(
+            build["major"], build["minor"], build["build_number"], build["commit_hash"]
+        )
+        algod_client._compile_cache_build = cached
+    return cached
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def __str__(self) -> str:
+        return f"compile cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+
+
+class CompileCache:
+    """
+    Persistent, content-addressed cache for both halves of a build:
+
+        PyTeal -> TEAL      keyed by the sources of the module defining the
+                            program function and of the project modules it
+                            imports, its arguments and the pyteal version
+        TEAL -> bytecode    keyed by the TEAL source, its #pragma version and
+                            the compiler (algod build) version
+
+    Entries are plain files under `path`; the least recently used ones are
+    evicted once either `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_DIR,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        project_root: str = PROJECT_ROOT,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.project_root = project_root
+        self.stats = CacheStats()
+
+    def teal(self, program_fn: Callable, *args, render: Optional[Callable] = None) -> str:
+        """
+        Return the TEAL for `program_fn(*args)`, building it only on a miss.
+
+        Args:
+            program_fn (callable): contract entry point, e.g. step_01.approval
+            args: arguments passed to program_fn, part of the key
+            render (callable, optional): turns (program_fn, *args) into TEAL,
+                defaults to calling program_fn directly
+        Returns:
+            str: TEAL source
+        """
+        module = sys.modules[program_fn.__module__]
+        # Constants such as DIGEST_SIZE come from other project modules
+        sources = project_sources(module, self.project_root)
+        key = self._key(
+            "teal",
+            *[part for name_source in sources for part in name_source],
+            program_fn.__qualname__,
+            repr(args),
+            pyteal_version(),
+        )
+        cached = self._read(key, ".teal")
+        if cached is not None:
+            return cached.decode("utf-8")
+
+        teal = render(program_fn, *args) if render else program_fn(*args)
+        self._write(key, ".teal", teal.encode("utf-8"))
+        return teal
+
+    def bytecode(self, teal: str, compile_fn: Callable[[str], bytes], compiler: str) -> bytes:
+        """
+        Return the bytecode for `teal`, calling `compile_fn` only on a miss.
+
+        Args:
+            teal (str): TEAL source
+            compile_fn (callable): TEAL -> bytecode, e.g. an algod round trip
+            compiler (str): compiler identity, see algod_build_version
+        Returns:
+            bytes: assembled program
+        """
+        key = self._key("bytecode", teal, str(teal_version(teal)), compiler)
+        cached = self._read(key, ".bin")
+        if cached is not None:
+            return cached
+
+        bytecode = compile_fn(teal)
+        self._write(key, ".bin", bytecode)
+        return bytecode
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        for entry in os.scandir(self.path):
+            os.remove(entry.path)
+
+    def _key(self, *parts: str) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _read(self, key: str, suffix: str) -> Optional[bytes]:
+        file_path = os.path.join(self.path, key + suffix)
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return None
+        # Touch the entry so eviction sees it as recently used
+        os.utime(file_path)
+        self.stats.hits += 1
+        return data
+
+    def _write(self, key: str, suffix: str, data: bytes):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, key + suffix)
+        tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        # Atomic so that parallel builds never read a half written entry
+        os.replace(tmp_path, file_path)
+        self._evict()
+
+    def _evict(self):
+        entries = [
+            (e.stat().st_mtime, e.stat().st_size, e.path)
+            for e in os.scandir(self.path)
+            if not e.name.endswith(".tmp")
+        ]
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, oldest = entries.pop(0)
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.stats.evictions += 1
@@ -0,0 +1,2073 @@
+"""
+Offline TEAL interpreter.
+
+Runs application programs against an in-memory ledger, without a node. Programs
+are executed from their bytecode (see `assembler.assemble`), so anything algod
+would be sent can be run as is:
+
+    ledger = Ledger()
+    ledger.fund(creator, 10_000_000)
+    create, = ledger.execute([app_create(creator, assemble(approval()).bytecode, ...)])
+    app_id = create.created_app_id
+
+Transactions are dicts keyed by TEAL field name ("Sender", "Fee", "ApplicationArgs",
+...), with addresses as raw 32 byte public keys; `txn_fields` converts algosdk
+transactions and the msgpack dicts algod receives. A group is applied atomically:
+on any failure the ledger is rolled back and a TealError is raised.
+
+Modelled: application mode of TEAL v1-v8 with global and local state, scratch
+space, boxes, pooled opcode budget and fees, and inner payments. Logic signature
+mode, assets, inner application calls and the crypto opcodes without a Python
+implementation (ecdsa, vrf) are not, and fail with a TealError.
+"""
+import base64
+import hashlib
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from algosdk import encoding
+from Cryptodome.Hash import keccak
+
+from .assembler import FIELD_TABLES, NAMED_INTS, OPS_BY_OPCODE, OpSpec, decode_varuint
+
+MIN_TXN_FEE = 1000
+MIN_BALANCE = 100000
+MAX_TXN_LIFE = 1000
+OPCODE_BUDGET = 700
+MAX_GROUP_SIZE = 16
+MAX_INNER_TXNS = 256
+
+MAX_STACK_DEPTH = 1000
+MAX_BYTES_SIZE = 4096
+MAX_CALL_DEPTH = 8 * 1024
+MAX_NOTE_SIZE = 1024
+MAX_KEY_SIZE = 64
+MAX_KEY_VALUE_SIZE = 128
+MAX_BOX_SIZE = 32768
+BOX_IO_PER_REF = 1024
+
+# Minimum balance of created apps, opt-ins and boxes
+APP_FLAT_MIN_BALANCE = 100000
+SCHEMA_UINT_MIN_BALANCE = 28500
+SCHEMA_BYTES_MIN_BALANCE = 50000
+BOX_FLAT_MIN_BALANCE = 2500
+BOX_BYTE_MIN_BALANCE = 400
+
+ZERO_ADDRESS = bytes(32)
+UINT64_MAX = 2 ** 64 - 1
+
+NO_OP, OPT_IN, CLOSE_OUT, CLEAR_STATE, UPDATE_APPLICATION, DELETE_APPLICATION = range(6)
+TYPE_ENUMS = {name: NAMED_INTS[name] for name in ("pay", "keyreg", "acfg", "axfer", "afrz", "appl")}
+TYPE_NAMES = {value: name for name, value in TYPE_ENUMS.items()}
+
+StackValue = Union[int, bytes]
+
+
+class TealError(Exception):
+    """
+    A transaction of the group failed, the ledger is left as it was.
+    """
+
+    def __init__(self, message, txn_index=None, pc=None, op=None, trace=None):
+        self.message = message
+        self.txn_index = txn_index
+        self.pc = pc
+        self.op = op
+        self.trace = trace
+        super().__init__(message)
+
+    def __str__(self):
+        where = []
+        if self.txn_index is not None:
+            where.append("txn {}".format(self.txn_index))
+        if self.pc is not None:
+            where.append("pc {} ({})".format(self.pc, self.op))
+        return "{}: {}".format(", ".join(where), self.message) if where else self.message
+
+
+class TealReject(TealError):
+    """
+    A program ran to completion and rejected the transaction.
+    """
+
+
+@dataclass
+class TraceStep:
+    app_id: int
+    pc: int
+    op: str
+    immediates: tuple
+    cost: int
+    # Stack after the instruction ran
+    stack: Tuple[StackValue, ...]
+
+
+@dataclass
+class TxnResult:
+    txn: dict
+    app_id: int = 0
+    created_app_id: int = 0
+    # key -> new value, None for deleted keys
+    global_delta: Dict[bytes, Optional[StackValue]] = field(default_factory=dict)
+    local_deltas: Dict[bytes, Dict[bytes, Optional[StackValue]]] = field(default_factory=dict)
+    logs: List[bytes] = field(default_factory=list)
+    inner: List["TxnResult"] = field(default_factory=list)
+    cost: int = 0
+    trace: List[TraceStep] = field(default_factory=list)
+
+
+@dataclass
+class App:
+    id: int
+    creator: bytes
+    approval: bytes
+    clear: bytes
+    global_schema: Tuple[int, int] = (0, 0)
+    local_schema: Tuple[int, int] = (0, 0)
+    extra_pages: int = 0
+    global_state: Dict[bytes, StackValue] = field(default_factory=dict)
+
+    @property
+    def address(self) -> bytes:
+        return app_address(self.id)
+
+
+@lru_cache(maxsize=4096)
+def app_address(app_id: int) -> bytes:
+    return encoding.checksum(b"appID" + app_id.to_bytes(8, "big"))
+
+
+def _app_min_balance(uints: int, byte_slices: int, extra_pages: int = 0) -> int:
+    return (APP_FLAT_MIN_BALANCE * (1 + extra_pages)
+            + SCHEMA_UINT_MIN_BALANCE * uints + SCHEMA_BYTES_MIN_BALANCE * byte_slices)
+
+
+def box_min_balance(name: bytes, size: int) -> int:
+    return BOX_FLAT_MIN_BALANCE + BOX_BYTE_MIN_BALANCE * (len(name) + size)
+
+
+# Transaction fields ---------------------------------------------------------
+
+ADDRESS_FIELDS = {
+    "Sender", "Receiver", "CloseRemainderTo", "AssetSender", "AssetReceiver",
+    "AssetCloseTo", "RekeyTo", "ConfigAssetManager", "ConfigAssetReserve",
+    "ConfigAssetFreeze", "ConfigAssetClawback", "FreezeAssetAccount",
+}
+BYTES_FIELDS = ADDRESS_FIELDS | {
+    "Note", "Lease", "Type", "VotePK", "SelectionPK", "TxID", "ApprovalProgram",
+    "ClearStateProgram", "ConfigAssetUnitName", "ConfigAssetName", "ConfigAssetURL",
+    "ConfigAssetMetadataHash", "StateProofPK", "LastLog",
+}
+# Fixed size byte fields read as zeros when unset
+_ZERO_FIELDS = {name: bytes(32) for name in ADDRESS_FIELDS | {"Lease", "TxID", "VotePK", "SelectionPK"}}
+_ZERO_FIELDS["StateProofPK"] = bytes(64)
+
+# msgpack (wire) key -> TEAL field name
+MSGPACK_FIELDS = {
+    "snd": "Sender", "fee": "Fee", "fv": "FirstValid", "lv": "LastValid", "note": "Note",
+    "lx": "Lease", "rcv": "Receiver", "amt": "Amount", "close": "CloseRemainderTo",
+    "type": "Type", "rekey": "RekeyTo", "grp": "Group", "apid": "ApplicationID",
+    "apan": "OnCompletion", "apaa": "ApplicationArgs", "apat": "Accounts",
+    "apfa": "Applications", "apas": "Assets", "apap": "ApprovalProgram",
+    "apsu": "ClearStateProgram", "apep": "ExtraProgramPages", "xaid": "XferAsset",
+    "aamt": "AssetAmount", "asnd": "AssetSender", "arcv": "AssetReceiver",
+    "aclose": "AssetCloseTo", "caid": "ConfigAsset", "faid": "FreezeAsset",
+    "fadd": "FreezeAssetAccount", "afrz": "FreezeAssetFrozen", "votekey": "VotePK",
+    "selkey": "SelectionPK", "votefst": "VoteFirst", "votelst": "VoteLast",
+    "votekd": "VoteKeyDilution", "nonpart": "Nonparticipation", "sprfkey": "StateProofPK",
+}
+_FIELD_KEYS = {name: key for key, name in MSGPACK_FIELDS.items()}
+_SCHEMA_KEYS = {"apgs": ("GlobalNumUint", "GlobalNumByteSlice"), "apls": ("LocalNumUint", "LocalNumByteSlice")}
+
+
+def txn_fields(txn) -> dict:
+    """
+    TEAL field dict of a transaction.
+
+    Args:
+        txn: algosdk Transaction or SignedTransaction, or a msgpack dict as
+            algod receives it (signed or not)
+    Returns:
+        dict: fields by TEAL name, see the module docstring
+    """
+    if hasattr(txn, "transaction"):
+        txn = txn.transaction
+    if hasattr(txn, "dictify"):
+        txn = txn.dictify()
+    if "txn" in txn:
+        txn = txn["txn"]
+    fields = {}
+    for key, value in txn.items():
+        if key in MSGPACK_FIELDS:
+            fields[MSGPACK_FIELDS[key]] = value
+        elif key in _SCHEMA_KEYS:
+            uints, byte_slices = _SCHEMA_KEYS[key]
+            fields[uints] = value.get("nui", 0)
+            fields[byte_slices] = value.get("nbs", 0)
+        elif key == "apbx":
+            fields["Boxes"] = [(box.get("i", 0), box.get("n", b"")) for box in value]
+    if isinstance(fields.get("Type"), str):
+        fields["Type"] = fields["Type"].encode()
+    fields["_wire"] = dict(txn)
+    return _normalize(fields)
+
+
+def txn_dict(fields: dict) -> dict:
+    """
+    The msgpack dict of a transaction given by its TEAL fields, e.g. of an inner
+    transaction, with zero values left out like algod does.
+    """
+    out = {}
+    for name, value in fields.items():
+        key = _FIELD_KEYS.get(name)
+        if key is None or not value or (name in _ZERO_FIELDS and value == _ZERO_FIELDS[name]):
+            continue
+        out[key] = value.decode() if name == "Type" else value
+    for key, (uints, byte_slices) in _SCHEMA_KEYS.items():
+        schema = {"nui": fields.get(uints, 0), "nbs": fields.get(byte_slices, 0)}
+        schema = {k: v for k, v in schema.items() if v}
+        if schema:
+            out[key] = schema
+    if fields.get("Boxes"):
+        out["apbx"] = [{k: v for k, v in (("i", i), ("n", n)) if v} for i, n in fields["Boxes"]]
+    return out
+
+
+def _normalize(fields: dict) -> dict:
+    if "Type" in fields and "TypeEnum" not in fields:
+        fields["TypeEnum"] = TYPE_ENUMS.get(fields["Type"].decode(), 0)
+    elif "TypeEnum" in fields and "Type" not in fields:
+        fields["Type"] = TYPE_NAMES.get(fields["TypeEnum"], "unknown").encode()
+    return fields
+
+
+def _txid(fields: dict) -> bytes:
+    wire = fields.get("_wire") or txn_dict(fields)
+    return encoding.checksum(b"TX" + base64.b64decode(encoding.msgpack_encode(dict(wire))))
+
+
+def payment(sender: bytes, receiver: bytes, amount: int, fee: int = MIN_TXN_FEE, note: bytes = b"", **extra) -> dict:
+    return _normalize({"Type": b"pay", "Sender": sender, "Receiver": receiver,
+                       "Amount": amount, "Fee": fee, "Note": note, **extra})
+
+
+def app_call(sender: bytes, app_id: int, args=(), accounts=(), fee: int = MIN_TXN_FEE,
+             on_completion: int = NO_OP, apps=(), boxes=(), **extra) -> dict:
+    """
+    App call fields; int args are encoded like algosdk does, boxes are
+    (app index, name) references.
+    """
+    return _normalize({
+        "Type": b"appl", "Sender": sender, "ApplicationID": app_id, "Fee": fee,
+        "OnCompletion": on_completion,
+        "ApplicationArgs": [arg.to_bytes(8, "big") if isinstance(arg, int) else
+                            arg.encode() if isinstance(arg, str) else arg for arg in args],
+        "Accounts": list(accounts), "Applications": list(apps), "Boxes": list(boxes), **extra
+    })
+
+
+def app_create(sender: bytes, approval: bytes, clear: bytes, global_schema=(0, 0), local_schema=(0, 0),
+               args=(), fee: int = MIN_TXN_FEE, **extra) -> dict:
+    return app_call(
+        sender, 0, args, fee=fee, ApprovalProgram=approval, ClearStateProgram=clear,
+        GlobalNumUint=global_schema[0], GlobalNumByteSlice=global_schema[1],
+        LocalNumUint=local_schema[0], LocalNumByteSlice=local_schema[1], **extra
+    )
+
+
+# Bytecode -------------------------------------------------------------------
+
+_FIELD_NAMES = {kind: {value: name for name, value in table.items()} for kind, table in FIELD_TABLES.items()}
+
+
+@dataclass
+class _Instr:
+    spec: OpSpec
+    immediates: tuple
+    next_pc: int
+    handler: Callable
+
+
+@dataclass
+class _Code:
+    version: int
+    # indexed by pc, None inside instructions
+    instrs: List[Optional[_Instr]]
+    # pc of the first instruction, after the version
+    start: int
+    size: int
+
+
+@lru_cache(maxsize=256)
+def decode_program(bytecode: bytes) -> _Code:
+    """
+    Decode bytecode into instructions keyed by pc, with branch targets resolved
+    to absolute pcs and fields to their names.
+    """
+    if not bytecode:
+        raise TealError("empty program")
+    version, pc = decode_varuint(bytecode, 0)
+    first = pc
+    instrs = {}
+    size = len(bytecode)
+    try:
+        while pc < size:
+            start = pc
+            spec = OPS_BY_OPCODE.get(bytecode[pc])
+            if spec is None or spec.version > version:
+                raise TealError("invalid opcode 0x{:02x}".format(bytecode[pc]), pc=pc)
+            pc += 1
+            immediates = []
+            for kind in spec.immediates:
+                if kind == "uint8":
+                    immediates.append(bytecode[pc])
+                    pc += 1
+                elif kind == "int8":
+                    immediates.append(bytecode[pc] - 256 if bytecode[pc] > 127 else bytecode[pc])
+                    pc += 1
+                elif kind == "varuint":
+                    value, pc = decode_varuint(bytecode, pc)
+                    immediates.append(value)
+                elif kind == "label":
+                    offset = int.from_bytes(bytecode[pc:pc + 2], "big", signed=True)
+                    pc += 2
+                    immediates.append(pc + offset)
+                elif kind == "labels":
+                    count = bytecode[pc]
+                    offsets = [int.from_bytes(bytecode[pc + 1 + 2 * i:pc + 3 + 2 * i], "big", signed=True)
+                               for i in range(count)]
+                    pc += 1 + 2 * count
+                    immediates.append(tuple(pc + offset for offset in offsets))
+                elif kind == "bytes":
+                    length, pc = decode_varuint(bytecode, pc)
+                    immediates.append(bytecode[pc:pc + length])
+                    pc += length
+                elif kind in ("bytecblock", "bytes_list"):
+                    count, pc = decode_varuint(bytecode, pc)
+                    values = []
+                    for _ in range(count):
+                        length, pc = decode_varuint(bytecode, pc)
+                        values.append(bytecode[pc:pc + length])
+                        pc += length
+                    immediates.append(tuple(values))
+                elif kind in ("intcblock", "varuint_list"):
+                    count, pc = decode_varuint(bytecode, pc)
+                    values = []
+                    for _ in range(count):
+                        value, pc = decode_varuint(bytecode, pc)
+                        values.append(value)
+                    immediates.append(tuple(values))
+                else:
+                    name = _FIELD_NAMES[kind].get(bytecode[pc])
+                    if name is None:
+                        raise TealError("invalid {} {}".format(kind, bytecode[pc]), pc=start)
+                    immediates.append(name)
+                    pc += 1
+            if pc > size:
+                raise TealError("truncated {}".format(spec.name), pc=start)
+            if spec.name == "callsub":
+                # where retsub returns to
+                immediates.append(pc)
+            instrs[start] = _Instr(spec, tuple(immediates), pc, _OPS[spec.name])
+    except IndexError:
+        raise TealError("truncated program")
+    return _Code(version, [instrs.get(pc) for pc in range(size)], first, size)
+
+
+# Ledger ---------------------------------------------------------------------
+
+_MISSING = object()
+
+
+class Ledger:
+    """
+    Balances, apps, local states and boxes, changed only by `execute`.
+
+    Args:
+        round_num (int): round reported to programs
+        timestamp (int): LatestTimestamp reported to programs
+        min_fee (int): minimum fee per transaction
+        first_app_id (int): id of the first app created
+    """
+
+    def __init__(self, round_num: int = 1, timestamp: int = 0, min_fee: int = MIN_TXN_FEE, first_app_id: int = 1):
+        self.round = round_num
+        self.timestamp = timestamp
+        self.min_fee = min_fee
+        self.next_app_id = first_app_id
+        self.balances: Dict[bytes, int] = {}
+        # Minimum balance on top of MIN_BALANCE, from created apps, opt-ins and boxes
+        self.min_balance_extra: Dict[bytes, int] = {}
+        self.apps: Dict[int, App] = {}
+        self.local_states: Dict[Tuple[bytes, int], Dict[bytes, StackValue]] = {}
+        self.boxes: Dict[Tuple[int, bytes], bytes] = {}
+        self._journal: List[tuple] = []
+
+    def fund(self, address: bytes, amount: int):
+        """Credits an account out of thin air, outside of any group."""
+        self.balances[address] = self.balances.get(address, 0) + amount
+
+    def balance(self, address: bytes) -> int:
+        return self.balances.get(address, 0)
+
+    def min_balance(self, address: bytes) -> int:
+        return MIN_BALANCE + self.min_balance_extra.get(address, 0)
+
+    def global_state(self, app_id: int) -> Dict[bytes, StackValue]:
+        return dict(self.apps[app_id].global_state)
+
+    def local_state(self, address: bytes, app_id: int) -> Optional[Dict[bytes, StackValue]]:
+        state = self.local_states.get((address, app_id))
+        return None if state is None else dict(state)
+
+    def app_boxes(self, app_id: int) -> Dict[bytes, bytes]:
+        return {name: value for (owner, name), value in self.boxes.items() if owner == app_id}
+
+    def execute(self, txns: list, trace: bool = False) -> List[TxnResult]:
+        """
+        Applies a group atomically.
+
+        Args:
+            txns (list): field dicts or anything `txn_fields` takes
+            trace (bool): record every instruction run in the results
+        Returns:
+            list: a TxnResult per transaction
+        Raises:
+            TealError: on any failure, TealReject if a program rejected
+        """
+        txns = [dict(txn) if isinstance(txn, dict) and "Type" in txn else txn_fields(txn) for txn in txns]
+        next_app_id = self.next_app_id
+        self._journal = []
+        try:
+            return _Group(self, txns, trace).run()
+        except BaseException:
+            self._rollback()
+            self.next_app_id = next_app_id
+            raise
+        finally:
+            self._journal = []
+
+    # Journaled writes, undone if the group fails
+
+    def _put(self, table: dict, key, value):
+        self._journal.append((table, key, table.get(key, _MISSING)))
+        table[key] = value
+
+    def _del(self, table: dict, key):
+        self._journal.append((table, key, table.get(key, _MISSING)))
+        table.pop(key, None)
+
+    def _rollback(self, mark: int = 0):
+        journal = self._journal
+        while len(journal) > mark:
+            table, key, old = journal.pop()
+            if old is _MISSING:
+                table.pop(key, None)
+            else:
+                table[key] = old
+
+    def _add_min_balance(self, address: bytes, delta: int):
+        self._put(self.min_balance_extra, address, self.min_balance_extra.get(address, 0) + delta)
+
+    def _move(self, sender: bytes, receiver: bytes, amount: int, fee: int = 0):
+        balance = self.balances.get(sender, 0)
+        if balance < amount + fee:
+            raise TealError("overspend: {} has {}, needs {}".format(
+                encoding.encode_address(sender), balance, amount + fee))
+        self._put(self.balances, sender, balance - amount - fee)
+        self._put(self.balances, receiver, self.balances.get(receiver, 0) + amount)
+
+
+# Group evaluation -----------------------------------------------------------
+
+class _Group:
+
+    def __init__(self, ledger: Ledger, txns: List[dict], trace: bool):
+        if not 0 < len(txns) <= MAX_GROUP_SIZE:
+            raise TealError("group of {} transactions".format(len(txns)))
+        self.ledger = ledger
+        self.txns = txns
+        self.trace = trace
+        for index, txn in enumerate(txns):
+            txn["GroupIndex"] = index
+        self.group_id = txns[0].get("Group", ZERO_ADDRESS) if len(txns) > 1 else ZERO_ADDRESS
+        self.results: List[Optional[TxnResult]] = [None] * len(txns)
+        self.scratch: Dict[int, list] = {}
+        app_calls = sum(1 for txn in txns if txn.get("TypeEnum") == TYPE_ENUMS["appl"])
+        self.budget = OPCODE_BUDGET * app_calls
+        self.fee_credit = sum(txn.get("Fee", 0) for txn in txns) - ledger.min_fee * len(txns)
+        if self.fee_credit < 0:
+            raise TealError("group fees of {} are below the minimum of {}".format(
+                self.fee_credit + ledger.min_fee * len(txns), ledger.min_fee * len(txns)))
+        self.inner_txns = 0
+        self.box_quota = BOX_IO_PER_REF * sum(len(txn.get("Boxes", ())) for txn in txns)
+        # box -> size counted against the quota
+        self.box_io: Dict[Tuple[int, bytes], int] = {}
+
+    def run(self) -> List[TxnResult]:
+        for index, txn in enumerate(self.txns):
+            touched = set()
+            try:
+                self.results[index] = self.apply(txn, touched)
+                self.check_min_balances(touched)
+            except TealError as e:
+                if e.txn_index is None:
+                    e.txn_index = index
+                raise
+        return self.results
+
+    def check_min_balances(self, touched):
+        ledger = self.ledger
+        for address in touched:
+            # Closed accounts are gone, every other one has to keep its minimum
+            if address not in ledger.balances:
+                continue
+            balance = ledger.balances[address]
+            if balance < ledger.min_balance(address):
+                raise TealError("{} balance {} below min {}".format(
+                    encoding.encode_address(address), balance, ledger.min_balance(address)))
+
+    def apply(self, txn: dict, touched: set, caller: Optional["_Eval"] = None) -> TxnResult:
+        kind = txn.get("TypeEnum")
+        sender = txn.get("Sender", ZERO_ADDRESS)
+        touched.add(sender)
+        if kind == TYPE_ENUMS["pay"]:
+            self.pay(txn, touched)
+            return TxnResult(txn)
+        if kind == TYPE_ENUMS["appl"]:
+            if caller is not None:
+                raise TealError("inner application calls are not supported")
+            self.ledger._move(sender, sender, 0, txn.get("Fee", 0))
+            return self.call(txn, touched)
+        raise TealError("{} transactions are not supported".format(txn.get("Type", b"").decode()))
+
+    def pay(self, txn: dict, touched: set):
+        ledger = self.ledger
+        sender = txn.get("Sender", ZERO_ADDRESS)
+        receiver = txn.get("Receiver", ZERO_ADDRESS)
+        touched.add(receiver)
+        ledger._move(sender, receiver, txn.get("Amount", 0), txn.get("Fee", 0))
+        close_to = txn.get("CloseRemainderTo", ZERO_ADDRESS)
+        if close_to != ZERO_ADDRESS:
+            if ledger.min_balance_extra.get(sender):
+                raise TealError("cannot close an account holding apps, opt-ins or boxes")
+            touched.add(close_to)
+            ledger._move(sender, close_to, ledger.balances.get(sender, 0))
+            ledger._del(ledger.balances, sender)
+
+    def call(self, txn: dict, touched: set) -> TxnResult:
+        ledger = self.ledger
+        sender = txn.get("Sender", ZERO_ADDRESS)
+        app_id = txn.get("ApplicationID", 0)
+        on_completion = txn.get("OnCompletion", NO_OP)
+        result = TxnResult(txn)
+        if app_id == 0:
+            app_id = ledger.next_app_id
+            ledger.next_app_id += 1
+            app = App(
+                app_id, sender, txn.get("ApprovalProgram", b""), txn.get("ClearStateProgram", b""),
+                (txn.get("GlobalNumUint", 0), txn.get("GlobalNumByteSlice", 0)),
+                (txn.get("LocalNumUint", 0), txn.get("LocalNumByteSlice", 0)),
+                txn.get("ExtraProgramPages", 0)
+            )
+            ledger._put(ledger.apps, app_id, app)
+            ledger._add_min_balance(sender, _app_min_balance(*app.global_schema, app.extra_pages))
+            result.created_app_id = app_id
+        app = ledger.apps.get(app_id)
+        if app is None:
+            raise TealError("application {} does not exist".format(app_id))
+        result.app_id = app_id
+        local_key = (sender, app_id)
+
+        if on_completion == CLEAR_STATE:
+            if local_key not in ledger.local_states:
+                raise TealError("{} is not opted in to {}".format(encoding.encode_address(sender), app_id))
+            mark = len(ledger._journal)
+            try:
+                _Eval(self, txn, result, app, app.clear).run()
+            except TealError:
+                # The clear program can't stop the opt out, only its effects are dropped
+                ledger._rollback(mark)
+            self.close_out(sender, app)
+            return result
+
+        if on_completion == OPT_IN:
+            if local_key in ledger.local_states:
+                raise TealError("{} is already opted in to {}".format(encoding.encode_address(sender), app_id))
+            ledger._put(ledger.local_states, local_key, {})
+            ledger._add_min_balance(sender, _app_min_balance(*app.local_schema))
+
+        approved = _Eval(self, txn, result, app, app.approval).run()
+        if not approved:
+            raise TealReject("rejected by approval program of {}".format(app_id), trace=result.trace)
+
+        if on_completion == CLOSE_OUT:
+            if local_key not in ledger.local_states:
+                raise TealError("{} is not opted in to {}".format(encoding.encode_address(sender), app_id))
+            self.close_out(sender, app)
+        elif on_completion == UPDATE_APPLICATION:
+            updated = App(app.id, app.creator, txn.get("ApprovalProgram", b""), txn.get("ClearStateProgram", b""),
+                          app.global_schema, app.local_schema, app.extra_pages, app.global_state)
+            ledger._put(ledger.apps, app_id, updated)
+        elif on_completion == DELETE_APPLICATION:
+            ledger._del(ledger.apps, app_id)
+            ledger._add_min_balance(app.creator, -_app_min_balance(*app.global_schema, app.extra_pages))
+            touched.add(app.creator)
+        return result
+
+    def close_out(self, address: bytes, app: App):
+        ledger = self.ledger
+        ledger._del(ledger.local_states, (address, app.id))
+        ledger._add_min_balance(address, -_app_min_balance(*app.local_schema))
+
+
+def _uint(value: StackValue, op: str) -> int:
+    if value.__class__ is not int:
+        raise TealError("{} expects a uint64, got bytes".format(op))
+    return value
+
+
+def _bytes(value: StackValue, op: str) -> bytes:
+    if value.__class__ is not bytes:
+        raise TealError("{} expects bytes, got a uint64".format(op))
+    return value
+
+
+class _Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+class _Eval:
+    """
+    One program run: stack, scratch, call frames and the inner group being built.
+    """
+
+    def __init__(self, group: _Group, txn: dict, result: TxnResult, app: App, program: bytes):
+        self.group = group
+        self.ledger = group.ledger
+        self.txn = txn
+        self.index = txn["GroupIndex"]
+        self.result = result
+        self.app = app
+        self.code = decode_program(program)
+        self.stack: List[StackValue] = []
+        self.scratch: List[StackValue] = [0] * 256
+        group.scratch[self.index] = self.scratch
+        # (return pc, stack height at entry, proto args, proto returns)
+        self.frames: List[list] = []
+        # opcode cost of this run so far
+        self.spent = 0
+        self.intc: Tuple[int, ...] = ()
+        self.bytec: Tuple[bytes, ...] = ()
+        self.building: Optional[List[dict]] = None
+        self.last_inner: List[TxnResult] = []
+        self.global_before: Optional[dict] = None
+        self.locals_before: Dict[bytes, dict] = {}
+
+    def run(self) -> bool:
+        code = self.code
+        instrs = code.instrs
+        stack = self.stack
+        group = self.group
+        trace = self.result.trace if group.trace else None
+        size = code.size
+        budget = group.budget
+        pc = code.start
+        spent = 0
+        instr = None
+        try:
+            while pc < size:
+                instr = instrs[pc]
+                if instr is None:
+                    raise TealError("branch into the middle of an instruction")
+                spent += instr.spec.cost
+                if spent > budget:
+                    raise TealError("dynamic cost budget exceeded")
+                self.spent = spent
+                jump = instr.handler(self, instr.immediates)
+                if len(stack) > MAX_STACK_DEPTH:
+                    raise TealError("stack overflow")
+                if trace is not None:
+                    trace.append(TraceStep(
+                        self.app.id, pc, instr.spec.name, instr.immediates, instr.spec.cost, tuple(stack)))
+                pc = instr.next_pc if jump is None else jump
+            if pc != size:
+                raise TealError("branch past the end of the program")
+            if len(stack) != 1:
+                raise TealError("stack has {} values at the end of the program".format(len(stack)))
+            approved = _uint(stack[0], "return") != 0
+        except _Return as done:
+            if trace is not None:
+                trace.append(TraceStep(
+                    self.app.id, pc, instr.spec.name, instr.immediates, instr.spec.cost, tuple(stack)))
+            approved = done.value != 0
+        except IndexError:
+            raise TealError("stack underflow", pc=pc, op=instr.spec.name if instr else None, trace=trace)
+        except TealError as e:
+            if e.pc is None:
+                e.pc, e.op = pc, instr.spec.name if instr else None
+            e.trace = trace
+            raise
+        finally:
+            group.budget -= spent
+            self.result.cost += spent
+            self.record_deltas()
+        if self.building is not None:
+            raise TealError("program ended with an unsubmitted inner transaction")
+        return approved
+
+    def record_deltas(self):
+        result = self.result
+        if self.global_before is not None:
+            result.global_delta = _delta(self.global_before, self.app.global_state)
+        for address, before in self.locals_before.items():
+            after = self.ledger.local_states.get((address, self.app.id), {})
+            delta = _delta(before, after)
+            if delta:
+                result.local_deltas[address] = delta
+
+    # Resolution of accounts, apps and boxes, as available to the program
+
+    def account(self, value: StackValue, op: str) -> bytes:
+        txn = self.txn
+        if value.__class__ is int:
+            if value == 0:
+                return txn.get("Sender", ZERO_ADDRESS)
+            accounts = txn.get("Accounts", ())
+            if value > len(accounts):
+                raise TealError("{}: invalid Accounts index {}".format(op, value))
+            return accounts[value - 1]
+        if len(value) != 32:
+            raise TealError("{}: invalid address of {} bytes".format(op, len(value)))
+        if not self.available(value):
+            raise TealError("{}: unavailable account {}".format(op, encoding.encode_address(value)))
+        return value
+
+    def available(self, address: bytes) -> bool:
+        txn = self.txn
+        if address == txn.get("Sender") or address in txn.get("Accounts", ()) or address == self.app.address:
+            return True
+        return any(address == app_address(app_id) for app_id in txn.get("Applications", ()))
+
+    def app_ref(self, value: int, op: str) -> int:
+        apps = self.txn.get("Applications", ())
+        if value == 0:
+            return self.app.id
+        if value <= len(apps):
+            return apps[value - 1]
+        if value == self.app.id or value in apps:
+            return value
+        if any(result is not None and result.created_app_id == value for result in self.group.results):
+            return value
+        raise TealError("{}: unavailable app {}".format(op, value))
+
+    def box(self, name: StackValue, op: str) -> Tuple[int, bytes]:
+        name = _bytes(name, op)
+        if not 0 < len(name) <= MAX_KEY_SIZE:
+            raise TealError("{}: box names are 1 to {} bytes".format(op, MAX_KEY_SIZE))
+        # Box references are shared by the app calls of the group
+        for txn, result in zip(self.group.txns, self.group.results):
+            if txn is self.txn:
+                called = self.app.id
+            elif result is not None and result.created_app_id:
+                called = result.created_app_id
+            else:
+                called = txn.get("ApplicationID", 0)
+            apps = txn.get("Applications", ())
+            for index, ref_name in txn.get("Boxes", ()):
+                ref_app = called if index == 0 else (apps[index - 1] if index <= len(apps) else None)
+                if ref_app == self.app.id and ref_name == name:
+                    return self.app.id, name
+        raise TealError("{}: invalid box reference {!r}".format(op, name))
+
+    def box_io(self, key: Tuple[int, bytes], size: int):
+        group = self.group
+        if size > group.box_io.get(key, 0):
+            group.box_io[key] = size
+            used = sum(group.box_io.values())
+            if used > group.box_quota:
+                raise TealError("box I/O budget of {} bytes exceeded, {} needed".format(group.box_quota, used))
+
+    def touch_global(self):
+        if self.global_before is None:
+            self.global_before = dict(self.app.global_state)
+
+    def touch_local(self, address: bytes) -> dict:
+        state = self.ledger.local_states.get((address, self.app.id))
+        if state is None:
+            raise TealError("{} is not opted in to {}".format(encoding.encode_address(address), self.app.id))
+        if address not in self.locals_before:
+            self.locals_before[address] = dict(state)
+        return state
+
+    # Transaction fields
+
+    def txn_field(self, txn: dict, name: str, index: Optional[int], result: Optional[TxnResult]):
+        if index is not None:
+            return self.txn_array(txn, name, index, result)
+        if name in ("NumAppArgs", "NumAccounts", "NumAssets", "NumApplications", "NumLogs"):
+            array = {"NumAppArgs": "ApplicationArgs", "NumLogs": "Logs"}.get(name, name[3:])
+            return len(self.array_of(txn, array, result))
+        if name in ("NumApprovalProgramPages", "NumClearStateProgramPages"):
+            program = txn.get(name[3:-5], b"")
+            return -(-len(program) // MAX_BYTES_SIZE)
+        if name == "GroupIndex":
+            return txn.get("GroupIndex", 0)
+        if name == "TxID":
+            if "TxID" not in txn:
+                txn["TxID"] = _txid(txn)
+            return txn["TxID"]
+        if name == "CreatedApplicationID":
+            return result.created_app_id if result is not None else 0
+        if name == "LastLog":
+            return result.logs[-1] if result is not None and result.logs else b""
+        if name == "CreatedAssetID":
+            return 0
+        if name in ("ApplicationArgs", "Accounts", "Assets", "Applications", "Logs",
+                    "ApprovalProgramPages", "ClearStateProgramPages"):
+            raise TealError("{} needs an array index".format(name))
+        value = txn.get(name)
+        if value is None:
+            if name in _ZERO_FIELDS:
+                return _ZERO_FIELDS[name]
+            return b"" if name in BYTES_FIELDS else 0
+        if value.__class__ is bool:
+            return int(value)
+        return value
+
+    def array_of(self, txn: dict, name: str, result: Optional[TxnResult]):
+        if name == "Logs":
+            return result.logs if result is not None else []
+        if name in ("ApprovalProgramPages", "ClearStateProgramPages"):
+            program = txn.get(name[:-5], b"")
+            return [program[i:i + MAX_BYTES_SIZE] for i in range(0, len(program), MAX_BYTES_SIZE)]
+        return txn.get(name, ())
+
+    def txn_array(self, txn: dict, name: str, index: int, result: Optional[TxnResult]):
+        if name == "Accounts":
+            if index == 0:
+                return txn.get("Sender", ZERO_ADDRESS)
+            index -= 1
+        elif name == "Applications":
+            if index == 0:
+                return txn.get("ApplicationID", 0)
+            index -= 1
+        array = self.array_of(txn, name, result)
+        if not 0 <= index < len(array):
+            raise TealError("invalid {} index {}".format(name, index))
+        return array[index]
+
+    def gtxn(self, group_index: int, name: str, index: Optional[int] = None):
+        group = self.group
+        if not 0 <= group_index < len(group.txns):
+            raise TealError("gtxn lookup of {} in a group of {}".format(group_index, len(group.txns)))
+        result = group.results[group_index]
+        if group_index == self.index:
+            result = self.result
+        elif group_index > self.index and name in ("Logs", "NumLogs", "LastLog", "CreatedApplicationID"):
+            raise TealError("{} of a later transaction is not known yet".format(name))
+        return self.txn_field(group.txns[group_index], name, index, result)
+
+    def itxn(self, name: str, index: Optional[int] = None, position: int = -1):
+        if not self.last_inner:
+            raise TealError("no inner transaction has been submitted")
+        if not -len(self.last_inner) <= position < len(self.last_inner):
+            raise TealError("inner transaction {} of {}".format(position, len(self.last_inner)))
+        result = self.last_inner[position]
+        return self.txn_field(result.txn, name, index, result)
+
+    def global_field(self, name: str):
+        ledger = self.ledger
+        if name == "MinTxnFee":
+            return ledger.min_fee
+        if name == "MinBalance":
+            return MIN_BALANCE
+        if name == "MaxTxnLife":
+            return MAX_TXN_LIFE
+        if name == "ZeroAddress":
+            return ZERO_ADDRESS
+        if name == "GroupSize":
+            return len(self.group.txns)
+        if name == "LogicSigVersion":
+            return 8
+        if name == "Round":
+            return ledger.round
+        if name == "LatestTimestamp":
+            return ledger.timestamp
+        if name == "CurrentApplicationID":
+            return self.app.id
+        if name == "CreatorAddress":
+            return self.app.creator
+        if name == "CurrentApplicationAddress":
+            return self.app.address
+        if name == "GroupID":
+            return self.group.group_id
+        if name == "OpcodeBudget":
+            return self.group.budget - self.spent
+        if name == "CallerApplicationID":
+            return 0
+        if name == "CallerApplicationAddress":
+            return ZERO_ADDRESS
+        raise TealError("unknown global {}".format(name))
+
+    # Inner transactions
+
+    def inner_defaults(self) -> dict:
+        return {
+            "Sender": self.app.address, "FirstValid": self.txn.get("FirstValid", 0),
+            "LastValid": self.txn.get("LastValid", 0),
+        }
+
+    def set_inner_field(self, name: str, value: StackValue):
+        fields = self.building[-1]
+        op = "itxn_field " + name
+        if name in ("ApplicationArgs", "Accounts", "Assets", "Applications"):
+            fields.setdefault(name, []).append(value)
+            return
+        if name in ADDRESS_FIELDS:
+            value = _bytes(value, op)
+            if len(value) != 32:
+                raise TealError("{}: invalid address of {} bytes".format(op, len(value)))
+            if name != "Sender" and not self.available(value):
+                raise TealError("{}: unavailable account {}".format(op, encoding.encode_address(value)))
+        elif name in BYTES_FIELDS:
+            value = _bytes(value, op)
+            if name == "Note" and len(value) > MAX_NOTE_SIZE:
+                raise TealError("{}: {} bytes is over the {} byte limit".format(op, len(value), MAX_NOTE_SIZE))
+        else:
+            value = _uint(value, op)
+        if name == "TypeEnum":
+            if value not in TYPE_NAMES:
+                raise TealError("{}: unknown type {}".format(op, value))
+            fields["Type"] = TYPE_NAMES[value].encode()
+        elif name == "Type":
+            if value.decode(errors="replace") not in TYPE_ENUMS:
+                raise TealError("{}: unknown type {!r}".format(op, value))
+            fields["TypeEnum"] = TYPE_ENUMS[value.decode()]
+        fields[name] = value
+
+    def submit_inner(self):
+        inner = self.building
+        self.building = None
+        group = self.group
+        ledger = self.ledger
+        if len(inner) > MAX_GROUP_SIZE:
+            raise TealError("inner group of {} transactions".format(len(inner)))
+        group.inner_txns += len(inner)
+        if group.inner_txns > MAX_INNER_TXNS:
+            raise TealError("too many inner transactions, {} in the group".format(group.inner_txns))
+        results = []
+        touched = set()
+        for fields in inner:
+            if "TypeEnum" not in fields:
+                raise TealError("inner transaction without a type")
+            if fields.get("Sender") != self.app.address:
+                raise TealError("inner transaction sent from another account")
+            if "Fee" not in fields:
+                fields["Fee"] = max(ledger.min_fee - max(group.fee_credit, 0), 0)
+            group.fee_credit += fields["Fee"] - ledger.min_fee
+            if group.fee_credit < 0:
+                raise TealError("fee too small: inner transactions are short {}".format(-group.fee_credit))
+            results.append(group.apply(fields, touched, caller=self))
+        group.check_min_balances(touched)
+        self.last_inner = results
+        self.result.inner.extend(results)
+
+
+def _delta(before: dict, after: dict) -> dict:
+    delta = {key: value for key, value in after.items() if before.get(key, _MISSING) != value}
+    delta.update((key, None) for key in before if key not in after)
+    return delta
+
+
+# Opcodes --------------------------------------------------------------------
+
+_OPS: Dict[str, Callable[[_Eval, tuple], Optional[int]]] = {}
+
+
+def _op(*names):
+    def register(handler):
+        for name in names:
+            _OPS[name] = handler
+        return handler
+    return register
+
+
+def _unsupported(name):
+    def handler(ev, imm):
+        raise TealError("{} is not supported offline".format(name))
+    return handler
+
+
+for _name in ("arg", "arg_0", "arg_1", "arg_2", "arg_3", "args", "ed25519verify", "ecdsa_verify",
+              "ecdsa_pk_decompress", "ecdsa_pk_recover", "vrf_verify", "block", "json_ref",
+              "asset_holding_get", "asset_params_get"):
+    _OPS[_name] = _unsupported(_name)
+
+
+def _binary_uint(name, fn):
+    def handler(ev, imm):
+        stack = ev.stack
+        b = stack.pop()
+        a = stack[-1]
+        if a.__class__ is not int or b.__class__ is not int:
+            raise TealError("{} expects uint64s".format(name))
+        stack[-1] = fn(a, b)
+    _OPS[name] = handler
+
+
+def _checked(value, name):
+    if value > UINT64_MAX:
+        raise TealError("{} overflowed".format(name))
+    if value < 0:
+        raise TealError("{} went below zero".format(name))
+    return value
+
+
+def _div(a, b, name="/"):
+    if b == 0:
+        raise TealError("{} by zero".format(name))
+    return a // b
+
+
+def _mod(a, b):
+    if b == 0:
+        raise TealError("% by zero")
+    return a % b
+
+
+def _exp(a, b):
+    if a == 0 and b == 0:
+        raise TealError("0^0 is undefined")
+    if a > 1 and b >= 64:
+        raise TealError("exp overflowed")
+    return _checked(a ** b, "exp")
+
+
+def _shift(a, b, left):
+    if b >= 64:
+        raise TealError("shift by {}".format(b))
+    return (a << b) & UINT64_MAX if left else a >> b
+
+
+_binary_uint("+", lambda a, b: _checked(a + b, "+"))
+_binary_uint("-", lambda a, b: _checked(a - b, "-"))
+_binary_uint("*", lambda a, b: _checked(a * b, "*"))
+_binary_uint("/", _div)
+_binary_uint("%", _mod)
+_binary_uint("<", lambda a, b: int(a < b))
+_binary_uint(">", lambda a, b: int(a > b))
+_binary_uint("<=", lambda a, b: int(a <= b))
+_binary_uint(">=", lambda a, b: int(a >= b))
+_binary_uint("&&", lambda a, b: int(bool(a) and bool(b)))
+_binary_uint("||", lambda a, b: int(bool(a) or bool(b)))
+_binary_uint("|", lambda a, b: a | b)
+_binary_uint("&", lambda a, b: a & b)
+_binary_uint("^", lambda a, b: a ^ b)
+_binary_uint("exp", _exp)
+_binary_uint("shl", lambda a, b: _shift(a, b, True))
+_binary_uint("shr", lambda a, b: _shift(a, b, False))
+
+
+def _compare(name, equal):
+    def handler(ev, imm):
+        stack = ev.stack
+        b = stack.pop()
+        a = stack[-1]
+        if a.__class__ is not b.__class__:
+            raise TealError("{} of a uint64 and bytes".format(name))
+        stack[-1] = int((a == b) is equal)
+    _OPS[name] = handler
+
+
+_compare("==", True)
+_compare("!=", False)
+
+
+@_op("!")
+def _not(ev, imm):
+    ev.stack[-1] = int(_uint(ev.stack[-1], "!") == 0)
+
+
+@_op("~")
+def _bitnot(ev, imm):
+    ev.stack[-1] = UINT64_MAX ^ _uint(ev.stack[-1], "~")
+
+
+@_op("len")
+def _len(ev, imm):
+    ev.stack[-1] = len(_bytes(ev.stack[-1], "len"))
+
+
+@_op("itob")
+def _itob(ev, imm):
+    ev.stack[-1] = _uint(ev.stack[-1], "itob").to_bytes(8, "big")
+
+
+@_op("btoi")
+def _btoi(ev, imm):
+    value = _bytes(ev.stack[-1], "btoi")
+    if len(value) > 8:
+        raise TealError("btoi of {} bytes".format(len(value)))
+    ev.stack[-1] = int.from_bytes(value, "big")
+
+
+@_op("sqrt")
+def _sqrt(ev, imm):
+    ev.stack[-1] = math.isqrt(_uint(ev.stack[-1], "sqrt"))
+
+
+@_op("bitlen")
+def _bitlen(ev, imm):
+    value = ev.stack[-1]
+    ev.stack[-1] = (value if value.__class__ is int else int.from_bytes(value, "big")).bit_length()
+
+
+@_op("mulw")
+def _mulw(ev, imm):
+    stack = ev.stack
+    b, a = _uint(stack.pop(), "mulw"), _uint(stack.pop(), "mulw")
+    product = a * b
+    stack += [product >> 64, product & UINT64_MAX]
+
+
+@_op("addw")
+def _addw(ev, imm):
+    stack = ev.stack
+    b, a = _uint(stack.pop(), "addw"), _uint(stack.pop(), "addw")
+    total = a + b
+    stack += [total >> 64, total & UINT64_MAX]
+
+
+@_op("divw")
+def _divw(ev, imm):
+    stack = ev.stack
+    c, b, a = (_uint(stack.pop(), "divw") for _ in range(3))
+    quotient = _div((a << 64) | b, c, "divw")
+    stack.append(_checked(quotient, "divw"))
+
+
+@_op("divmodw")
+def _divmodw(ev, imm):
+    stack = ev.stack
+    d, c, b, a = (_uint(stack.pop(), "divmodw") for _ in range(4))
+    divisor = (c << 64) | d
+    dividend = (a << 64) | b
+    quotient, remainder = divmod(dividend, divisor) if divisor else _div(1, 0, "divmodw")
+    stack += [quotient >> 64, quotient & UINT64_MAX, remainder >> 64, remainder & UINT64_MAX]
+
+
+@_op("expw")
+def _expw(ev, imm):
+    stack = ev.stack
+    b, a = _uint(stack.pop(), "expw"), _uint(stack.pop(), "expw")
+    if a == 0 and b == 0:
+        raise TealError("0^0 is undefined")
+    if a > 1 and b >= 128:
+        raise TealError("expw overflowed")
+    value = a ** b
+    if value >> 128:
+        raise TealError("expw overflowed")
+    stack += [value >> 64, value & UINT64_MAX]
+
+
+def _bmath(name, fn, compare=False):
+    def handler(ev, imm):
+        stack = ev.stack
+        b, a = _bytes(stack.pop(), name), _bytes(stack[-1], name)
+        if len(a) > 64 or len(b) > 64:
+            raise TealError("{} inputs are limited to 64 bytes".format(name))
+        value = fn(int.from_bytes(a, "big"), int.from_bytes(b, "big"))
+        if compare:
+            stack[-1] = int(value)
+        else:
+            stack[-1] = value.to_bytes(max((value.bit_length() + 7) // 8, 0), "big")
+    _OPS[name] = handler
+
+
+_bmath("b+", lambda a, b: a + b)
+_bmath("b-", lambda a, b: _checked(a - b, "b-"))
+_bmath("b*", lambda a, b: a * b)
+_bmath("b/", lambda a, b: _div(a, b, "b/"))
+_bmath("b%", lambda a, b: a - _div(a, b, "b%") * b)
+_bmath("b<", lambda a, b: a < b, True)
+_bmath("b>", lambda a, b: a > b, True)
+_bmath("b<=", lambda a, b: a <= b, True)
+_bmath("b>=", lambda a, b: a >= b, True)
+_bmath("b==", lambda a, b: a == b, True)
+_bmath("b!=", lambda a, b: a != b, True)
+
+
+def _bbitwise(name, fn):
+    def handler(ev, imm):
+        stack = ev.stack
+        b, a = _bytes(stack.pop(), name), _bytes(stack[-1], name)
+        size = max(len(a), len(b))
+        a, b = a.rjust(size, b"\x00"), b.rjust(size, b"\x00")
+        stack[-1] = bytes(fn(x, y) for x, y in zip(a, b))
+    _OPS[name] = handler
+
+
+_bbitwise("b|", lambda x, y: x | y)
+_bbitwise("b&", lambda x, y: x & y)
+_bbitwise("b^", lambda x, y: x ^ y)
+
+
+@_op("b~")
+def _bnot(ev, imm):
+    ev.stack[-1] = bytes(255 - x for x in _bytes(ev.stack[-1], "b~"))
+
+
+@_op("bsqrt")
+def _bsqrt(ev, imm):
+    value = math.isqrt(int.from_bytes(_bytes(ev.stack[-1], "bsqrt"), "big"))
+    ev.stack[-1] = value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+
+@_op("bzero")
+def _bzero(ev, imm):
+    size = _uint(ev.stack[-1], "bzero")
+    if size > MAX_BYTES_SIZE:
+        raise TealError("bzero of {} bytes".format(size))
+    ev.stack[-1] = bytes(size)
+
+
+# Constants
+
+@_op("intcblock")
+def _intcblock(ev, imm):
+    ev.intc = imm[0]
+
+
+@_op("bytecblock")
+def _bytecblock(ev, imm):
+    ev.bytec = imm[0]
+
+
+def _const(index, table):
+    def handler(ev, imm):
+        i = imm[0] if index is None else index
+        try:
+            ev.stack.append(ev.intc[i] if table == "intc" else ev.bytec[i])
+        except IndexError:
+            raise TealError("{} {} out of range".format(table, i))
+    return handler
+
+
+_OPS["intc"] = _const(None, "intc")
+_OPS["bytec"] = _const(None, "bytec")
+for _i in range(4):
+    _OPS["intc_{}".format(_i)] = _const(_i, "intc")
+    _OPS["bytec_{}".format(_i)] = _const(_i, "bytec")
+
+
+@_op("pushint", "pushbytes")
+def _push(ev, imm):
+    ev.stack.append(imm[0])
+
+
+@_op("pushints", "pushbytess")
+def _push_list(ev, imm):
+    ev.stack.extend(imm[0])
+
+
+# Flow control
+
+@_op("err")
+def _err(ev, imm):
+    raise TealError("err opcode executed")
+
+
+@_op("bnz")
+def _bnz(ev, imm):
+    if _uint(ev.stack.pop(), "bnz"):
+        return imm[0]
+
+
+@_op("bz")
+def _bz(ev, imm):
+    if not _uint(ev.stack.pop(), "bz"):
+        return imm[0]
+
+
+@_op("b")
+def _b(ev, imm):
+    return imm[0]
+
+
+@_op("return")
+def _return(ev, imm):
+    raise _Return(_uint(ev.stack.pop(), "return"))
+
+
+@_op("assert")
+def _assert(ev, imm):
+    if not _uint(ev.stack.pop(), "assert"):
+        raise TealError("assert failed")
+
+
+@_op("callsub")
+def _callsub(ev, imm):
+    if len(ev.frames) >= MAX_CALL_DEPTH:
+        raise TealError("callsub nested too deep")
+    ev.frames.append([imm[1], len(ev.stack), None, None])
+    return imm[0]
+
+
+@_op("retsub")
+def _retsub(ev, imm):
+    if not ev.frames:
+        raise TealError("retsub with no callsub")
+    return_pc, height, args, returns = ev.frames.pop()
+    if args is not None:
+        stack = ev.stack
+        if len(stack) < height + returns:
+            raise TealError("retsub with {} values, proto declared {}".format(len(stack) - height, returns))
+        base = height - args
+        stack[base:] = stack[len(stack) - returns:]
+    return return_pc
+
+
+@_op("proto")
+def _proto(ev, imm):
+    if not ev.frames:
+        raise TealError("proto outside a subroutine")
+    frame = ev.frames[-1]
+    if len(ev.stack) < imm[0]:
+        raise TealError("proto needs {} arguments".format(imm[0]))
+    frame[2], frame[3] = imm
+
+
+@_op("frame_dig")
+def _frame_dig(ev, imm):
+    base = _frame_base(ev) + imm[0]
+    if not 0 <= base < len(ev.stack):
+        raise TealError("frame_dig {} out of the frame".format(imm[0]))
+    ev.stack.append(ev.stack[base])
+
+
+@_op("frame_bury")
+def _frame_bury(ev, imm):
+    value = ev.stack.pop()
+    base = _frame_base(ev) + imm[0]
+    if not 0 <= base < len(ev.stack):
+        raise TealError("frame_bury {} out of the frame".format(imm[0]))
+    ev.stack[base] = value
+
+
+def _frame_base(ev):
+    if not ev.frames or ev.frames[-1][2] is None:
+        raise TealError("frame access without proto")
+    return ev.frames[-1][1]
+
+
+@_op("switch")
+def _switch(ev, imm):
+    index = _uint(ev.stack.pop(), "switch")
+    if index < len(imm[0]):
+        return imm[0][index]
+
+
+@_op("match")
+def _match(ev, imm):
+    targets = imm[0]
+    stack = ev.stack
+    value = stack.pop()
+    if len(stack) < len(targets):
+        raise IndexError
+    candidates = stack[len(stack) - len(targets):]
+    del stack[len(stack) - len(targets):]
+    for target, candidate in zip(targets, candidates):
+        if candidate.__class__ is value.__class__ and candidate == value:
+            return target
+
+
+# Stack manipulation
+
+@_op("pop")
+def _pop(ev, imm):
+    ev.stack.pop()
+
+
+@_op("dup")
+def _dup(ev, imm):
+    ev.stack.append(ev.stack[-1])
+
+
+@_op("dup2")
+def _dup2(ev, imm):
+    stack = ev.stack
+    stack += (stack[-2], stack[-1])
+
+
+@_op("dig")
+def _dig(ev, imm):
+    ev.stack.append(ev.stack[-1 - imm[0]])
+
+
+@_op("bury")
+def _bury(ev, imm):
+    if imm[0] == 0:
+        raise TealError("bury 0")
+    value = ev.stack.pop()
+    ev.stack[-imm[0]] = value
+
+
+@_op("popn")
+def _popn(ev, imm):
+    if imm[0]:
+        if len(ev.stack) < imm[0]:
+            raise IndexError
+        del ev.stack[-imm[0]:]
+
+
+@_op("dupn")
+def _dupn(ev, imm):
+    ev.stack.extend([ev.stack[-1]] * imm[0])
+
+
+@_op("swap")
+def _swap(ev, imm):
+    stack = ev.stack
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+
+
+@_op("select")
+def _select(ev, imm):
+    stack = ev.stack
+    c = _uint(stack.pop(), "select")
+    b = stack.pop()
+    if c:
+        stack[-1] = b
+
+
+@_op("cover")
+def _cover(ev, imm):
+    stack = ev.stack
+    if imm[0] >= len(stack):
+        raise IndexError
+    stack.insert(len(stack) - 1 - imm[0], stack.pop())
+
+
+@_op("uncover")
+def _uncover(ev, imm):
+    stack = ev.stack
+    if imm[0] >= len(stack):
+        raise IndexError
+    stack.append(stack.pop(len(stack) - 1 - imm[0]))
+
+
+# Byte strings
+
+def _limit(value: bytes, op: str) -> bytes:
+    if len(value) > MAX_BYTES_SIZE:
+        raise TealError("{} produced {} bytes, over the {} byte limit".format(op, len(value), MAX_BYTES_SIZE))
+    return value
+
+
+@_op("concat")
+def _concat(ev, imm):
+    stack = ev.stack
+    b = _bytes(stack.pop(), "concat")
+    stack[-1] = _limit(_bytes(stack[-1], "concat") + b, "concat")
+
+
+def _substring(value: bytes, start: int, end: int, op: str) -> bytes:
+    if start > end or end > len(value):
+        raise TealError("{} [{}:{}] of {} bytes".format(op, start, end, len(value)))
+    return value[start:end]
+
+
+@_op("substring")
+def _substring_imm(ev, imm):
+    ev.stack[-1] = _substring(_bytes(ev.stack[-1], "substring"), imm[0], imm[1], "substring")
+
+
+@_op("substring3")
+def _substring3(ev, imm):
+    stack = ev.stack
+    end, start = _uint(stack.pop(), "substring3"), _uint(stack.pop(), "substring3")
+    stack[-1] = _substring(_bytes(stack[-1], "substring3"), start, end, "substring3")
+
+
+@_op("extract")
+def _extract(ev, imm):
+    value = _bytes(ev.stack[-1], "extract")
+    start, length = imm
+    end = len(value) if length == 0 else start + length
+    ev.stack[-1] = _substring(value, start, end, "extract")
+
+
+@_op("extract3")
+def _extract3(ev, imm):
+    stack = ev.stack
+    length, start = _uint(stack.pop(), "extract3"), _uint(stack.pop(), "extract3")
+    stack[-1] = _substring(_bytes(stack[-1], "extract3"), start, start + length, "extract3")
+
+
+def _extract_uint(size):
+    name = "extract_uint{}".format(size * 8)
+
+    def handler(ev, imm):
+        stack = ev.stack
+        start = _uint(stack.pop(), name)
+        stack[-1] = int.from_bytes(_substring(_bytes(stack[-1], name), start, start + size, name), "big")
+    _OPS[name] = handler
+
+
+for _size in (2, 4, 8):
+    _extract_uint(_size)
+
+
+def _replace(value: bytes, start: int, replacement: bytes, op: str) -> bytes:
+    if start + len(replacement) > len(value):
+        raise TealError("{} of {} bytes at {} in {} bytes".format(op, len(replacement), start, len(value)))
+    return value[:start] + replacement + value[start + len(replacement):]
+
+
+@_op("replace2")
+def _replace2(ev, imm):
+    stack = ev.stack
+    replacement = _bytes(stack.pop(), "replace2")
+    stack[-1] = _replace(_bytes(stack[-1], "replace2"), imm[0], replacement, "replace2")
+
+
+@_op("replace3")
+def _replace3(ev, imm):
+    stack = ev.stack
+    replacement, start = _bytes(stack.pop(), "replace3"), _uint(stack.pop(), "replace3")
+    stack[-1] = _replace(_bytes(stack[-1], "replace3"), start, replacement, "replace3")
+
+
+@_op("getbyte")
+def _getbyte(ev, imm):
+    stack = ev.stack
+    index = _uint(stack.pop(), "getbyte")
+    value = _bytes(stack[-1], "getbyte")
+    if index >= len(value):
+        raise TealError("getbyte {} of {} bytes".format(index, len(value)))
+    stack[-1] = value[index]
+
+
+@_op("setbyte")
+def _setbyte(ev, imm):
+    stack = ev.stack
+    byte, index = _uint(stack.pop(), "setbyte"), _uint(stack.pop(), "setbyte")
+    value = _bytes(stack[-1], "setbyte")
+    if index >= len(value) or byte > 255:
+        raise TealError("setbyte {} to {} in {} bytes".format(index, byte, len(value)))
+    stack[-1] = value[:index] + bytes([byte]) + value[index + 1:]
+
+
+@_op("getbit")
+def _getbit(ev, imm):
+    stack = ev.stack
+    index = _uint(stack.pop(), "getbit")
+    value = stack[-1]
+    if value.__class__ is int:
+        if index >= 64:
+            raise TealError("getbit {} of a uint64".format(index))
+        stack[-1] = (value >> index) & 1
+    else:
+        if index >= len(value) * 8:
+            raise TealError("getbit {} of {} bytes".format(index, len(value)))
+        stack[-1] = (value[index // 8] >> (7 - index % 8)) & 1
+
+
+@_op("setbit")
+def _setbit(ev, imm):
+    stack = ev.stack
+    bit, index = _uint(stack.pop(), "setbit"), _uint(stack.pop(), "setbit")
+    value = stack[-1]
+    if bit > 1:
+        raise TealError("setbit to {}".format(bit))
+    if value.__class__ is int:
+        if index >= 64:
+            raise TealError("setbit {} of a uint64".format(index))
+        stack[-1] = value | (1 << index) if bit else value & ~(1 << index)
+    else:
+        if index >= len(value) * 8:
+            raise TealError("setbit {} of {} bytes".format(index, len(value)))
+        data = bytearray(value)
+        mask = 1 << (7 - index % 8)
+        data[index // 8] = data[index // 8] | mask if bit else data[index // 8] & ~mask
+        stack[-1] = bytes(data)
+
+
+@_op("base64_decode")
+def _base64_decode(ev, imm):
+    value = _bytes(ev.stack[-1], "base64_decode")
+    try:
+        if imm[0] == "URLEncoding":
+            ev.stack[-1] = base64.urlsafe_b64decode(value + b"=" * (-len(value) % 4))
+        else:
+            ev.stack[-1] = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise TealError("base64_decode of invalid input")
+
+
+def _hash(name, fn):
+    def handler(ev, imm):
+        ev.stack[-1] = fn(_bytes(ev.stack[-1], name))
+    _OPS[name] = handler
+
+
+_hash("sha256", lambda data: hashlib.sha256(data).digest())
+_hash("sha3_256", lambda data: hashlib.sha3_256(data).digest())
+_hash("sha512_256", encoding.checksum)
+_hash("keccak256", lambda data: keccak.new(data=data, digest_bits=256).digest())
+
+
+@_op("ed25519verify_bare")
+def _ed25519verify_bare(ev, imm):
+    from nacl.exceptions import BadSignatureError
+    from nacl.signing import VerifyKey
+    stack = ev.stack
+    key, signature = _bytes(stack.pop(), "ed25519verify_bare"), _bytes(stack.pop(), "ed25519verify_bare")
+    data = _bytes(stack[-1], "ed25519verify_bare")
+    try:
+        VerifyKey(key).verify(data, signature)
+        stack[-1] = 1
+    except (BadSignatureError, ValueError):
+        stack[-1] = 0
+
+
+# Scratch space
+
+def _scratch_index(index):
+    if index > 255:
+        raise TealError("scratch slot {}".format(index))
+    return index
+
+
+@_op("load")
+def _load(ev, imm):
+    ev.stack.append(ev.scratch[imm[0]])
+
+
+@_op("store")
+def _store(ev, imm):
+    ev.scratch[imm[0]] = ev.stack.pop()
+
+
+@_op("loads")
+def _loads(ev, imm):
+    ev.stack[-1] = ev.scratch[_scratch_index(_uint(ev.stack[-1], "loads"))]
+
+
+@_op("stores")
+def _stores(ev, imm):
+    value = ev.stack.pop()
+    ev.scratch[_scratch_index(_uint(ev.stack.pop(), "stores"))] = value
+
+
+def _gload_value(ev, group_index, slot):
+    if group_index >= ev.index:
+        raise TealError("gload of transaction {} from {}".format(group_index, ev.index))
+    scratch = ev.group.scratch.get(group_index)
+    if scratch is None:
+        raise TealError("gload of transaction {}, which is not an app call".format(group_index))
+    return scratch[_scratch_index(slot)]
+
+
+@_op("gload")
+def _gload(ev, imm):
+    ev.stack.append(_gload_value(ev, imm[0], imm[1]))
+
+
+@_op("gloads")
+def _gloads(ev, imm):
+    ev.stack[-1] = _gload_value(ev, _uint(ev.stack[-1], "gloads"), imm[0])
+
+
+@_op("gloadss")
+def _gloadss(ev, imm):
+    slot = _uint(ev.stack.pop(), "gloadss")
+    ev.stack[-1] = _gload_value(ev, _uint(ev.stack[-1], "gloadss"), slot)
+
+
+def _gaid_value(ev, group_index):
+    if group_index >= ev.index:
+        raise TealError("gaid of transaction {} from {}".format(group_index, ev.index))
+    result = ev.group.results[group_index]
+    if not result.created_app_id:
+        raise TealError("transaction {} did not create an app".format(group_index))
+    return result.created_app_id
+
+
+@_op("gaid")
+def _gaid(ev, imm):
+    ev.stack.append(_gaid_value(ev, imm[0]))
+
+
+@_op("gaids")
+def _gaids(ev, imm):
+    ev.stack[-1] = _gaid_value(ev, _uint(ev.stack[-1], "gaids"))
+
+
+# Transaction and global fields
+
+@_op("txn")
+def _txn(ev, imm):
+    ev.stack.append(ev.txn_field(ev.txn, imm[0], None, ev.result))
+
+
+@_op("txna")
+def _txna(ev, imm):
+    ev.stack.append(ev.txn_field(ev.txn, imm[0], imm[1], ev.result))
+
+
+@_op("txnas")
+def _txnas(ev, imm):
+    ev.stack[-1] = ev.txn_field(ev.txn, imm[0], _uint(ev.stack[-1], "txnas"), ev.result)
+
+
+@_op("gtxn")
+def _gtxn(ev, imm):
+    ev.stack.append(ev.gtxn(imm[0], imm[1]))
+
+
+@_op("gtxna")
+def _gtxna(ev, imm):
+    ev.stack.append(ev.gtxn(imm[0], imm[1], imm[2]))
+
+
+@_op("gtxnas")
+def _gtxnas(ev, imm):
+    ev.stack[-1] = ev.gtxn(imm[0], imm[1], _uint(ev.stack[-1], "gtxnas"))
+
+
+@_op("gtxns")
+def _gtxns(ev, imm):
+    ev.stack[-1] = ev.gtxn(_uint(ev.stack[-1], "gtxns"), imm[0])
+
+
+@_op("gtxnsa")
+def _gtxnsa(ev, imm):
+    ev.stack[-1] = ev.gtxn(_uint(ev.stack[-1], "gtxnsa"), imm[0], imm[1])
+
+
+@_op("gtxnsas")
+def _gtxnsas(ev, imm):
+    index = _uint(ev.stack.pop(), "gtxnsas")
+    ev.stack[-1] = ev.gtxn(_uint(ev.stack[-1], "gtxnsas"), imm[0], index)
+
+
+@_op("itxn")
+def _itxn(ev, imm):
+    ev.stack.append(ev.itxn(imm[0]))
+
+
+@_op("itxna")
+def _itxna(ev, imm):
+    ev.stack.append(ev.itxn(imm[0], imm[1]))
+
+
+@_op("itxnas")
+def _itxnas(ev, imm):
+    ev.stack[-1] = ev.itxn(imm[0], _uint(ev.stack[-1], "itxnas"))
+
+
+@_op("gitxn")
+def _gitxn(ev, imm):
+    ev.stack.append(ev.itxn(imm[1], None, imm[0]))
+
+
+@_op("gitxna")
+def _gitxna(ev, imm):
+    ev.stack.append(ev.itxn(imm[1], imm[2], imm[0]))
+
+
+@_op("gitxnas")
+def _gitxnas(ev, imm):
+    ev.stack[-1] = ev.itxn(imm[1], _uint(ev.stack[-1], "gitxnas"), imm[0])
+
+
+@_op("global")
+def _global(ev, imm):
+    ev.stack.append(ev.global_field(imm[0]))
+
+
+# Balances and state
+
+@_op("balance")
+def _balance(ev, imm):
+    ev.stack[-1] = ev.ledger.balance(ev.account(ev.stack[-1], "balance"))
+
+
+@_op("min_balance")
+def _min_balance(ev, imm):
+    ev.stack[-1] = ev.ledger.min_balance(ev.account(ev.stack[-1], "min_balance"))
+
+
+@_op("app_opted_in")
+def _app_opted_in(ev, imm):
+    stack = ev.stack
+    app_id = ev.app_ref(_uint(stack.pop(), "app_opted_in"), "app_opted_in")
+    address = ev.account(stack[-1], "app_opted_in")
+    stack[-1] = int((address, app_id) in ev.ledger.local_states)
+
+
+def _state_key(key, op):
+    key = _bytes(key, op)
+    if len(key) > MAX_KEY_SIZE:
+        raise TealError("{}: key of {} bytes".format(op, len(key)))
+    return key
+
+
+@_op("app_global_get")
+def _app_global_get(ev, imm):
+    ev.stack[-1] = ev.app.global_state.get(_bytes(ev.stack[-1], "app_global_get"), 0)
+
+
+@_op("app_global_get_ex")
+def _app_global_get_ex(ev, imm):
+    stack = ev.stack
+    key = _bytes(stack.pop(), "app_global_get_ex")
+    app = ev.ledger.apps.get(ev.app_ref(_uint(stack[-1], "app_global_get_ex"), "app_global_get_ex"))
+    value = app.global_state.get(key) if app is not None else None
+    stack[-1] = 0 if value is None else value
+    stack.append(int(value is not None))
+
+
+@_op("app_global_put")
+def _app_global_put(ev, imm):
+    stack = ev.stack
+    value = stack.pop()
+    key = _state_key(stack.pop(), "app_global_put")
+    ev.touch_global()
+    state = ev.app.global_state
+    _check_entry(state, key, value, ev.app.global_schema, "app_global_put")
+    ev.ledger._put(state, key, value)
+
+
+@_op("app_global_del")
+def _app_global_del(ev, imm):
+    key = _bytes(ev.stack.pop(), "app_global_del")
+    ev.touch_global()
+    if key in ev.app.global_state:
+        ev.ledger._del(ev.app.global_state, key)
+
+
+def _check_entry(state, key, value, schema, op):
+    if value.__class__ is bytes and len(key) + len(value) > MAX_KEY_VALUE_SIZE:
+        raise TealError("{}: key and value of {} bytes".format(op, len(key) + len(value)))
+    old = state.get(key)
+    if old is not None and old.__class__ is value.__class__:
+        return
+    uints = sum(1 for v in state.values() if v.__class__ is int)
+    byte_slices = len(state) - uints
+    if old is not None:
+        uints, byte_slices = (uints - 1, byte_slices) if old.__class__ is int else (uints, byte_slices - 1)
+    if value.__class__ is int and uints + 1 > schema[0]:
+        raise TealError("{}: store integer count {} exceeds schema integer count {}".format(op, uints + 1, schema[0]))
+    if value.__class__ is bytes and byte_slices + 1 > schema[1]:
+        raise TealError("{}: store bytes count {} exceeds schema bytes count {}".format(op, byte_slices + 1, schema[1]))
+
+
+@_op("app_local_get")
+def _app_local_get(ev, imm):
+    stack = ev.stack
+    key = _bytes(stack.pop(), "app_local_get")
+    address = ev.account(stack[-1], "app_local_get")
+    stack[-1] = ev.ledger.local_states.get((address, ev.app.id), {}).get(key, 0)
+
+
+@_op("app_local_get_ex")
+def _app_local_get_ex(ev, imm):
+    stack = ev.stack
+    key = _bytes(stack.pop(), "app_local_get_ex")
+    app_id = ev.app_ref(_uint(stack.pop(), "app_local_get_ex"), "app_local_get_ex")
+    address = ev.account(stack[-1], "app_local_get_ex")
+    value = ev.ledger.local_states.get((address, app_id), {}).get(key)
+    stack[-1] = 0 if value is None else value
+    stack.append(int(value is not None))
+
+
+@_op("app_local_put")
+def _app_local_put(ev, imm):
+    stack = ev.stack
+    value = stack.pop()
+    key = _state_key(stack.pop(), "app_local_put")
+    state = ev.touch_local(ev.account(stack.pop(), "app_local_put"))
+    _check_entry(state, key, value, ev.app.local_schema, "app_local_put")
+    ev.ledger._put(state, key, value)
+
+
+@_op("app_local_del")
+def _app_local_del(ev, imm):
+    stack = ev.stack
+    key = _bytes(stack.pop(), "app_local_del")
+    state = ev.touch_local(ev.account(stack.pop(), "app_local_del"))
+    if key in state:
+        ev.ledger._del(state, key)
+
+
+@_op("app_params_get")
+def _app_params_get(ev, imm):
+    app = ev.ledger.apps.get(ev.app_ref(_uint(ev.stack[-1], "app_params_get"), "app_params_get"))
+    if app is None:
+        ev.stack[-1] = 0
+        ev.stack.append(0)
+        return
+    value = {
+        "AppApprovalProgram": app.approval, "AppClearStateProgram": app.clear,
+        "AppGlobalNumUint": app.global_schema[0], "AppGlobalNumByteSlice": app.global_schema[1],
+        "AppLocalNumUint": app.local_schema[0], "AppLocalNumByteSlice": app.local_schema[1],
+        "AppExtraProgramPages": app.extra_pages, "AppCreator": app.creator, "AppAddress": app.address,
+    }[imm[0]]
+    ev.stack[-1] = value
+    ev.stack.append(1)
+
+
+@_op("acct_params_get")
+def _acct_params_get(ev, imm):
+    address = ev.account(ev.stack[-1], "acct_params_get")
+    ledger = ev.ledger
+    if imm[0] == "AcctBalance":
+        value = ledger.balance(address)
+    elif imm[0] == "AcctMinBalance":
+        value = ledger.min_balance(address)
+    elif imm[0] == "AcctAuthAddr":
+        value = ZERO_ADDRESS
+    else:
+        raise TealError("acct_params_get {} is not supported offline".format(imm[0]))
+    ev.stack[-1] = value
+    ev.stack.append(int(ledger.balance(address) > 0))
+
+
+@_op("log")
+def _log(ev, imm):
+    message = _bytes(ev.stack.pop(), "log")
+    logs = ev.result.logs
+    if len(logs) >= 32 or sum(map(len, logs)) + len(message) > 1024:
+        raise TealError("too many log messages")
+    logs.append(message)
+
+
+# Boxes
+
+def _box_create(ev, key, size, op):
+    ledger = ev.ledger
+    if size > MAX_BOX_SIZE:
+        raise TealError("{}: box of {} bytes".format(op, size))
+    ev.box_io(key, size)
+    ledger._put(ledger.boxes, key, bytes(size))
+    ledger._add_min_balance(ev.app.address, box_min_balance(key[1], size))
+
+
+def _box_value(ev, key, op):
+    value = ev.ledger.boxes.get(key)
+    if value is not None:
+        ev.box_io(key, len(value))
+    return value
+
+
+@_op("box_create")
+def _box_create_op(ev, imm):
+    stack = ev.stack
+    size = _uint(stack.pop(), "box_create")
+    key = ev.box(stack[-1], "box_create")
+    existing = _box_value(ev, key, "box_create")
+    if existing is not None:
+        if len(existing) != size:
+            raise TealError("box_create: box exists with {} bytes".format(len(existing)))
+        stack[-1] = 0
+        return
+    _box_create(ev, key, size, "box_create")
+    stack[-1] = 1
+
+
+@_op("box_extract")
+def _box_extract(ev, imm):
+    stack = ev.stack
+    length, start = _uint(stack.pop(), "box_extract"), _uint(stack.pop(), "box_extract")
+    key = ev.box(stack[-1], "box_extract")
+    value = _box_value(ev, key, "box_extract")
+    if value is None:
+        raise TealError("box_extract: no such box")
+    stack[-1] = _limit(_substring(value, start, start + length, "box_extract"), "box_extract")
+
+
+@_op("box_replace")
+def _box_replace(ev, imm):
+    stack = ev.stack
+    replacement, start = _bytes(stack.pop(), "box_replace"), _uint(stack.pop(), "box_replace")
+    key = ev.box(stack.pop(), "box_replace")
+    value = _box_value(ev, key, "box_replace")
+    if value is None:
+        raise TealError("box_replace: no such box")
+    ev.ledger._put(ev.ledger.boxes, key, _replace(value, start, replacement, "box_replace"))
+
+
+@_op("box_del")
+def _box_del(ev, imm):
+    key = ev.box(ev.stack[-1], "box_del")
+    value = _box_value(ev, key, "box_del")
+    if value is None:
+        ev.stack[-1] = 0
+        return
+    ledger = ev.ledger
+    ledger._del(ledger.boxes, key)
+    ledger._add_min_balance(ev.app.address, -box_min_balance(key[1], len(value)))
+    ev.stack[-1] = 1
+
+
+@_op("box_len")
+def _box_len(ev, imm):
+    value = _box_value(ev, ev.box(ev.stack[-1], "box_len"), "box_len")
+    ev.stack[-1] = 0 if value is None else len(value)
+    ev.stack.append(int(value is not None))
+
+
+@_op("box_get")
+def _box_get(ev, imm):
+    value = _box_value(ev, ev.box(ev.stack[-1], "box_get"), "box_get")
+    ev.stack[-1] = b"" if value is None else _limit(value, "box_get")
+    ev.stack.append(int(value is not None))
+
+
+@_op("box_put")
+def _box_put(ev, imm):
+    stack = ev.stack
+    value = _bytes(stack.pop(), "box_put")
+    key = ev.box(stack.pop(), "box_put")
+    existing = _box_value(ev, key, "box_put")
+    if existing is None:
+        _box_create(ev, key, len(value), "box_put")
+    elif len(existing) != len(value):
+        raise TealError("box_put: box has {} bytes, not {}".format(len(existing), len(value)))
+    ev.ledger._put(ev.ledger.boxes, key, value)
+
+
+# Inner transactions
+
+@_op("itxn_begin")
+def _itxn_begin(ev, imm):
+    if ev.building is not None:
+        raise TealError("itxn_begin without itxn_submit")
+    ev.building = [ev.inner_defaults()]
+
+
+@_op("itxn_next")
+def _itxn_next(ev, imm):
+    if ev.building is None:
+        raise TealError("itxn_next without itxn_begin")
+    ev.building.append(ev.inner_defaults())
+
+
+@_op("itxn_field")
+def _itxn_field(ev, imm):
+    if ev.building is None:
+        raise TealError("itxn_field without itxn_begin")
+    ev.set_inner_field(imm[0], ev.stack.pop())
+
+
+@_op("itxn_submit")
+def _itxn_submit(ev, imm):
+    if ev.building is None:
+        raise TealError("itxn_submit without itxn_begin")
+    ev.submit_inner()
@@ -0,0 +1,449 @@
+"""
+Static opcode-cost and inner transaction profiler for TEAL programs.
+
+The program is split into basic blocks and functions (main and every callsub
+target), and loops are found from the back edges of each function. Costs are
+worst-case path sums using the opcode costs of the assembler's OpSpec table,
+with every loop run the number of times given in `trip_counts`:
+
+    {"sendfilesbatched:0": 4, "closesale:0": 12}
+
+keys are `<function>:<n>`, the nth loop of a function in program order, where
+the function is the subroutine label without PyTeal's `_<index>` suffix (or
+"main"). The counts are totals over one program run, so an inner loop is given
+its total iterations rather than its iterations per outer iteration.
+
+A condition inside a loop is costed as its worst side on every iteration,
+unless `trip_counts` also gives the runs of the labelled side, keyed
+`<function>:<label>` with the label's `_l<n>` suffix:
+
+    {"storeslots:0": 9, "storeslots:l5": 8}
+
+The other side is then costed for the remaining iterations. The constant
+blocks `assembler.assemble` puts ahead of the program are part of the cost of
+main, so costs match a run of the assembled bytecode.
+
+Branches are marked in the contract with `Comment("branch: <name>")`; a
+branch is costed as the worst path from the program start through its marker.
+"""
+import json
+import math
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .assembler import OPS_BY_NAME, _Instr, _const_blocks, _const_value, parse
+
+# Opcode budget of one app call, pooled over the app calls of a group
+OPCODE_BUDGET = 700
+MAX_GROUP_SIZE = 16
+# Inner transactions one group can issue
+MAX_INNER_TXNS = 256
+
+BRANCH_MARKER = re.compile(r"//\s*branch:\s*(\S+)")
+
+_JUMPS = {"b", "bz", "bnz", "switch", "match"}
+_TERMINATORS = {"return", "err", "retsub"}
+_INNER_OPS = ("itxn_begin", "itxn_next")
+
+
+class ProfileError(Exception):
+    pass
+
+
+@dataclass
+class _Block:
+    start: int
+    instrs: List[_Instr]
+    succs: List[int] = field(default_factory=list)
+    labels: List[str] = field(default_factory=list)
+
+    @property
+    def last(self) -> Optional[_Instr]:
+        return self.instrs[-1] if self.instrs else None
+
+
+@dataclass
+class _Loop:
+    key: str
+    header: int
+    body: Set[int]
+
+
+@dataclass
+class _Function:
+    name: str
+    entry: int
+    blocks: Set[int]
+    loops: List[_Loop]
+
+
+@dataclass
+class Metrics:
+    cost: int
+    inner_txns: int
+
+
+def _function_name(label: str) -> str:
+    return re.sub(r"_\d+$", "", label)
+
+
+def _op_cost(instr: _Instr) -> int:
+    spec = OPS_BY_NAME.get(instr.op)
+    # int/byte/addr/method pseudo-ops compile to a single 1 cost op
+    return spec.cost if spec is not None else 1
+
+
+class ProgramProfile:
+    """
+    Control flow model of a TEAL program, see the module docstring.
+    """
+
+    def __init__(self, teal: str):
+        self.teal = teal
+        version, program = parse(teal)
+        for item in program:
+            if isinstance(item, _Instr) and item.op in ("int", "byte", "addr", "method"):
+                item.const = _const_value(item)
+        # intcblock and bytecblock, run once before the first instruction
+        self.prologue_cost = sum(1 for block in _const_blocks(version, program) if block)
+        instrs: List[_Instr] = []
+        label_at: Dict[str, int] = {}
+        for item in program:
+            if isinstance(item, str):
+                label_at[item] = len(instrs)
+            else:
+                instrs.append(item)
+
+        markers = {}
+        for lineno, line in enumerate(teal.splitlines(), start=1):
+            match = BRANCH_MARKER.search(line)
+            if match:
+                markers[match.group(1)] = next(
+                    (i for i, instr in enumerate(instrs) if instr.line > lineno), len(instrs)
+                )
+
+        leaders = {0} | set(label_at.values()) | set(markers.values())
+        for i, instr in enumerate(instrs):
+            if instr.op in _JUMPS or instr.op in _TERMINATORS:
+                leaders.add(i + 1)
+        leaders = sorted(leader for leader in leaders if leader < len(instrs))
+
+        self.blocks: Dict[int, _Block] = {}
+        for n, start in enumerate(leaders):
+            end = leaders[n + 1] if n + 1 < len(leaders) else len(instrs)
+            self.blocks[start] = _Block(start, instrs[start:end])
+        for label, index in label_at.items():
+            if index in self.blocks:
+                self.blocks[index].labels.append(label)
+        for start, block in self.blocks.items():
+            block.succs = self._successors(block, label_at, start + len(block.instrs))
+
+        self.branches = markers
+        entries = {"main": 0}
+        for block in self.blocks.values():
+            for instr in block.instrs:
+                if instr.op == "callsub":
+                    entries[_function_name(instr.args[0])] = label_at[instr.args[0]]
+        self._callee = {label: _function_name(label) for label in label_at}
+        self.functions = {name: self._function(name, entry) for name, entry in entries.items()}
+
+    def _successors(self, block: _Block, label_at: Dict[str, int], fallthrough: int) -> List[int]:
+        last = block.last
+        if last is None or last.op in _TERMINATORS:
+            return []
+        targets = [label_at[arg] for arg in last.args] if last.op in _JUMPS else []
+        if last.op != "b" and fallthrough in self.blocks:
+            targets.append(fallthrough)
+        return targets
+
+    def _function(self, name: str, entry: int) -> _Function:
+        blocks: Set[int] = set()
+        back_edges: List[Tuple[int, int]] = []
+        on_stack: Set[int] = set()
+
+        def visit(node):
+            blocks.add(node)
+            on_stack.add(node)
+            for succ in self.blocks[node].succs:
+                if succ in on_stack:
+                    back_edges.append((node, succ))
+                elif succ not in blocks:
+                    visit(succ)
+            on_stack.discard(node)
+
+        visit(entry)
+        bodies: Dict[int, Set[int]] = {}
+        for tail, header in back_edges:
+            body = bodies.setdefault(header, {header})
+            stack = [tail]
+            while stack:
+                node = stack.pop()
+                if node not in body:
+                    body.add(node)
+                    stack.extend(pred for pred in blocks if node in self.blocks[pred].succs)
+        loops = [
+            _Loop("{}:{}".format(name, n), header, bodies[header])
+            for n, header in enumerate(sorted(bodies))
+        ]
+        return _Function(name, entry, blocks, loops)
+
+    @property
+    def loop_keys(self) -> List[str]:
+        return [loop.key for function in self.functions.values() for loop in function.loops]
+
+    def function_metrics(self, name: str, trip_counts: Dict[str, int], op_counts: Optional[Dict[str, int]] = None) -> Metrics:
+        """
+        Worst-case cost and inner transactions of one run of a function.
+        Args:
+            name: function name, "main" or a subroutine
+            trip_counts: total iterations per loop key
+            op_counts: exact executions of an op within a function, e.g.
+                {"sendfilesbatched:itxn_next": 3}, for ops under a condition the
+                worst case would overcount
+        """
+        return self._metrics(name, None, trip_counts, op_counts or {})
+
+    def branch_metrics(self, branch: str, trip_counts: Dict[str, int], op_counts: Optional[Dict[str, int]] = None) -> Metrics:
+        """
+        Worst-case cost and inner transactions of a run through a branch marker.
+        """
+        if branch not in self.branches:
+            raise ProfileError("no '// branch: {}' marker, found {}".format(branch, sorted(self.branches)))
+        return self._metrics("main", self.branches[branch], trip_counts, op_counts or {})
+
+    def _metrics(self, name, through, trip_counts, op_counts):
+        cost = self._longest(name, through, "cost", trip_counts, op_counts)
+        if name == "main":
+            cost += self.prologue_cost
+        inner = self._longest(name, through, "inner", trip_counts, op_counts)
+        return Metrics(cost, inner)
+
+    def _block_value(self, block: _Block, metric, trip_counts, op_counts, function) -> int:
+        value = 0
+        for instr in block.instrs:
+            if metric == "cost":
+                value += _op_cost(instr)
+            elif instr.op in _INNER_OPS and "{}:{}".format(function, instr.op) not in op_counts:
+                value += 1
+            if instr.op == "callsub":
+                value += self._longest(self._callee[instr.args[0]], None, metric, trip_counts, op_counts)
+        return value
+
+    def _side_runs(self, function: str, start: int, trip_counts: Dict[str, int]) -> Optional[int]:
+        for label in self.blocks[start].labels:
+            key = "{}:{}".format(function, label.rsplit("_", 1)[-1])
+            if key in trip_counts:
+                return trip_counts[key]
+        return None
+
+    def _longest(self, name, through, metric, trip_counts, op_counts) -> int:
+        function = self.functions[name]
+        loops = sorted(function.loops, key=lambda loop: len(loop.body))
+        # innermost loop first, so each block maps to the loop directly around it
+        owner: Dict[int, _Loop] = {}
+        for loop in loops:
+            for node in loop.body:
+                owner.setdefault(node, loop)
+        parent: Dict[str, Optional[_Loop]] = {}
+        for loop in loops:
+            outer = [other for other in loops if other is not loop and loop.body < other.body]
+            parent[loop.key] = min(outer, key=lambda other: len(other.body)) if outer else None
+
+        def value_of(node):
+            return self._block_value(self.blocks[node], metric, trip_counts, op_counts, name)
+
+        def rep(node, region):
+            # Collapse a node into the outermost loop inside region that contains it
+            loop = owner.get(node)
+            rep_loop = None
+            while loop is not None and loop is not region:
+                rep_loop = loop
+                loop = parent[loop.key]
+            return rep_loop
+
+        def loop_total(loop):
+            if loop.key not in trip_counts:
+                raise ProfileError("no trip count for loop {}, loops are {}".format(loop.key, self.loop_keys))
+            trips = trip_counts[loop.key]
+            per, fixed = iteration(loop)
+            return trips * per + (fixed if trips else 0) + value_of(loop.header)
+
+        def iteration(loop):
+            # Worst (per iteration, once in total) pair for one pass from the header back to it
+            memo = {}
+
+            def best(node):
+                if node in memo:
+                    return memo[node]
+                memo[node] = None
+                inner = rep(node, loop) if node != loop.header else None
+                if inner is not None:
+                    # The inner loop's exit check runs again every time it is entered
+                    exit_check = value_of(inner.header)
+                    here = (exit_check, loop_total(inner) - exit_check)
+                    succs = {succ for member in inner.body for succ in self.blocks[member].succs if succ not in inner.body}
+                else:
+                    here = (value_of(node), 0)
+                    succs = set(self.blocks[node].succs)
+                candidates = []
+                counted = None
+                for succ in succs:
+                    if succ == loop.header:
+                        candidates.append((0, 0))
+                    elif succ in loop.body:
+                        sub = best(succ if rep(succ, loop) is None else rep(succ, loop).header)
+                        if sub is not None:
+                            candidates.append(sub)
+                            runs = self._side_runs(name, succ, trip_counts)
+                            if runs is not None:
+                                counted = (sub, runs)
+                result = None
+                if candidates:
+                    trips = trip_counts.get(loop.key, 1)
+                    if counted is not None and len(candidates) == 2:
+                        # Both sides rejoin, only their per iteration costs differ
+                        side, runs = counted
+                        other = candidates[1 - candidates.index(side)]
+                        tail = (other[0], other[1] + runs * (side[0] - other[0]))
+                    else:
+                        tail = max(candidates, key=lambda pair: trips * pair[0] + pair[1])
+                    result = (here[0] + tail[0], here[1] + tail[1])
+                memo[node] = result
+                return result
+
+            pair = best(loop.header)
+            return pair if pair is not None else (0, 0)
+
+        def longest_from(start, target):
+            # Worst path from start to an exit, or to target (excluded) when given
+            memo = {}
+
+            def best(node):
+                if node == target:
+                    return 0
+                if node in memo:
+                    return memo[node]
+                memo[node] = None
+                loop = rep(node, None)
+                if loop is not None:
+                    here = loop_total(loop)
+                    succs = {succ for member in loop.body for succ in self.blocks[member].succs if succ not in loop.body}
+                    last = None
+                else:
+                    here = value_of(node)
+                    succs = self.blocks[node].succs
+                    last = self.blocks[node].last
+                results = []
+                for succ in succs:
+                    loop_succ = rep(succ, None)
+                    sub = best(loop_succ.header if loop_succ is not None else succ)
+                    if sub is not None:
+                        results.append(sub)
+                if results:
+                    result = here + max(results)
+                elif target is None and not succs and (last is None or last.op != "err"):
+                    result = here
+                else:
+                    result = None
+                memo[node] = result
+                return result
+
+            return best(start)
+
+        if through is None:
+            total = longest_from(function.entry, None)
+        else:
+            if rep(through, None) is not None:
+                raise ProfileError("branch markers inside loops are not supported")
+            before = longest_from(function.entry, through)
+            after = longest_from(through, None)
+            total = None if before is None or after is None else before + after
+        if total is None:
+            raise ProfileError("no path through {} reaches an exit".format(name))
+        if metric == "inner":
+            total += sum(
+                count for key, count in op_counts.items()
+                if key.split(":")[0] == name
+            )
+        return total
+
+
+@dataclass
+class BranchReport:
+    branch: str
+    num_files: int
+    cost: int
+    inner_txns: int
+    # Fee the app call has to carry to pay for itself and its inner transactions
+    fee: int
+    # App calls needed in the group for the pooled opcode budget
+    app_calls: int
+    fits: bool
+
+
+def profile_branches(
+    teal: str,
+    branches: Iterable[str],
+    sizes: Iterable[int],
+    trip_counts: Callable[[int], Dict[str, int]],
+    op_counts: Optional[Callable[[int], Dict[str, int]]] = None,
+    min_fee: int = 1000,
+) -> List[BranchReport]:
+    """
+    Profile every branch for every listing size.
+    Args:
+        teal: program to profile
+        branches: branch marker names
+        sizes: num_files values
+        trip_counts: num_files -> loop trip counts
+        op_counts: num_files -> exact op counts, see ProgramProfile.function_metrics
+        min_fee: minimum transaction fee
+    """
+    profile = ProgramProfile(teal)
+    reports = []
+    for num_files in sizes:
+        counts = trip_counts(num_files)
+        ops = op_counts(num_files) if op_counts else {}
+        for branch in branches:
+            metrics = profile.branch_metrics(branch, counts, ops)
+            app_calls = max(1, math.ceil(metrics.cost / OPCODE_BUDGET))
+            reports.append(BranchReport(
+                branch,
+                num_files,
+                metrics.cost,
+                metrics.inner_txns,
+                min_fee * (1 + metrics.inner_txns),
+                app_calls,
+                app_calls <= MAX_GROUP_SIZE and metrics.inner_txns <= MAX_INNER_TXNS,
+            ))
+    return reports
+
+
+def largest_fitting(reports: List[BranchReport], branch: str, single_call: bool = True) -> Optional[int]:
+    """
+    Largest profiled num_files whose run of branch fits one app call's budget,
+    or the pooled budget of a full group when single_call is False.
+    """
+    fitting = [
+        report.num_files for report in reports
+        if report.branch == branch and report.fits and (report.app_calls == 1 or not single_call)
+    ]
+    return max(fitting) if fitting else None
+
+
+def format_table(reports: List[BranchReport]) -> str:
+    header = "{:<10} {:>9} {:>8} {:>7} {:>9} {:>9} {:>5}".format(
+        "branch", "num_files", "cost", "inner", "fee", "app_calls", "fits"
+    )
+    lines = [header, "-" * len(header)]
+    for report in reports:
+        lines.append("{:<10} {:>9} {:>8} {:>7} {:>9} {:>9} {:>5}".format(
+            report.branch, report.num_files, report.cost, report.inner_txns,
+            report.fee, report.app_calls, "yes" if report.fits else "no"
+        ))
+    return "\n".join(lines)
+
+
+def to_json(reports: List[BranchReport], **extra) -> str:
+    return json.dumps(dict(extra, reports=[asdict(report) for report in reports]), indent=2)
@@ -1,11 +1,14 @@
-from base64 import b64decode
+from base64 import b64decode, b64encode
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Optional, Union
 
 from algosdk.v2client.algod import AlgodClient
 from pyteal import *
 from pyteal.ast import *
 
+from .assembler import assemble, cross_check, program_address
+from .cache import CompileCache, assembler_version
+
 
 def event(
     init: Expr = Reject(),
@@ -50,10 +53,19 @@ def check_self(
     )
 
 
-def application(pyteal: Expr) -> str:
+def application(pyteal: Union[Expr, str]) -> str:
+    # Contracts like step_01 already return compiled TEAL
+    if isinstance(pyteal, str):
+        return pyteal
     return compileTeal(pyteal, mode=Mode.Application, version=MAX_TEAL_VERSION)
 
 
+def logic_signature(pyteal: Union[Expr, str]) -> str:
+    if isinstance(pyteal, str):
+        return pyteal
+    return compileTeal(pyteal, mode=Mode.Signature, version=MAX_TEAL_VERSION)
+
+
 @dataclass
 class CompiledSignature:
     address: str
@@ -61,11 +73,24 @@ class CompiledSignature:
     teal: str
 
 
-def signature(algod_client: AlgodClient, pyteal: Expr) -> CompiledSignature:
-    teal = compileTeal(pyteal, mode=Mode.Signature, version=MAX_TEAL_VERSION)
-    compilation_result = algod_client.compile(teal)
+def signature(
+    algod_client: Optional[AlgodClient],
+    pyteal: Union[Expr, str],
+    cache: Optional[CompileCache] = None,
+    check_with_algod: bool = False,
+) -> CompiledSignature:
+    # Assembled offline; algod_client is only needed to cross-check the bytecode
+    teal = logic_signature(pyteal)
+    if check_with_algod:
+        bytecode = cross_check(algod_client, teal).bytecode
+    elif cache is None:
+        bytecode = assemble(teal).bytecode
+    else:
+        bytecode = cache.bytecode(
+            teal, lambda teal: assemble(teal).bytecode, assembler_version()
+        )
     return CompiledSignature(
-        address=compilation_result["hash"],
-        bytecode_b64=compilation_result["result"],
+        address=program_address(bytecode),
+        bytecode_b64=b64encode(bytecode).decode("utf-8"),
         teal=teal,
     )
@@ -0,0 +1,55 @@
+import pytest
+from algosdk.future import transaction
+from pyteal_helpers.artifact import Artifact, ArtifactError, FORMAT_VERSION, MAGIC
+from pyteal_helpers.assembler import ASSEMBLER_VERSION, assemble
+
+APPROVAL_TEAL = "#pragma version 8\nint 1\nreturn"
+CLEAR_TEAL = "#pragma version 8\nint 0\nreturn"
+
+@pytest.fixture
+def artifact():
+    return Artifact.build(
+        APPROVAL_TEAL,
+        CLEAR_TEAL,
+        assemble(APPROVAL_TEAL).bytecode,
+        assemble(CLEAR_TEAL).bytecode,
+        (2, 62),
+        (0, 0),
+        ASSEMBLER_VERSION
+    )
+
+def test_round_trip(tmp_path, artifact):
+    path = str(tmp_path / "sale.artifact")
+    artifact.dump(path)
+    loaded = Artifact.load(path)
+    assert loaded == artifact
+    assert loaded.global_schema == transaction.StateSchema(2, 62)
+    assert loaded.local_schema == transaction.StateSchema(0, 0)
+    assert loaded.compiler == ASSEMBLER_VERSION
+    assert loaded.built_from(APPROVAL_TEAL, CLEAR_TEAL)
+    assert not loaded.built_from(APPROVAL_TEAL, APPROVAL_TEAL)
+
+def test_corruption_is_detected(artifact):
+    data = bytearray(artifact.to_bytes())
+    # Last byte of the clear program
+    data[-1] ^= 1
+    with pytest.raises(ArtifactError, match="checksum"):
+        Artifact.from_buffer(data)
+
+def test_header_is_checked(artifact):
+    data = artifact.to_bytes()
+    with pytest.raises(ArtifactError, match="truncated"):
+        Artifact.from_buffer(data[:10])
+    with pytest.raises(ArtifactError, match="header says"):
+        Artifact.from_buffer(data[:-1])
+    with pytest.raises(ArtifactError, match="not a contract artifact"):
+        Artifact.from_buffer(b"\x80" + data[1:])
+    newer = data[:len(MAGIC)] + (FORMAT_VERSION + 1).to_bytes(2, "little") + data[len(MAGIC) + 2:]
+    with pytest.raises(ArtifactError, match="format"):
+        Artifact.from_buffer(newer)
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.artifact"
+    path.write_bytes(b"")
+    with pytest.raises(ArtifactError):
+        Artifact.load(str(path))
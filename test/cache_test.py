@@ -0,0 +1,61 @@
+import importlib
+import sys
+from pyteal_helpers.cache import CompileCache, assembler_version, project_sources, source_version
+
+CONTRACT = '''
+from cache_consts import SIZE
+
+def approval():
+    return "#pragma version 8\\nint {}\\n".format(SIZE)
+'''
+
+def write(path, source):
+    path.write_text(source)
+    importlib.invalidate_caches()
+
+def test_teal_key_covers_imported_constants(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    write(project / "cache_consts.py", "SIZE = 32\n")
+    write(project / "cache_contract.py", CONTRACT)
+    monkeypatch.syspath_prepend(str(project))
+    # A rewrite within the same second would otherwise reload a stale .pyc
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    contract = importlib.import_module("cache_contract")
+    assert [name for name, _ in project_sources(contract, str(project))] == ["cache_consts", "cache_contract"]
+
+    cache = CompileCache(str(tmp_path / "cache"), project_root=str(project))
+    assert cache.teal(contract.approval) == "#pragma version 8\nint 32\n"
+    cache.teal(contract.approval)
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+    # Only the imported module changes
+    write(project / "cache_consts.py", "SIZE = 40\n")
+    importlib.reload(importlib.import_module("cache_consts"))
+    importlib.reload(contract)
+    assert cache.teal(contract.approval) == "#pragma version 8\nint 40\n"
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+def test_bytecode_key_covers_the_assembler_source(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    write(project / "cache_asm.py", "OPCODE = 0x81\n")
+    monkeypatch.syspath_prepend(str(project))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    asm = importlib.import_module("cache_asm")
+    cache = CompileCache(str(tmp_path / "cache"), project_root=str(project))
+    teal = "#pragma version 8\nint 1\n"
+
+    def compile_fn(teal):
+        return bytes([8, asm.OPCODE, 1])
+
+    assert cache.bytecode(teal, compile_fn, source_version(asm, str(project))) == b"\x08\x81\x01"
+    cache.bytecode(teal, compile_fn, source_version(asm, str(project)))
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+    # An assembler fix is a new compiler, without anyone bumping a version
+    write(project / "cache_asm.py", "OPCODE = 0x22\n")
+    importlib.reload(asm)
+    assert cache.bytecode(teal, compile_fn, source_version(asm, str(project))) == b"\x08\x22\x01"
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+    assert assembler_version().startswith("pyteal_helpers.assembler-")
@@ -0,0 +1,99 @@
+import json
+import subprocess
+import sys
+import pytest
+from test_utils import PooledAlgodClient, fund_accounts, generate_new_account
+from test_utils.local_algod import LocalAlgod
+from cli import main
+
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+TOTAL_ITEM_COST = 300000
+TOKEN = 'a' * 64
+
+@pytest.fixture
+def funder():
+    return generate_new_account()
+
+@pytest.fixture
+def algod(funder):
+    with LocalAlgod(genesis={funder[2]: 10 ** 12}, token=TOKEN) as algod:
+        yield algod
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    from contracts.ipfs_transfer.deploy import load_sale_template
+    monkeypatch.chdir(tmp_path)
+    load_sale_template.cache_clear()
+    yield tmp_path
+    load_sale_template.cache_clear()
+
+def run(capsys, *argv):
+    code = main(list(argv))
+    return code, capsys.readouterr().out
+
+def test_sale(algod, funder, build_dir, capsys):
+    buyer_mnemonic, _, buyer = generate_new_account()
+    client = PooledAlgodClient(TOKEN, algod.address)
+    fund_accounts([buyer], funder[0], client=client)
+    client.close()
+    node = ['--algod', algod.address, '--token', TOKEN]
+
+    assert run(capsys, 'compile')[0] == 0
+    assert (build_dir / 'build' / 'ipfs_transfer.artifact').exists()
+    code, out = run(capsys, 'deploy', str(TOTAL_ITEM_COST), *TEST_IPFS_KEYS, '--buyer', buyer, '--mnemonic', funder[0], *node)
+    app_id = int(out)
+
+    state = json.loads(run(capsys, 'state', str(app_id), *node)[1])
+    assert state['global_state']['buyer'] == buyer
+    assert state['global_state']['num_files'] == len(TEST_IPFS_KEYS)
+
+    code, out = run(capsys, 'buy', str(app_id), '--mnemonic', buyer_mnemonic, *node)
+    assert code == 0
+    assert out.split(': ')[1].split() == TEST_IPFS_KEYS
+    assert json.loads(run(capsys, 'state', str(app_id), *node)[1])['global_state'] == {}
+
+def test_state_shows_slots_by_index(algod, funder, build_dir, capsys):
+    import base64
+    from test_utils import pack_digests
+    _, _, buyer = generate_new_account()
+    node = ['--algod', algod.address, '--token', TOKEN]
+    # 50 slots, slot 48 is b"0" and the last one holds a single digest
+    keys = (TEST_IPFS_KEYS * 74)[:148]
+    slots = pack_digests(keys)
+    assert len(slots) == 50 and len(slots[-1]) == 32
+
+    assert run(capsys, 'compile')[0] == 0
+    code, out = run(capsys, 'deploy', str(TOTAL_ITEM_COST), *keys, '--buyer', buyer, '--mnemonic', funder[0], *node)
+    global_state = json.loads(run(capsys, 'state', out.strip(), *node)[1])['global_state']
+    assert global_state['buyer'] == buyer
+    assert global_state['num_files'] == len(keys)
+    assert {key: global_state[key] for key in map(str, range(50))} == {
+        str(index): base64.b64encode(slot).decode() for index, slot in enumerate(slots)
+    }
+
+def test_errors_exit_with_a_message(algod, build_dir, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['state', '999', '--algod', algod.address])
+    assert exit_info.value.code == 1
+    assert 'application does not exist' in capsys.readouterr().err
+
+    with pytest.raises(SystemExit):
+        main(['deploy', '1', TEST_IPFS_KEYS[0], '--mnemonic', generate_new_account()[0], '--algod', algod.address])
+    assert 'compile the contract first' in capsys.readouterr().err
+
+def test_state_starts_without_heavy_imports(algod):
+    # A fresh interpreter, as the ops scripts run it
+    code = (
+        "import sys, cli\n"
+        "try:\n"
+        "    cli.main(['state', '1', '--algod', '{}', '--timings'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(sorted(m for m in ('algosdk', 'pyteal', 'test_utils') if m in sys.modules))\n"
+    ).format(algod.address)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+    assert 'startup' in result.stderr and 'total' in result.stderr
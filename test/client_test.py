@@ -0,0 +1,87 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from algosdk.error import AlgodHTTPError
+from test_utils import PooledAlgodClient, AsyncAlgodClient
+
+GENESIS_HASH = 'AQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQE='
+
+class FakeAlgod(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    last_round = 10
+    connections = set()
+    requests = []
+
+    def do_GET(self):
+        FakeAlgod.connections.add(self.client_address)
+        FakeAlgod.requests.append(self.path)
+        if self.path == '/v2/status':
+            self.reply(200, {'last-round': FakeAlgod.last_round})
+        elif self.path == '/v2/transactions/params':
+            self.reply(200, {
+                'fee': 0, 'min-fee': 1000, 'last-round': FakeAlgod.last_round,
+                'genesis-hash': GENESIS_HASH, 'genesis-id': 'sandnet-v1', 'consensus-version': 'future'
+            })
+        else:
+            self.reply(404, {'message': 'no such account'})
+
+    def reply(self, code, body):
+        body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def algod_url():
+    FakeAlgod.connections = set()
+    FakeAlgod.requests = []
+    FakeAlgod.last_round = 10
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAlgod)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_reuses_connection(algod_url):
+    client = PooledAlgodClient('token', algod_url)
+    for _ in range(5):
+        assert client.status()['last-round'] == 10
+    assert len(FakeAlgod.connections) == 1
+    client.close()
+
+def test_suggested_params_cached_per_round(algod_url):
+    client = PooledAlgodClient('token', algod_url)
+    first = client.suggested_params()
+    first.fee = 5000
+    assert client.suggested_params().fee == 0
+    assert FakeAlgod.requests.count('/v2/transactions/params') == 1
+    FakeAlgod.last_round = 11
+    client.status()
+    assert client.suggested_params().first == 11
+    assert FakeAlgod.requests.count('/v2/transactions/params') == 2
+
+def test_http_errors(algod_url):
+    client = PooledAlgodClient('token', algod_url)
+    with pytest.raises(AlgodHTTPError) as error:
+        client.account_info('NOPE')
+    assert error.value.code == 404
+    assert str(error.value) == 'no such account'
+
+def test_async_interface(algod_url):
+    async_client = AsyncAlgodClient(PooledAlgodClient('token', algod_url), max_workers=4)
+
+    async def run():
+        return await asyncio.gather(*[async_client.status() for _ in range(8)])
+
+    statuses = asyncio.run(run())
+    async_client.close()
+    assert [status['last-round'] for status in statuses] == [10] * 8
+    assert len(FakeAlgod.connections) <= 4
@@ -0,0 +1,115 @@
+import base64
+from collections import Counter
+import msgpack
+import pytest
+from algosdk import account
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from test_utils import block_txids, ConfirmationService, ConfirmationError
+
+GENESIS_HASH = b'\x01' * 32
+GENESIS_ID = 'sandnet-v1'
+
+def make_txns(count):
+    priv_key, address = account.generate_account()
+    params = transaction.SuggestedParams(1000, 10, 1010, base64.b64encode(GENESIS_HASH).decode(), GENESIS_ID, flat_fee=True)
+    txns = []
+    for i in range(count):
+        txn = transaction.ApplicationNoOpTxn(address, params, 7, [b'buy', i])
+        txns.append(txn.sign(priv_key))
+    return txns
+
+def encode_block(signed_txns):
+    # Blocks carry the transactions without their genesis hash/id
+    stxns = []
+    for signed in signed_txns:
+        stxn = signed.dictify()
+        txn = dict(stxn['txn'])
+        del txn['gh'], txn['gen']
+        stxns.append({'sig': stxn['sig'], 'txn': txn, 'hgi': True})
+    return msgpack.packb({'block': {'gh': GENESIS_HASH, 'gen': GENESIS_ID, 'txns': stxns}}, use_bin_type=True)
+
+class BlockClient:
+    """
+    Chain that advances one round per status_after_block call, with a fixed
+    set of txns landing in each round.
+    """
+    def __init__(self, rounds, pool_errors=None):
+        self.rounds = rounds
+        self.last_round = 0
+        self.pool_errors = pool_errors or {}
+        self.block_fetches = 0
+        self.confirmed = {}
+        self.info_calls = Counter()
+
+    def status(self):
+        return {'last-round': self.last_round}
+
+    def status_after_block(self, round_num):
+        self.last_round = max(self.last_round, round_num + 1)
+        return self.status()
+
+    def block_info(self, round_num, response_format='json'):
+        if round_num > self.last_round:
+            raise AlgodHTTPError('failed to retrieve information from the ledger', 404)
+        self.block_fetches += 1
+        signed = self.rounds.get(round_num, [])
+        for txn in signed:
+            self.confirmed[txn.transaction.get_txid()] = round_num
+        return encode_block(signed)
+
+    def pending_transaction_info(self, txid):
+        self.info_calls[txid] += 1
+        if txid in self.confirmed:
+            return {'confirmed-round': self.confirmed[txid], 'pool-error': ''}
+        return {'pool-error': self.pool_errors.get(txid, '')}
+
+def test_block_txids_match_sdk():
+    txns = make_txns(3)
+    assert block_txids(encode_block(txns)) == [txn.transaction.get_txid() for txn in txns]
+
+def test_confirms_across_rounds_with_one_fetch_per_round():
+    txns = make_txns(6)
+    client = BlockClient({1: txns[:4], 3: txns[4:]})
+    txids = [txn.transaction.get_txid() for txn in txns]
+    results = ConfirmationService(client, timeout=5).wait(txids)
+    assert [results[txid].confirmed_round for txid in txids] == [1, 1, 1, 1, 3, 3]
+    assert all(results[txid].info['confirmed-round'] for txid in txids)
+    # rounds 0 to 3, not one poll per txid per round
+    assert client.block_fetches == 4
+
+def test_reports_pool_errors():
+    txns = make_txns(2)
+    rejected = txns[1].transaction.get_txid()
+    client = BlockClient({1: txns[:1]}, pool_errors={rejected: 'overspend'})
+    txids = [txn.transaction.get_txid() for txn in txns]
+    with pytest.raises(ConfirmationError) as error:
+        ConfirmationService(client, timeout=3).wait(txids)
+    results = error.value.results
+    assert results[txids[0]].confirmed
+    assert results[rejected].pool_error == 'overspend'
+    assert 'overspend' in str(error.value)
+
+def test_settles_known_txns_without_waiting_for_blocks():
+    txns = make_txns(3)
+    confirmed, rejected, pending = [txn.transaction.get_txid() for txn in txns]
+    client = BlockClient({3: txns[2:]}, pool_errors={rejected: 'overspend'})
+    client.last_round = 2
+    # Sent in round 0, confirmed in a round before watching starts
+    client.confirmed[confirmed] = 1
+    futures = ConfirmationService(client, timeout=100).watch([confirmed, rejected, pending], submitted_round=0)
+    assert futures[confirmed].result(timeout=0).confirmed_round == 1
+    assert futures[rejected].result(timeout=0).pool_error == 'overspend'
+    assert not futures[pending].done()
+    assert client.block_fetches == 0
+
+def test_one_info_call_per_txid():
+    txns = make_txns(3)
+    txids = [txn.transaction.get_txid() for txn in txns]
+    rejected = txids[2]
+    client = BlockClient({1: txns[:1], 2: txns[1:2]}, pool_errors={rejected: 'overspend'})
+    with pytest.raises(ConfirmationError) as error:
+        ConfirmationService(client, timeout=3).wait(txids)
+    assert error.value.results[rejected].pool_error == 'overspend'
+    # Just sent, so none is looked up before its block or its timeout
+    assert client.info_calls == {txid: 1 for txid in txids}
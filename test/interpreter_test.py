@@ -0,0 +1,353 @@
+import base64
+import pytest
+from algosdk import account, encoding
+from algosdk.future import transaction
+from contracts.ipfs_transfer.deploy import MAX_PURCHASE_BOXES
+from pyteal_helpers.assembler import assemble
+from pyteal_helpers.interpreter import Ledger, TealError, TealReject, app_address, app_call, app_create, payment
+from test_utils import cid_to_digest, listing_min_balance, num_slots, pack_digests, DIGESTS_PER_SLOT, MAX_LISTING_FILES
+
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+TOTAL_ITEM_COST = 300000
+FUNDS = 10 ** 9
+
+def new_account():
+    return encoding.decode_address(account.generate_account()[1])
+
+@pytest.fixture
+def ledger():
+    return Ledger()
+
+@pytest.fixture
+def seller(ledger):
+    address = new_account()
+    ledger.fund(address, FUNDS)
+    return address
+
+@pytest.fixture
+def buyer(ledger):
+    address = new_account()
+    ledger.fund(address, FUNDS)
+    return address
+
+def deploy_sale(ledger, seller, buyer, keys, batch_delivery=True):
+    from contracts.ipfs_transfer.step_01 import approval, clear
+    create, = ledger.execute([app_create(
+        seller,
+        assemble(approval(batch_delivery)).bytecode,
+        assemble(clear()).bytecode,
+        global_schema=(3, num_slots(len(keys)) + 1)
+    )])
+    app_id = create.created_app_id
+    ledger.execute([app_call(seller, app_id, [TOTAL_ITEM_COST, len(keys)] + pack_digests(keys), [buyer])])
+    return app_id
+
+def purchase(app_id, seller, buyer, fee=3000):
+    return [
+        payment(buyer, app_address(app_id), TOTAL_ITEM_COST + 100000),
+        app_call(buyer, app_id, accounts=[seller], fee=fee),
+    ]
+
+def test_sale_setup_purchase_close(ledger, seller, buyer):
+    app_id = deploy_sale(ledger, seller, buyer, TEST_IPFS_KEYS)
+    state = ledger.global_state(app_id)
+    assert state[b'buyer'] == buyer
+    assert state[b'payment_amount'] == TOTAL_ITEM_COST
+    assert state[b'num_files'] == len(TEST_IPFS_KEYS)
+
+    seller_balance = ledger.balance(seller)
+    _, call = ledger.execute(purchase(app_id, seller, buyer))
+    pay, keys = call.inner
+    assert pay.txn['Receiver'] == seller and pay.txn['Amount'] == TOTAL_ITEM_COST
+    assert keys.txn['Receiver'] == buyer
+    assert keys.txn['Note'] == b''.join(cid_to_digest(cid) for cid in TEST_IPFS_KEYS)
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST
+    # Sale closed: every key deleted, the app account left at its minimum balance
+    assert ledger.global_state(app_id) == {}
+    assert set(call.global_delta) == set(state) and all(value is None for value in call.global_delta.values())
+    assert ledger.balance(app_address(app_id)) == 100000
+
+def test_rejected_group_rolls_back(ledger, seller, buyer):
+    app_id = deploy_sale(ledger, seller, buyer, TEST_IPFS_KEYS)
+    state = ledger.global_state(app_id)
+    balances = ledger.balance(seller), ledger.balance(buyer)
+    stranger = new_account()
+    ledger.fund(stranger, FUNDS)
+    # No branch of the contract matches a stranger
+    with pytest.raises(TealError, match="err opcode") as error:
+        ledger.execute(purchase(app_id, seller, stranger))
+    assert error.value.txn_index == 1
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(purchase(app_id, seller, buyer, fee=2000))
+    assert ledger.global_state(app_id) == state
+    assert (ledger.balance(seller), ledger.balance(buyer)) == balances
+
+def test_budget_and_fees_are_pooled(ledger, seller, buyer):
+    # 31 files are 11 slots, two notes: the 3000 the contract checks can't pay for
+    # 4 transactions, and the purchase takes more than one call's opcode budget
+    keys = TEST_IPFS_KEYS * 15 + TEST_IPFS_KEYS[:1]
+    app_id = deploy_sale(ledger, seller, buyer, keys)
+    with pytest.raises(TealError, match="budget"):
+        ledger.execute(purchase(app_id, seller, buyer, fee=4000))
+    program = assemble("#pragma version 8\nint 1\n").bytecode
+    budget_app = ledger.execute([app_create(seller, program, program)])[0].created_app_id
+    with pytest.raises(TealError, match="fee too small"):
+        ledger.execute(purchase(app_id, seller, buyer) + [app_call(buyer, budget_app)])
+    _, call, _ = ledger.execute(purchase(app_id, seller, buyer, fee=4000) + [app_call(buyer, budget_app)])
+    assert len(call.inner) == 3
+    assert call.cost > 700
+
+def test_trace(ledger, seller, buyer):
+    app_id = deploy_sale(ledger, seller, buyer, TEST_IPFS_KEYS)
+    _, call = ledger.execute(purchase(app_id, seller, buyer), trace=True)
+    assert len(call.trace) > 0
+    assert sum(step.cost for step in call.trace) == call.cost
+    assert call.trace[-1].op == 'return' and call.trace[-2].stack[-1] == 1
+    assert [step.op for step in call.trace[:2]] == ['intcblock', 'bytecblock']
+    submits = [step for step in call.trace if step.op == 'itxn_submit']
+    assert len(submits) == 2
+
+def test_failed_create_leaves_no_app(ledger, seller):
+    clear = assemble("#pragma version 8\nint 1\n").bytecode
+    loop = assemble("#pragma version 8\nloop:\nb loop\n").bytecode
+    with pytest.raises(TealError, match="budget"):
+        ledger.execute([app_create(seller, loop, clear)])
+    with pytest.raises(TealReject):
+        ledger.execute([app_create(seller, assemble("#pragma version 8\nint 0\n").bytecode, clear)])
+    assert ledger.apps == {} and ledger.min_balance(seller) == 100000
+
+def test_box_references_are_shared_by_the_group(ledger, seller):
+    clear = assemble("#pragma version 8\nint 1\n").bytecode
+    writer = assemble("#pragma version 8\ntxn ApplicationID\nbz done\nbyte \"b\"\nbyte \"x\"\nbox_put\ndone:\nint 1\n")
+    create, = ledger.execute([app_create(seller, writer.bytecode, clear)])
+    app_id = create.created_app_id
+    ledger.fund(app_address(app_id), 200000)
+    with pytest.raises(TealError, match="invalid box reference"):
+        ledger.execute([app_call(seller, app_id)])
+    # Only the first call names the box, the second one writes it
+    ledger.execute([app_call(seller, app_id, boxes=[(0, b"b")]), app_call(seller, app_id, ["write"])])
+    assert ledger.app_boxes(app_id) == {b"b": b"x"}
+
+def test_marketplace_from_sdk_txns(ledger, seller, buyer):
+    from contracts.ipfs_transfer.deploy import listing_purchase_txns, with_listing_refs, MAX_APP_CALL_REFS
+    from contracts.ipfs_transfer.marketplace import approval, clear
+    params = transaction.SuggestedParams(1000, 1, 1000, base64.b64encode(bytes(32)).decode(), 'sandnet-v1',
+        flat_fee=True, min_fee=1000)
+    seller_address, buyer_address = encoding.encode_address(seller), encoding.encode_address(buyer)
+    create, = ledger.execute([app_create(seller, assemble(approval()).bytecode, assemble(clear()).bytecode)])
+    app_id = create.created_app_id
+    ledger.fund(app_address(app_id), 100000)
+
+    keys = TEST_IPFS_KEYS * 20
+    digests = b''.join(cid_to_digest(cid) for cid in keys)
+    funding = transaction.PaymentTxn(seller_address, params, encoding.encode_address(app_address(app_id)),
+        listing_min_balance(len(keys)))
+    listing = transaction.ApplicationNoOpTxn(seller_address, params, app_id,
+        ["list", 7, TOTAL_ITEM_COST, len(keys), digests], [buyer_address])
+    group, = with_listing_refs(params, seller_address, app_id, 7, len(keys),
+        [(listing, MAX_APP_CALL_REFS - 1)], [funding])
+    ledger.execute(group)
+    assert len(ledger.app_boxes(app_id)[(7).to_bytes(8, 'big')]) == 88 + 32 * len(keys)
+
+    seller_balance = ledger.balance(seller)
+    txns = listing_purchase_txns(params, buyer_address, seller_address, app_id, 7, TOTAL_ITEM_COST, len(keys))
+    results = ledger.execute(txns)
+    notes = [inner.txn['Note'] for inner in results[1].inner[1:-1]]
+    assert b''.join(notes) == digests
+    # The seller gets the price and the box minimum balance back
+    assert ledger.app_boxes(app_id) == {}
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST + listing_min_balance(len(keys))
+    assert ledger.balance(app_address(app_id)) == 100000
+
+def test_partial_upload_cannot_be_bought(ledger, seller, buyer):
+    from contracts.ipfs_transfer.step_01 import approval, clear
+    # 4 slots, only the first one uploaded by the setup call
+    keys = TEST_IPFS_KEYS * 6
+    create, = ledger.execute([app_create(
+        seller,
+        assemble(approval()).bytecode,
+        assemble(clear()).bytecode,
+        global_schema=(3, num_slots(len(keys)) + 1)
+    )])
+    app_id = create.created_app_id
+    slots = pack_digests(keys)
+    ledger.execute([app_call(seller, app_id, [TOTAL_ITEM_COST, len(keys)] + slots[:1], [buyer])])
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(purchase(app_id, seller, buyer))
+    # Appends have to continue where the upload stopped
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute([app_call(seller, app_id, ["append", 2 * DIGESTS_PER_SLOT] + slots[2:])])
+    ledger.execute([app_call(seller, app_id, ["append", DIGESTS_PER_SLOT] + slots[1:])])
+    _, call = ledger.execute(purchase(app_id, seller, buyer))
+    assert call.inner[1].txn['Note'] == b''.join(cid_to_digest(cid) for cid in keys)
+
+def test_proceeds_go_to_the_creator(ledger, seller, buyer):
+    app_id = deploy_sale(ledger, seller, buyer, TEST_IPFS_KEYS)
+    pay, call = purchase(app_id, seller, buyer)
+    # The buyer names itself as the account to pay
+    call['Accounts'] = [buyer]
+    with pytest.raises(TealError, match="unavailable account"):
+        ledger.execute([pay, call])
+    seller_balance = ledger.balance(seller)
+    ledger.execute(purchase(app_id, seller, buyer))
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST
+
+def deploy_box_sale(ledger, seller, buyer, keys):
+    from contracts.ipfs_transfer.box_storage import approval, clear
+    from contracts.ipfs_transfer.deploy import APP_ACCOUNT_MIN_BALANCE
+    from test_utils import box_min_balance, box_name, pack_box_chunks
+    create, = ledger.execute([app_create(seller, assemble(approval()).bytecode, assemble(clear()).bytecode,
+        global_schema=(2, 1))])
+    app_id = create.created_app_id
+    ledger.execute([
+        payment(seller, app_address(app_id), APP_ACCOUNT_MIN_BALANCE + box_min_balance(len(keys))),
+        app_call(seller, app_id, [TOTAL_ITEM_COST, len(keys)], [buyer]),
+    ])
+    # One box per call, as setup_box_shop uploads them
+    for index, chunk in enumerate(pack_box_chunks(keys)):
+        ledger.execute([app_call(seller, app_id, ["put_chunk", index, chunk], boxes=[(0, box_name(index))])])
+    return app_id
+
+def test_box_sale_pays_the_creator(ledger, seller, buyer):
+    from contracts.ipfs_transfer.deploy import box_purchase_txns
+    from test_utils import box_min_balance
+    params = transaction.SuggestedParams(1000, 1, 1000, base64.b64encode(bytes(32)).decode(), 'sandnet-v1',
+        flat_fee=True, min_fee=1000)
+    seller_address, buyer_address = encoding.encode_address(seller), encoding.encode_address(buyer)
+    keys = TEST_IPFS_KEYS * 20
+    app_id = deploy_box_sale(ledger, seller, buyer, keys)
+
+    # The buyer pays itself and names itself as the account to pay
+    pay, call, *refs = box_purchase_txns(params, buyer_address, buyer_address, app_id, TOTAL_ITEM_COST, len(keys))
+    pay.receiver = buyer_address
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(transaction.assign_group_id([pay, call] + refs))
+    pay.receiver = encoding.encode_address(app_address(app_id))
+    with pytest.raises(TealError, match="unavailable account"):
+        ledger.execute(transaction.assign_group_id([pay, call] + refs))
+
+    seller_balance = ledger.balance(seller)
+    txns = box_purchase_txns(params, buyer_address, seller_address, app_id, TOTAL_ITEM_COST, len(keys))
+    ledger.execute(txns)
+    assert ledger.app_boxes(app_id) == {}
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST + box_min_balance(len(keys))
+    with pytest.raises(ValueError):
+        box_purchase_txns(params, buyer_address, seller_address, app_id, TOTAL_ITEM_COST, 32 * MAX_PURCHASE_BOXES + 1)
+
+def test_merkle_sale_pays_the_creator(ledger, seller, buyer):
+    from contracts.ipfs_transfer.merkle_root import approval, clear
+    from test_utils import MerkleTree
+    create, = ledger.execute([app_create(seller, assemble(approval()).bytecode, assemble(clear()).bytecode,
+        global_schema=(2, 2))])
+    app_id = create.created_app_id
+    tree = MerkleTree(TEST_IPFS_KEYS)
+    ledger.execute([app_call(seller, app_id, [TOTAL_ITEM_COST, tree.num_leaves, tree.root], [buyer])])
+
+    # Paying someone else than the app is not a purchase
+    pay, call = purchase(app_id, seller, buyer)
+    pay['Receiver'] = seller
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute([pay, call])
+    pay, call = purchase(app_id, seller, buyer)
+    call['Accounts'] = [buyer]
+    with pytest.raises(TealError, match="unavailable account"):
+        ledger.execute([pay, call])
+
+    seller_balance = ledger.balance(seller)
+    _, call = ledger.execute(purchase(app_id, seller, buyer))
+    assert call.inner[1].txn['Note'] == tree.root + tree.num_leaves.to_bytes(8, 'big')
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST
+
+def test_marketplace_listing_is_funded_and_complete(ledger, seller, buyer):
+    from contracts.ipfs_transfer.deploy import listing_purchase_txns, with_listing_refs, MAX_APP_CALL_REFS
+    from contracts.ipfs_transfer.marketplace import approval, clear
+    params = transaction.SuggestedParams(1000, 1, 1000, base64.b64encode(bytes(32)).decode(), 'sandnet-v1',
+        flat_fee=True, min_fee=1000)
+    seller_address, buyer_address = encoding.encode_address(seller), encoding.encode_address(buyer)
+    create, = ledger.execute([app_create(seller, assemble(approval()).bytecode, assemble(clear()).bytecode)])
+    app_id = create.created_app_id
+    # Enough for the listing box, so only the checks on the funding payment stop it
+    ledger.fund(app_address(app_id), 100000 + listing_min_balance(100))
+
+    keys = TEST_IPFS_KEYS * 50
+    digests = b''.join(cid_to_digest(cid) for cid in keys)
+
+    def listing_group(first_group):
+        listing = transaction.ApplicationNoOpTxn(seller_address, params, app_id,
+            ["list", 7, TOTAL_ITEM_COST, len(keys), digests[:32 * 63]], [buyer_address])
+        group, = with_listing_refs(params, seller_address, app_id, 7, len(keys),
+            [(listing, MAX_APP_CALL_REFS - 1)], first_group)
+        return group
+
+    # Without a payment ahead of it, the call has none to read
+    with pytest.raises(TealError):
+        ledger.execute(listing_group([]))
+    app = encoding.encode_address(app_address(app_id))
+    short = transaction.PaymentTxn(seller_address, params, app, listing_min_balance(len(keys)) - 1)
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(listing_group([short]))
+    elsewhere = transaction.PaymentTxn(seller_address, params, buyer_address, listing_min_balance(len(keys)))
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(listing_group([elsewhere]))
+    funding = transaction.PaymentTxn(seller_address, params, app, listing_min_balance(len(keys)))
+    ledger.execute(listing_group([funding]))
+
+    # 63 of the 100 digests are uploaded
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(listing_purchase_txns(params, buyer_address, seller_address, app_id, 7, TOTAL_ITEM_COST, len(keys)))
+
+    def put(first):
+        call = transaction.ApplicationNoOpTxn(seller_address, params, app_id, ["put", 7, first, digests[32 * first:]])
+        group, = with_listing_refs(params, seller_address, app_id, 7, len(keys), [(call, MAX_APP_CALL_REFS)])
+        return group
+
+    with pytest.raises(TealError, match="assert failed"):
+        ledger.execute(put(64))
+    ledger.execute(put(63))
+    results = ledger.execute(listing_purchase_txns(params, buyer_address, seller_address, app_id, 7, TOTAL_ITEM_COST, len(keys)))
+    assert b''.join(inner.txn['Note'] for inner in results[1].inner[1:-1]) == digests
+
+# 448 files are the most one inner group of 16 delivers, MAX_LISTING_FILES fill the box
+@pytest.mark.parametrize('num_files', [448, 449, MAX_LISTING_FILES])
+def test_marketplace_delivers_any_listing_size(ledger, seller, buyer, num_files):
+    from contracts.ipfs_transfer.deploy import listing_groups, listing_purchase_txns
+    from contracts.ipfs_transfer.marketplace import approval, clear
+    params = transaction.SuggestedParams(1000, 1, 1000, base64.b64encode(bytes(32)).decode(), 'sandnet-v1',
+        flat_fee=True, min_fee=1000)
+    seller_address, buyer_address = encoding.encode_address(seller), encoding.encode_address(buyer)
+    create, = ledger.execute([app_create(seller, assemble(approval()).bytecode, assemble(clear()).bytecode)])
+    app_id = create.created_app_id
+    ledger.fund(app_address(app_id), 100000)
+
+    keys = (TEST_IPFS_KEYS * num_files)[:num_files]
+    for group in listing_groups(params, seller_address, app_id, 7, buyer_address, TOTAL_ITEM_COST, keys):
+        ledger.execute(group)
+    seller_balance = ledger.balance(seller)
+    results = ledger.execute(listing_purchase_txns(params, buyer_address, seller_address, app_id, 7, TOTAL_ITEM_COST,
+        num_files))
+    notes = [inner.txn['Note'] for inner in results[1].inner[1:-1]]
+    assert b''.join(notes) == b''.join(cid_to_digest(cid) for cid in keys)
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST + listing_min_balance(num_files)
+    assert ledger.app_boxes(app_id) == {}
+
+# 16 boxes of 32 files fill one inner group of notes, MAX_PURCHASE_BOXES fill the purchase group
+@pytest.mark.parametrize('num_files', [512, 513, 32 * MAX_PURCHASE_BOXES])
+def test_box_sale_delivers_several_inner_groups(ledger, seller, buyer, num_files):
+    from contracts.ipfs_transfer.deploy import box_purchase_txns
+    from test_utils import box_min_balance
+    params = transaction.SuggestedParams(1000, 1, 1000, base64.b64encode(bytes(32)).decode(), 'sandnet-v1',
+        flat_fee=True, min_fee=1000)
+    seller_address, buyer_address = encoding.encode_address(seller), encoding.encode_address(buyer)
+    keys = (TEST_IPFS_KEYS * num_files)[:num_files]
+    app_id = deploy_box_sale(ledger, seller, buyer, keys)
+
+    seller_balance = ledger.balance(seller)
+    results = ledger.execute(box_purchase_txns(params, buyer_address, seller_address, app_id, TOTAL_ITEM_COST,
+        num_files))
+    notes = [inner.txn['Note'] for inner in results[1].inner[1:-1]]
+    assert b''.join(notes) == b''.join(cid_to_digest(cid) for cid in keys)
+    assert ledger.app_boxes(app_id) == {}
+    assert ledger.balance(seller) == seller_balance + TOTAL_ITEM_COST + box_min_balance(num_files)
@@ -2,17 +2,16 @@ import os
 from tokenize import String
 import pytest
 import base64
-from test_utils import load_schema, get_global_state, get_local_state, ipfscidv0_to_byte32, payment_signed_txn, wait_for_txn_confirm, sign_txn, byte32_to_ipfscidv0
+from test_utils import load_artifact, get_global_state, get_local_state, payment_signed_txn, wait_for_txn_confirm, wait_for_txns_confirm, sign_txn, cid_to_digest, delivered_file_keys, pack_digests, unpack_digests, num_slots, slot_key
 from algosdk.future import transaction
 from algosdk.v2client import algod
 from algosdk import encoding
 
 DEFAULT_STATE_BYTES=1
-DEFAULT_STATE_INTS=2
+DEFAULT_STATE_INTS=3
 TEST_NUM_FILES=1
 TEST_IPFS_KEY=["QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG"]
 TOTAL_ITEM_COST=300000
-NOOP_FEE=3000
 
 @pytest.fixture(scope='class')
 def test_config():
@@ -23,29 +22,26 @@ def test_config():
 def client(test_config):
     algod_address = test_config['algod_address']
     algod_token = test_config['algod_token']
-    client = algod.AlgodClient(algod_token, algod_address)
-    return client
+    from test_utils import get_algod_client
+    return get_algod_client(algod_token, algod_address)
 
 @pytest.fixture(scope='class')
-def wallet_1():
-    from test_utils import generate_new_account, fund_account
-    mnemonic, priv_key, address = generate_new_account()
-    
-    wallet_1 = {'mnemonic': mnemonic, 'address': address, 'priv_key': priv_key}
-    
-    fund_account(wallet_1['address'], os.getenv('fund_account_mnemonic'))
-    print(wallet_1)
-    return wallet_1
+def wallets(client):
+    from test_utils import WalletPool
+    # Leased from the pool shared by every run and worker, only topped up when short
+    pool = WalletPool(client, os.getenv('fund_account_mnemonic'))
+    wallets = pool.lease(2)
+    yield wallets
+    pool.release(wallets)
 
 @pytest.fixture(scope='class')
-def wallet_2():
-    from test_utils import generate_new_account, fund_account
-    mnemonic, priv_key, address = generate_new_account()
-    
-    wallet_2 = {'mnemonic': mnemonic, 'address': address, 'priv_key': priv_key}
-    
-    fund_account(wallet_2['address'], os.getenv('fund_account_mnemonic'))
-    return wallet_2
+def wallet_1(wallets):
+    print(wallets[0])
+    return wallets[0]
+
+@pytest.fixture(scope='class')
+def wallet_2(wallets):
+    return wallets[1]
 
 @pytest.fixture(scope='class')
 def app_id(test_config, wallet_1):
@@ -68,18 +64,16 @@ class TestIPFSTransfer:
         clean_build()
         import os
         compile_ipfs(client, TEST_NUM_FILES)
-        assert os.path.exists('./build/ipfs_transfer_approval.compiled')
-        assert os.path.exists('./build/ipfs_transfer_clear.compiled')
+        assert os.path.exists('./build/ipfs_transfer.artifact')
         assert os.path.exists('./build/ipfs_transfer_approval.teal')
         assert os.path.exists('./build/ipfs_transfer_clear.teal')
-        assert os.path.exists('./build/global_schema')
-        assert os.path.exists('./build/local_schema')
         
         
     def test_schema(self):
-        global_schema = load_schema('global_schema')
-        local_schema = load_schema('local_schema')
-        assert global_schema == transaction.StateSchema(DEFAULT_STATE_INTS, TEST_NUM_FILES + DEFAULT_STATE_BYTES)
+        artifact = load_artifact('ipfs_transfer.artifact')
+        global_schema = artifact.global_schema
+        local_schema = artifact.local_schema
+        assert global_schema == transaction.StateSchema(DEFAULT_STATE_INTS, num_slots(TEST_NUM_FILES) + DEFAULT_STATE_BYTES)
         assert local_schema == transaction.StateSchema(0, 0)
         
     def test_deploy(self, app_id, client, wallet_1):
@@ -95,12 +89,12 @@ class TestIPFSTransfer:
         
         # Prepare NoOp transaction from the creator (business) address
         # Adds ipfs keys to the SC for purchase by buyer
-        # Limit is 13 keys at a time (arg limit)
-        # total of 61 keys total on a single SC for purchase (3 global states locked up in TotalCost, BuyerAddress, and NumItems)
+        # Keys are packed 3 raw digests to an arg/global slot
+        # Limit is 11 slots (33 keys) at a time (opcode budget of one call), upload_listing appends the rest
+        # total of 60 slots (180 keys) on a single SC for purchase (4 global states locked up in TotalCost, BuyerAddress, NumItems and the uploaded slot count)
         txn_args = [TOTAL_ITEM_COST, TEST_NUM_FILES]
-        for key in TEST_IPFS_KEY:
-            txn_args.append(ipfscidv0_to_byte32(key))
-        assert len(txn_args) == 3
+        txn_args.extend(pack_digests(TEST_IPFS_KEY))
+        assert len(txn_args) == 2 + num_slots(TEST_NUM_FILES)
         txn_prepare_purchase = transaction.ApplicationNoOpTxn(
             wallet_1['address'], 
             params,
@@ -133,13 +127,17 @@ class TestIPFSTransfer:
         expected_global = {
             "buyer": base64.b64encode(encoding.decode_address(wallet_2['address'])).decode('utf-8'),
             "payment_amount": TOTAL_ITEM_COST,
-            "num_files": TEST_NUM_FILES
+            "num_files": TEST_NUM_FILES,
+            "uploaded": num_slots(TEST_NUM_FILES)
         }
         
-        for i in range(0, TEST_NUM_FILES):
-            expected_global[i.to_bytes(8, 'big').decode()] = base64.b64encode(ipfscidv0_to_byte32(TEST_IPFS_KEY[i]).encode('utf-8')).decode('utf-8')
+        for i, slot in enumerate(pack_digests(TEST_IPFS_KEY)):
+            expected_global[slot_key(i).decode()] = base64.b64encode(slot).decode('utf-8')
            
         assert_state(local_state, global_state, None, expected_global)
+        
+        slots = [global_state[slot_key(i).decode()] for i in range(num_slots(TEST_NUM_FILES))]
+        assert unpack_digests(slots, TEST_NUM_FILES) == TEST_IPFS_KEY
 
         
           
@@ -151,9 +149,10 @@ class TestIPFSTransfer:
         # Create txns
         txn_pay = transaction.PaymentTxn(wallet_2['address'], params, app_address, TOTAL_ITEM_COST + 100000)
 
-        # Make sure noop fee covers inner txns    
+        # Make sure noop fee covers inner txns, exactly
+        from contracts.ipfs_transfer.purchase import purchase_cost
         txn_noop = transaction.ApplicationNoOpTxn(wallet_2['address'], params, app_id)
-        txn_noop.fee = NOOP_FEE
+        txn_noop.fee = purchase_cost(TEST_NUM_FILES, params.min_fee)[0]
         txn_noop.accounts = [wallet_1['address']]
         print(txn_noop)
         
@@ -177,12 +176,11 @@ class TestIPFSTransfer:
         client.send_transactions(signed_group)
         
         # Wait for txn to confirm or throw after 5 rounds
-        wait_for_txn_confirm(client, noop_id, 5)
-        wait_for_txn_confirm(client, pay_id, 5)
+        confirmed = wait_for_txns_confirm(client, [pay_id, noop_id], 5)
         
         # Get responses
-        noop_response = client.pending_transaction_info(noop_id)
-        pay_response = client.pending_transaction_info(pay_id)
+        noop_response = confirmed[noop_id].info
+        pay_response = confirmed[pay_id].info
         
         #if there's an error, give a printout of the txn
         print (noop_response['inner-txns'])
@@ -192,9 +190,11 @@ class TestIPFSTransfer:
         assert inner_pay_txn['rcv'] == wallet_1['address'] 
         assert inner_pay_txn['amt'] == TOTAL_ITEM_COST
         # Make sure the inner transaction sent the right key
-        assert base64.b64decode(inner_key_txn['note']).decode() == ipfscidv0_to_byte32(TEST_IPFS_KEY[0])
+        assert base64.b64decode(inner_key_txn['note']) == cid_to_digest(TEST_IPFS_KEY[0])
         # Make sure the key was sent to the right account
         assert inner_key_txn['rcv'] == wallet_2['address']
+        # Make sure every key can be rebuilt from the delivery notes
+        assert delivered_file_keys(noop_response['inner-txns']) == TEST_IPFS_KEY
         
     def test_state_after_close(self, app_id, client, wallet_1):
         assert app_id
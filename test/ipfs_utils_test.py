@@ -0,0 +1,60 @@
+import base64
+import pytest
+from test_utils.ipfs_utils import (
+    CIDError,
+    byte32_to_ipfscidv0,
+    cid_to_digest,
+    cids_to_digests,
+    digests_to_cids,
+    ipfscidv0_to_byte32,
+    listing_box_name,
+    listing_box_size,
+    listing_min_balance,
+    MAX_LISTING_FILES,
+)
+
+TEST_CID = "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG"
+TEST_HEX = "d3a822d7e1311fca049d0922f1ed8843ec75d75f75ac617258ac113fd2097bed"
+
+def cidv1(digest, codec=0x70):
+    raw = bytes([0x01, codec]) + b"\x12\x20" + digest
+    return "b" + base64.b32encode(raw).decode().lower().rstrip("=")
+
+def test_hex_roundtrip():
+    assert ipfscidv0_to_byte32(TEST_CID) == TEST_HEX
+    assert byte32_to_ipfscidv0(TEST_HEX) == TEST_CID
+
+def test_batch_list_and_buffer():
+    digests = [bytes([i]) * 32 for i in range(5)]
+    cids = digests_to_cids(digests)
+    assert cids_to_digests(cids) == digests
+    buffer = cids_to_digests(cids, as_buffer=True)
+    assert buffer == b"".join(digests)
+    assert digests_to_cids(memoryview(buffer)) == cids
+
+def test_cidv1_inputs():
+    digest = bytes.fromhex(TEST_HEX)
+    assert cid_to_digest(cidv1(digest)) == digest
+    assert cid_to_digest(cidv1(digest, codec=0x55)) == digest
+    with pytest.raises(CIDError):
+        cid_to_digest(cidv1(digest, codec=0x71))
+
+def test_rejects_other_multihashes():
+    # sha2-512 multihash (0x13 0x40)
+    raw = bytes([0x01, 0x70, 0x13, 0x40]) + b"\x00" * 64
+    with pytest.raises(CIDError):
+        cid_to_digest("b" + base64.b32encode(raw).decode().lower().rstrip("="))
+    with pytest.raises(CIDError):
+        cid_to_digest(TEST_CID[:-1] + "0")
+
+def test_rejects_bad_buffer():
+    with pytest.raises(CIDError):
+        digests_to_cids(b"\x00" * 33)
+
+def test_listing_layout():
+    assert listing_box_name(7) == bytes(7) + b"\x07"
+    assert listing_box_size(1) == 88 + 32
+    assert listing_box_size(MAX_LISTING_FILES) <= 32768
+    assert listing_min_balance(1) == 2500 + 400 * (8 + 120)
+    with pytest.raises(ValueError):
+        listing_box_size(MAX_LISTING_FILES + 1)
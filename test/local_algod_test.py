@@ -0,0 +1,137 @@
+import base64
+import pytest
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from test_utils import PooledAlgodClient, cid_to_digest, delivered_file_keys, fund_accounts, generate_new_account, num_slots
+from test_utils import get_global_state, sign_txn, wait_for_txns_confirm
+from test_utils.local_algod import LocalAlgod
+
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+TOTAL_ITEM_COST = 300000
+NOOP_FEE = 3000
+TOKEN = 'a' * 64
+
+@pytest.fixture
+def funder():
+    return generate_new_account()
+
+@pytest.fixture(params=[0, None, 0.05], ids=['instant', 'on-demand', 'timed'])
+def algod(request, funder):
+    with LocalAlgod(block_time=request.param, genesis={funder[2]: 10 ** 12}, token=TOKEN) as algod:
+        yield algod
+
+@pytest.fixture
+def client(algod):
+    client = PooledAlgodClient(TOKEN, algod.address)
+    yield client
+    client.close()
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    from contracts.ipfs_transfer.deploy import load_sale_template
+    monkeypatch.chdir(tmp_path)
+    load_sale_template.cache_clear()
+    yield
+    load_sale_template.cache_clear()
+
+def purchase(client, app_id, seller, buyer):
+    params = client.suggested_params()
+    app_address = encoding.encode_address(encoding.checksum(b'appID' + app_id.to_bytes(8, 'big')))
+    txn_pay = transaction.PaymentTxn(buyer['address'], params, app_address, TOTAL_ITEM_COST + 100000)
+    txn_noop = transaction.ApplicationNoOpTxn(buyer['address'], params, app_id, accounts=[seller['address']])
+    txn_noop.fee = NOOP_FEE
+    transaction.assign_group_id([txn_pay, txn_noop])
+    client.send_transactions([sign_txn(txn_pay, buyer['priv_key']), sign_txn(txn_noop, buyer['priv_key'])])
+    return txn_pay.get_txid(), txn_noop.get_txid()
+
+def wallets(client, funder, count=2):
+    accounts = [generate_new_account() for _ in range(count)]
+    fund_accounts([address for _, _, address in accounts], funder[0], client=client)
+    return [{'mnemonic': m, 'priv_key': k, 'address': a} for m, k, a in accounts]
+
+def test_sale_through_the_helpers(algod, client, funder, build_dir):
+    from contracts.ipfs_transfer.step_01 import compile_ipfs
+    from contracts.ipfs_transfer.deploy import deploy_ipfs
+    seller, buyer = wallets(client, funder)
+    assert client.account_info(buyer['address'])['amount'] == 1000000
+
+    compile_ipfs(client, len(TEST_IPFS_KEYS), check_with_algod=True)
+    app_id = deploy_ipfs(algod.address, TOKEN, seller['mnemonic'], len(TEST_IPFS_KEYS), TOTAL_ITEM_COST,
+        TEST_IPFS_KEYS, buyer_address=buyer['address'])
+    global_state = get_global_state(client, seller['address'], app_id)
+    assert global_state['buyer'] == base64.b64encode(encoding.decode_address(buyer['address'])).decode()
+    assert global_state['num_files'] == len(TEST_IPFS_KEYS)
+
+    pay_id, noop_id = purchase(client, app_id, seller, buyer)
+    confirmed = wait_for_txns_confirm(client, [pay_id, noop_id], 5)
+    info = confirmed[noop_id].info
+    inner_pay, inner_keys = [inner['txn']['txn'] for inner in info['inner-txns']]
+    assert inner_pay['rcv'] == seller['address'] and inner_pay['amt'] == TOTAL_ITEM_COST
+    assert base64.b64decode(inner_keys['note']) == b''.join(cid_to_digest(cid) for cid in TEST_IPFS_KEYS)
+    assert delivered_file_keys(info['inner-txns']) == TEST_IPFS_KEYS
+    assert {entry['value']['action'] for entry in info['global-state-delta']} == {3}
+    assert get_global_state(client, seller['address'], app_id) is None
+    assert confirmed[pay_id].confirmed_round == confirmed[noop_id].confirmed_round
+
+@pytest.mark.parametrize('num_files', [34, 42])
+def test_listing_too_big_for_one_call(algod, client, funder, build_dir, num_files):
+    # 12 and 14 slots: the setup goes alone, an append carries what its budget can't
+    from contracts.ipfs_transfer.step_01 import compile_ipfs
+    from contracts.ipfs_transfer.deploy import deploy_ipfs
+    seller, buyer = wallets(client, funder)
+    # Another algo for the minimum balance of up to 14 slots
+    fund_accounts([seller['address']], funder[0], client=client)
+    keys = [TEST_IPFS_KEYS[i % 2] for i in range(num_files)]
+    # The app is sized for the listing, not for the one file the artifact was compiled for
+    compile_ipfs(client, 1)
+    app_id = deploy_ipfs(algod.address, TOKEN, seller['mnemonic'], num_files, TOTAL_ITEM_COST, keys,
+        buyer_address=buyer['address'])
+    assert client.application_info(app_id)['params']['global-state-schema']['num-byte-slice'] == num_slots(num_files) + 1
+    global_state = get_global_state(client, seller['address'], app_id)
+    assert global_state['uploaded'] == num_slots(num_files)
+
+def test_rejected_group_is_not_pooled(algod, client, funder):
+    from contracts.ipfs_transfer.step_01 import approval, clear
+    from pyteal_helpers.assembler import assemble
+    seller, buyer = wallets(client, funder)
+    params = client.suggested_params()
+    create = transaction.ApplicationCreateTxn(seller['address'], params, transaction.OnComplete.NoOpOC,
+        assemble(approval()).bytecode, assemble(clear()).bytecode,
+        transaction.StateSchema(3, 2), transaction.StateSchema(0, 0))
+    client.send_transactions([sign_txn(create, seller['priv_key'])])
+    app_id = wait_for_txns_confirm(client, [create.get_txid()], 5)[create.get_txid()].info['application-index']
+    assert client.application_info(app_id)['params']['creator'] == seller['address']
+
+    # No sale is set up, so the contract fails the purchase at submission
+    with pytest.raises(AlgodHTTPError, match="TransactionPool.Remember"):
+        purchase(client, app_id, seller, buyer)
+    last_round = client.status()['last-round']
+    # Sent twice, the same transaction is refused the second time
+    txn = transaction.PaymentTxn(buyer['address'], params, seller['address'], 1000)
+    client.send_transactions([sign_txn(txn, buyer['priv_key'])])
+    with pytest.raises(AlgodHTTPError, match="already in ledger"):
+        client.send_transactions([sign_txn(txn, buyer['priv_key'])])
+    wait_for_txns_confirm(client, [txn.get_txid()], 5)
+    assert client.status()['last-round'] > last_round
+
+def test_on_demand_blocks(funder):
+    with LocalAlgod(block_time=None, genesis={funder[2]: 10 ** 12}) as algod:
+        client = PooledAlgodClient('', algod.address)
+        receiver = account.generate_account()[1]
+        txn = transaction.PaymentTxn(funder[2], client.suggested_params(), receiver, 500000)
+        client.send_transactions([sign_txn(txn, funder[1])])
+        # Pending until a block is asked for
+        assert 'confirmed-round' not in client.pending_transaction_info(txn.get_txid())
+        assert client.account_info(receiver)['amount'] == 0
+        status = client.status_after_block(client.status()['last-round'])
+        assert client.pending_transaction_info(txn.get_txid())['confirmed-round'] == status['last-round']
+        assert client.account_info(receiver)['amount'] == 500000
+        client.close()
+
+def test_token_required(algod):
+    with pytest.raises(AlgodHTTPError, match="Invalid API Token"):
+        PooledAlgodClient('wrong', algod.address).status()
@@ -0,0 +1,47 @@
+import base64
+import pytest
+from test_utils import (
+    MerkleTree,
+    cids_to_digests,
+    commitment_note,
+    delivered_commitment,
+    digests_to_cids,
+    merkle_root,
+    verify_list,
+    verify_proof,
+    verify_proofs,
+)
+
+def make_cids(count):
+    return digests_to_cids([i.to_bytes(32, 'big') for i in range(count)])
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 13, 100])
+def test_every_proof_verifies(count):
+    cids = make_cids(count)
+    digests = cids_to_digests(cids)
+    tree = MerkleTree(cids)
+    for index, proof in enumerate(tree.proofs()):
+        assert verify_proof(tree.root, count, index, digests[index], proof)
+    items = list(zip(range(count), digests, tree.proofs()))
+    assert verify_proofs(tree.root, count, items) == [True] * count
+
+def test_rejects_wrong_leaf_and_index():
+    cids = make_cids(10)
+    digests = cids_to_digests(cids)
+    tree = MerkleTree(cids)
+    assert not verify_proof(tree.root, 10, 3, digests[4], tree.proof(3))
+    assert not verify_proof(tree.root, 10, 4, digests[3], tree.proof(3))
+    assert not verify_proof(tree.root, 10, 3, digests[3], tree.proof(3)[:-1])
+    # A bad proof must not be accepted by joining a node verified earlier
+    items = [(0, digests[0], tree.proof(0)), (1, digests[2], tree.proof(1))]
+    assert verify_proofs(tree.root, 10, items) == [True, False]
+
+def test_list_and_commitment():
+    cids = make_cids(7)
+    root = merkle_root(cids)
+    assert verify_list(root, cids)
+    assert not verify_list(root, cids[:-1])
+    assert not verify_list(root, list(reversed(cids)))
+    note = base64.b64encode(commitment_note(root, 7)).decode()
+    inner_txns = [{'txn': {'txn': {'amt': 1}}}, {'txn': {'txn': {'note': note}}}]
+    assert delivered_commitment(inner_txns) == (root, 7)
@@ -0,0 +1,81 @@
+import base64
+from algosdk.error import AlgodHTTPError
+from test_utils import StateMirror
+
+def b64(value):
+    return base64.b64encode(value).decode()
+
+def set_bytes(key, value):
+    return {'key': b64(key), 'value': {'action': 1, 'bytes': b64(value)}}
+
+def set_uint(key, value):
+    return {'key': b64(key), 'value': {'action': 2, 'uint': value}}
+
+def delete(key):
+    return {'key': b64(key), 'value': {'action': 3}}
+
+def app_call(app_id, round_num, delta=None, inner=()):
+    info = {'confirmed-round': round_num, 'txn': {'txn': {'type': 'appl', 'apid': app_id}}, 'inner-txns': list(inner)}
+    if delta is not None:
+        info['global-state-delta'] = delta
+    return info
+
+class ChainClient:
+    """
+    Serves the global state the test says the chain is at, counting full reads.
+    """
+    def __init__(self, apps, last_round=10):
+        self.apps = apps
+        self.last_round = last_round
+        self.full_reads = 0
+
+    def status(self):
+        return {'last-round': self.last_round}
+
+    def application_info(self, app_id):
+        self.full_reads += 1
+        state = [
+            {'key': b64(key), 'value': {'type': 2, 'uint': value} if isinstance(value, int) else {'type': 1, 'bytes': b64(value)}}
+            for key, value in self.apps[app_id].items()
+        ]
+        return {'id': app_id, 'params': {'global-state': state}}
+
+    def account_application_info(self, address, app_id):
+        raise AlgodHTTPError('account application info not found', 404)
+
+def test_applies_setup_and_close_deltas():
+    client = ChainClient({7: {}})
+    mirror = StateMirror(client)
+    mirror.track(7)
+    setup = app_call(7, 11, [set_bytes(b'buyer', b'\x01' * 32), set_uint(b'payment_amount', 300000), set_uint(b'num_files', 1), set_bytes(b'\x00', b'\x02' * 32)])
+    assert mirror.apply(setup) == [7]
+    assert mirror.get(7, 'payment_amount') == 300000
+    assert mirror.get(7, b'\x00') == b'\x02' * 32
+    close = app_call(7, 12, [delete(b'buyer'), delete(b'payment_amount'), delete(b'num_files'), delete(b'\x00')])
+    mirror.apply(close)
+    assert mirror.global_state(7) == {}
+    assert client.full_reads == 1
+
+def test_inner_app_call_deltas():
+    client = ChainClient({7: {}, 8: {b'count': 1}})
+    mirror = StateMirror(client)
+    mirror.track(7)
+    mirror.track(8)
+    outer = app_call(7, 11, [set_uint(b'calls', 1)], inner=[app_call(8, 11, [set_uint(b'count', 2)])])
+    assert mirror.apply(outer) == [7, 8]
+    assert mirror.get(8, 'count') == 2
+
+def test_gap_triggers_resync():
+    client = ChainClient({7: {b'num_files': 3}})
+    mirror = StateMirror(client)
+    mirror.track(7)
+    # Someone else cleared the sale, then our delete arrives for a key we never saw go
+    client.apps[7] = {}
+    client.last_round = 13
+    mirror.apply(app_call(7, 12, [delete(b'buyer')]))
+    assert mirror.resyncs == 2
+    assert mirror.global_state(7) == {}
+
+def test_untracked_apps_ignored():
+    mirror = StateMirror(ChainClient({}))
+    assert mirror.apply(app_call(9, 11, [set_uint(b'x', 1)])) == []
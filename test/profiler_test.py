@@ -0,0 +1,157 @@
+import pytest
+from pyteal_helpers.profiler import ProgramProfile, ProfileError
+
+LOOP_TEAL = """#pragma version 8
+int 0
+store 0
+loop:
+load 0
+int 5
+<
+bz done
+load 0
+int 1
++
+store 0
+b loop
+done:
+int 1
+return
+"""
+
+BRANCH_TEAL = """#pragma version 8
+txn NumAppArgs
+bnz buy
+// branch: setup
+int 1
+return
+buy:
+// branch: buy
+callsub pay_0
+sha256
+pop
+int 1
+return
+pay_0:
+itxn_begin
+itxn_submit
+byte "x"
+retsub
+"""
+
+def test_loop_cost_scales_with_trips():
+    profile = ProgramProfile(LOOP_TEAL)
+    assert profile.loop_keys == ["main:0"]
+    # intcblock for the two int 1, 2 before the loop, 4 per header check, 5 per body pass, 2 after
+    for trips in (0, 1, 5):
+        cost = profile.function_metrics("main", {"main:0": trips}).cost
+        assert cost == 1 + 2 + 4 * (trips + 1) + 5 * trips + 2
+
+NESTED_TEAL = """#pragma version 8
+int 0
+store 0
+outer:
+load 0
+int 2
+<
+bz done
+int 0
+store 1
+inner:
+load 1
+int 3
+<
+bz next
+load 1
+int 1
++
+store 1
+b inner
+next:
+load 0
+int 1
++
+store 0
+b outer
+done:
+int 1
+return
+"""
+
+def test_nested_loop_exit_checks():
+    profile = ProgramProfile(NESTED_TEAL)
+    cost = profile.function_metrics("main", {"main:0": 2, "main:1": 6}).cost
+    # intcblock, the inner header is checked 3 + 1 times on each of the 2 outer passes
+    assert cost == 1 + 2 + 4 * 3 + 2 * (2 + 4 * 4 + 5 * 3 + 5) + 2
+
+def test_missing_trip_count():
+    with pytest.raises(ProfileError):
+        ProgramProfile(LOOP_TEAL).function_metrics("main", {})
+
+def test_branches_and_subroutines():
+    profile = ProgramProfile(BRANCH_TEAL)
+    # intcblock for the two int 1
+    assert profile.branch_metrics("setup", {}).cost == 1 + 2 + 2
+    buy = profile.branch_metrics("buy", {})
+    # callsub + subroutine (4) + sha256 (35) + pop, int 1, return
+    assert buy.cost == 1 + 2 + 1 + 4 + 35 + 3
+    assert buy.inner_txns == 1
+
+def test_step_01_purchase_fee():
+    from contracts.ipfs_transfer.profile import profile
+    reports, summary = profile(sizes=(1, 31, 180))
+    purchase = {report.num_files: report for report in reports if report.branch == "purchase"}
+    # seller payment + one note per 30 files
+    assert [purchase[n].inner_txns for n in (1, 31, 180)] == [2, 3, 7]
+    assert purchase[180].fee == 8000
+    assert summary["largest_purchase_pooled"] == 180
+
+def test_listing_calls_fit_one_budget():
+    # A setup sent alone has no other call to pool opcode budget with
+    from contracts.ipfs_transfer.deploy import SLOTS_PER_CALL
+    from contracts.ipfs_transfer.profile import slots_per_call
+    assert slots_per_call() == slots_per_call(batch_delivery=False) == SLOTS_PER_CALL
+
+def step_01_costs(num_files, batch_delivery=True):
+    # setup and purchase cost of a listing, run by the interpreter
+    from algosdk import account, encoding
+    from contracts.ipfs_transfer.deploy import SLOTS_PER_CALL
+    from contracts.ipfs_transfer.step_01 import approval, clear
+    from pyteal_helpers.assembler import assemble
+    from pyteal_helpers.interpreter import Ledger, app_address, app_call, app_create, payment
+    from test_utils import num_slots, pack_digests, DIGESTS_PER_SLOT
+    keys = ([
+        "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+        "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+    ] * num_files)[:num_files]
+    seller, buyer = (encoding.decode_address(account.generate_account()[1]) for _ in range(2))
+    ledger = Ledger()
+    ledger.fund(seller, 10 ** 9)
+    ledger.fund(buyer, 10 ** 9)
+    idle = assemble("#pragma version 8\nint 1\n").bytecode
+    create, budget = ledger.execute([
+        app_create(seller, assemble(approval(batch_delivery)).bytecode, assemble(clear()).bytecode,
+            global_schema=(3, num_slots(num_files) + 1)),
+        app_create(seller, idle, idle, note=b"budget"),
+    ])
+    app_id = create.created_app_id
+    slots = pack_digests(keys)
+    setup, = ledger.execute([app_call(seller, app_id, [300000, num_files] + slots[:SLOTS_PER_CALL], [buyer])])
+    for start in range(SLOTS_PER_CALL, len(slots), SLOTS_PER_CALL):
+        ledger.execute([app_call(seller, app_id, ["append", start * DIGESTS_PER_SLOT] + slots[start:start + SLOTS_PER_CALL])])
+    # Idle calls pool their budget with the purchase
+    _, purchase, *_ = ledger.execute([
+        payment(buyer, app_address(app_id), 300000 + 100000),
+        app_call(buyer, app_id, accounts=[seller], fee=100000),
+    ] + [app_call(buyer, budget.created_app_id, [index]) for index in range(5)])
+    return setup.cost, purchase.cost
+
+def test_step_01_estimates_match_the_interpreter():
+    from contracts.ipfs_transfer.profile import profile
+    # 33 files fill one setup call with the last slot, 30 leave it to an append
+    sizes = (1, 3, 4, 30, 33, 42, 180)
+    reports, _ = profile(sizes=sizes)
+    estimates = {(report.branch, report.num_files): report.cost for report in reports}
+    for num_files in sizes:
+        setup, purchase = step_01_costs(num_files)
+        assert (estimates["setup", num_files], estimates["purchase", num_files]) == (setup, purchase)
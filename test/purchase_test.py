@@ -0,0 +1,104 @@
+import pytest
+from algosdk.error import AlgodHTTPError
+from algosdk import account
+from test_utils import PooledAlgodClient, WalletPool, generate_new_account, get_global_state
+from test_utils.local_algod import LocalAlgod
+from contracts.ipfs_transfer.purchase import Order, PurchaseClient, deploy_budget_app, purchase_cost
+
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+TOTAL_ITEM_COST = 300000
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from contracts.ipfs_transfer.deploy import load_sale_template
+    from contracts.ipfs_transfer.step_01 import compile_ipfs
+    monkeypatch.chdir(tmp_path)
+    load_sale_template.cache_clear()
+    compile_ipfs(None, 1)
+    funder = generate_new_account()
+    with LocalAlgod(genesis={funder[2]: 10 ** 12}) as algod:
+        client = PooledAlgodClient('', algod.address)
+        client.pool = WalletPool(client, funder[0], path=str(tmp_path / 'pool'), balance=10 ** 8)
+        yield client
+        client.close()
+    load_sale_template.cache_clear()
+
+def test_purchase_cost():
+    # The NoOp pays for itself, the seller payment and one note per 30 files
+    assert purchase_cost(1) == (3000, 1)
+    assert purchase_cost(30) == (3000, 1)
+    assert purchase_cost(31) == (4000, 2)
+    assert purchase_cost(180, min_fee=2000) == (16000, 5)
+
+def test_buy_many(client):
+    from contracts.ipfs_transfer.deploy import mass_deploy_ipfs
+    seller, *buyers = client.pool.lease(5)
+    sizes = [1, 2, 30, 31, 60]
+    listings = [
+        (seller['priv_key'], TOTAL_ITEM_COST, (TEST_IPFS_KEYS * 30)[:size], buyers[i % len(buyers)]['address'])
+        for i, size in enumerate(sizes)
+    ]
+    app_ids = mass_deploy_ipfs(client, listings)
+    orders = [
+        Order(app_id, listing[3], next(b['priv_key'] for b in buyers if b['address'] == listing[3]))
+        for app_id, listing in zip(app_ids, listings)
+    ]
+
+    with pytest.raises(ValueError, match="no budget app"):
+        PurchaseClient(client).buy(orders)
+    purchases = PurchaseClient(client, deploy_budget_app(client, seller['priv_key']))
+    results = purchases.buy(orders)
+    for result, listing in zip(results, listings):
+        assert result.confirmed, result.error
+        assert result.order.seller == account.address_from_private_key(seller['priv_key'])
+        assert result.cids == listing[2]
+        assert get_global_state(client, None, result.order.app_id) is None
+    assert [len(result.txids) for result in results] == [2, 2, 2, 3, 3]
+
+    # Sold out: the resolved order is refused by the pool
+    again, = purchases.buy([orders[0]])
+    assert not again.confirmed and 'TransactionPool.Remember' in again.error
+
+def test_checkout(client):
+    from contracts.ipfs_transfer.deploy import mass_deploy_ipfs
+    seller, buyer = client.pool.lease(2)
+    sizes = [1, 2, 3, 30, 31, 60, 1, 5]
+    listings = [(seller['priv_key'], TOTAL_ITEM_COST, (TEST_IPFS_KEYS * 30)[:size], buyer['address']) for size in sizes]
+    app_ids = mass_deploy_ipfs(client, listings)
+    orders = [Order(app_id, buyer['address'], buyer['priv_key']) for app_id in app_ids]
+    purchases = PurchaseClient(client, deploy_budget_app(client, seller['priv_key']))
+
+    # 8 listings take the whole group, the two large ones share the pooled budget
+    results = purchases.checkout(orders)
+    assert len({result.confirmed_round for result in results}) == 1
+    assert [result.cids for result in results] == [listing[2] for listing in listings]
+    with pytest.raises(ValueError, match="do not fit"):
+        purchases.build_checkout(orders + orders[:1])
+
+    # One sold listing fails the whole checkout
+    new_ids = mass_deploy_ipfs(client, listings[:2])
+    failed = purchases.checkout([Order(new_ids[0], buyer['address'], buyer['priv_key']), orders[1],
+                                 Order(new_ids[1], buyer['address'], buyer['priv_key'])])
+    assert all(not result.confirmed and 'TransactionPool.Remember' in result.error for result in failed)
+    assert all(get_global_state(client, None, app_id)['num_files'] for app_id in new_ids)
+
+def test_payment_is_not_shared(client):
+    from algosdk.future import transaction
+    from contracts.ipfs_transfer.deploy import mass_deploy_ipfs
+    seller, buyer = client.pool.lease(2)
+    listings = [(seller['priv_key'], TOTAL_ITEM_COST, TEST_IPFS_KEYS, buyer['address'])] * 2
+    orders = PurchaseClient(client).resolve([Order(app_id, buyer['address'], buyer['priv_key'])
+                                             for app_id in mass_deploy_ipfs(client, listings)])
+    params = client.suggested_params()
+    purchases = PurchaseClient(client)
+    first, second = [purchases.build([order], params)[0] for order in orders]
+    # The second call would find the first one before it, not a payment of its own
+    group = first[:2] + second[1:2]
+    for txn in group:
+        txn.group = None
+    transaction.assign_group_id(group)
+    with pytest.raises(AlgodHTTPError, match="TransactionPool.Remember"):
+        client.send_transactions(purchases.sign([group], orders)[0])
@@ -0,0 +1,42 @@
+import base64
+from algosdk import account, encoding
+from algosdk.future import transaction
+from test_utils import BatchSigner, sign_batch, sign_txn
+
+GENESIS_HASH = base64.b64encode(bytes(32)).decode()
+
+def payments(count, sender):
+    params = transaction.SuggestedParams(0, 1, 1000, GENESIS_HASH, 'sandnet-v1', min_fee=1000)
+    receiver = account.generate_account()[1]
+    return [transaction.PaymentTxn(sender, params, receiver, 1000 + i, note=b'n' * (i % 3)) for i in range(count)]
+
+def expected(txn, private_key):
+    signed = sign_txn(txn, private_key)
+    return signed.transaction.get_txid(), base64.b64decode(encoding.msgpack_encode(signed)), signed.dictify()
+
+def test_same_as_sign_txn():
+    private_key, address = account.generate_account()
+    txns = payments(20, address)
+    transaction.assign_group_id(txns[:4])
+    for txn, result in zip(txns, sign_batch(txns, private_key)):
+        txid, encoded, signed = expected(txn, private_key)
+        assert result.txid == txid
+        assert result.encoded == encoded
+        assert result.signed.dictify() == signed
+
+def test_rekeyed_sender():
+    private_key, _ = account.generate_account()
+    sender = account.generate_account()[1]
+    txn, = payments(1, sender)
+    result, = sign_batch([txn], private_key)
+    assert result.signed.authorizing_address == account.address_from_private_key(private_key)
+    assert result.encoded == expected(txn, private_key)[1]
+
+def test_process_pool():
+    keys = [account.generate_account() for _ in range(3)]
+    txns = [txn for private_key, address in keys for txn in payments(10, address)]
+    private_keys = [private_key for private_key, _ in keys for _ in range(10)]
+    with BatchSigner(processes=2, min_batch=8, chunk_size=7) as signer:
+        results = signer.sign(txns, private_keys)
+        assert signer._pool is not None
+    assert [r.encoded for r in results] == [expected(t, k)[1] for t, k in zip(txns, private_keys)]
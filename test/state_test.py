@@ -0,0 +1,96 @@
+import base64
+import pytest
+from algosdk.error import AlgodHTTPError
+from test_utils import AppStateReader, decode_state, get_global_state, get_file_keys, pack_digests, slot_key, state_reader
+
+TEST_IPFS_KEYS = [
+    "QmcasS8sQuasoFb2MDXbmBDwatWdhbkXrmx7131Rban9GG",
+    "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+]
+
+def teal_value(key, value):
+    if isinstance(value, int):
+        encoded = {'type': 2, 'uint': value, 'bytes': ''}
+    else:
+        encoded = {'type': 1, 'uint': 0, 'bytes': base64.b64encode(value).decode()}
+    return {'key': base64.b64encode(key).decode(), 'value': encoded}
+
+class AppClient:
+    def __init__(self, apps, last_round=100):
+        self.apps = apps
+        self.last_round = last_round
+        self.app_fetches = 0
+
+    def status(self):
+        return {'last-round': self.last_round}
+
+    def application_info(self, app_id):
+        self.app_fetches += 1
+        if app_id not in self.apps:
+            raise AlgodHTTPError('application does not exist', 404)
+        state = [teal_value(key, value) for key, value in self.apps[app_id].items()]
+        return {'id': app_id, 'params': {'global-state': state} if state else {}}
+
+def sale_state(cids):
+    state = {b'num_files': len(cids), b'payment_amount': 300000, b'buyer': b'\xff' * 32}
+    for i, slot in enumerate(pack_digests(cids)):
+        state[slot_key(i)] = slot
+    return state
+
+def test_raw_keys_and_values():
+    state = decode_state([teal_value(b'\x80', b'\xff\x00'), teal_value(b'num_files', 3)])
+    assert state == {b'\x80': b'\xff\x00', b'num_files': 3}
+
+def test_cached_per_round():
+    client = AppClient({1: sale_state(TEST_IPFS_KEYS)})
+    reader = AppStateReader(client)
+    assert reader.global_state(1)[b'num_files'] == 2
+    reader.global_state(1)
+    assert client.app_fetches == 1
+    client.last_round += 1
+    reader.global_state(1)
+    assert client.app_fetches == 2
+
+def test_bulk_read():
+    client = AppClient({app_id: sale_state(TEST_IPFS_KEYS[:1]) for app_id in range(1, 21)})
+    states = AppStateReader(client).global_states(list(range(1, 22)))
+    assert len(states) == 21
+    assert states[21] is None
+    assert all(states[app_id][b'num_files'] == 1 for app_id in range(1, 21))
+
+def test_legacy_global_state_checks_every_app():
+    client = AppClient({1: {}, 2: sale_state(TEST_IPFS_KEYS)})
+    assert get_global_state(client, None, 1) is None
+    global_state = get_global_state(client, None, 2)
+    assert global_state['payment_amount'] == 300000
+    assert global_state['buyer'] == base64.b64encode(b'\xff' * 32).decode()
+    assert get_file_keys(client, None, 2) == TEST_IPFS_KEYS
+
+def test_legacy_helpers_share_the_client_reader():
+    client = AppClient({1: sale_state(TEST_IPFS_KEYS)})
+    get_global_state(client, None, 1)
+    get_global_state(client, None, 1)
+    assert get_file_keys(client, None, 1) == TEST_IPFS_KEYS
+    assert client.app_fetches == 1
+    assert state_reader(client) is state_reader(client)
+    client.last_round += 1
+    get_global_state(client, None, 1)
+    assert client.app_fetches == 2
+
+def test_rounds_before_the_latest_are_not_read():
+    client = AppClient({1: sale_state(TEST_IPFS_KEYS)})
+    reader = AppStateReader(client)
+    assert reader.latest_global_state(1)[0] == 100
+    client.last_round += 1
+    client.apps[1][b'num_files'] = 3
+    # Round 100 was cached while it was the latest
+    assert reader.global_state(1, 100)[b'num_files'] == 2
+    assert reader.global_states([1], 100)[1][b'num_files'] == 2
+    assert client.app_fetches == 1
+    reader.invalidate(1)
+    with pytest.raises(ValueError):
+        reader.global_state(1, 100)
+    with pytest.raises(ValueError):
+        reader.global_states([1], 100)
+    assert client.app_fetches == 1
+    assert reader.global_state(1, 101)[b'num_files'] == 3
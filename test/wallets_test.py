@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from algosdk.future import transaction
+from test_utils import PooledAlgodClient, WalletPool, generate_new_account, sign_txn, wait_for_txns_confirm
+from test_utils.local_algod import LocalAlgod
+
+BALANCE = 1000000
+
+@pytest.fixture
+def funder():
+    return generate_new_account()
+
+@pytest.fixture
+def client(funder):
+    with LocalAlgod(genesis={funder[2]: 10 ** 12}) as algod:
+        client = PooledAlgodClient('', algod.address)
+        yield client
+        client.close()
+
+@pytest.fixture
+def pool(client, funder, tmp_path):
+    return WalletPool(client, funder[0], path=str(tmp_path / 'pool'), balance=BALANCE)
+
+def spendable(client, address):
+    info = client.account_info(address)
+    return info['amount'] - info['min-balance']
+
+def test_leases_are_exclusive(pool, client, funder):
+    # Two pools on one directory stand for two pytest workers
+    other = WalletPool(client, funder[0], path=pool.path, balance=BALANCE)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        leases = list(executor.map(lambda p: p.lease(3), [pool, other] * 3))
+    addresses = [wallet['address'] for wallets in leases for wallet in wallets]
+    assert len(set(addresses)) == len(addresses) == 18
+    assert all(spendable(client, address) == BALANCE for address in addresses)
+    for wallets in leases:
+        pool.release(wallets)
+    assert len(pool.wallets()) == 18
+
+def test_released_wallets_are_recycled(pool, client):
+    assert len(pool.fill(4)) == 4
+    with pool.leased(2) as first:
+        # Spend some, the next lease tops it back up
+        params = client.suggested_params()
+        txn = transaction.PaymentTxn(first[0]['address'], params, first[1]['address'], 300000)
+        client.send_transactions([sign_txn(txn, first[0]['priv_key'])])
+        wait_for_txns_confirm(client, [txn.get_txid()], 5)
+    with pool.leased(4) as again:
+        assert {w['address'] for w in first} <= {w['address'] for w in again}
+        assert all(spendable(client, w['address']) >= BALANCE for w in again)
+    assert len(pool.wallets()) == 4
+    # Nothing to top up when every wallet has its balance
+    with pool.leased(4, top_up=False) as wallets:
+        assert pool.top_up(wallets) == []
+
+def test_abandoned_lease_is_taken_over(pool):
+    wallet, = pool.lease(1, top_up=False)
+    assert pool.lease(1, top_up=False)[0]['address'] != wallet['address']
+    lease_path = os.path.join(pool.path, wallet['address'] + '.lease')
+    abandoned = time.time() - pool.lease_timeout - 1
+    os.utime(lease_path, (abandoned, abandoned))
+    assert pool.lease(1, top_up=False)[0]['address'] == wallet['address']
+
+def test_failed_top_up_releases(client, tmp_path):
+    pool = WalletPool(client, None, path=str(tmp_path / 'pool'))
+    pool.funder_mnemonic = None
+    with pytest.raises(ValueError, match="no funder"):
+        pool.lease(2)
+    assert not any(name.endswith('.lease') for name in os.listdir(pool.path))
@@ -1,2 +1,9 @@
 from .test_utils import *
-from .ipfs_utils import *
\ No newline at end of file
+from .ipfs_utils import *
+from .merkle import *
+from .confirm import *
+from .client import *
+from .state import *
+from .mirror import *
+from .wallets import *
+from .signing import *
@@ -0,0 +1,224 @@
+import asyncio
+import copy
+import http.client
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+
+from algosdk import constants, error
+from algosdk.v2client import algod
+
+# Connection errors that mean an idle keep-alive connection was closed by the server
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# Older than this, cached suggested params are refetched even if no new round was seen
+PARAMS_MAX_AGE = 5.0
+
+
+class PooledAlgodClient(algod.AlgodClient):
+    """
+    AlgodClient that keeps its HTTP connections alive and reuses them, instead of
+    opening a new connection for every request.
+
+    suggested_params() is cached for the current round: it is only fetched again
+    once status()/status_after_block() report a newer round, or after
+    PARAMS_MAX_AGE seconds when nothing reported one.
+
+    Safe to share between threads, each request takes its own connection from
+    the pool.
+    """
+
+    def __init__(self, algod_token, algod_address, headers=None, max_connections=16, timeout=30):
+        """
+        Args:
+            algod_token (str): algod API token
+            algod_address (str): algod URL, e.g. http://localhost:4001
+            headers (dict, optional): extra headers sent with every request
+            max_connections (int): idle connections kept open
+            timeout (int): socket timeout in seconds
+        """
+        super().__init__(algod_token, algod_address, headers)
+        url = parse.urlsplit(algod_address)
+        self._connection_class = (
+            http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        )
+        self._host = url.netloc
+        self._base_path = url.path.rstrip('/')
+        self._timeout = timeout
+        self.max_connections = max_connections
+        self._idle = queue.LifoQueue(max_connections)
+
+        self._params_lock = threading.Lock()
+        self._params = None
+        self._params_round = -1
+        self._params_time = 0.0
+        self._last_round = -1
+
+    def _connection(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connection_class(self._host, timeout=self._timeout), False
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        # Same request building and error handling as AlgodClient.algod_request
+        header = {'User-Agent': 'py-algorand-sdk'}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in constants.no_auth:
+            header.update({constants.algod_auth_header: self.algod_token})
+        if requrl not in constants.unversioned_paths:
+            requrl = algod.api_version_path_prefix + requrl
+        if params:
+            requrl = requrl + '?' + parse.urlencode(params)
+
+        status, body = self._send(method, self._base_path + requrl, data, header)
+        if status >= 400:
+            message = body.decode('utf-8')
+            try:
+                message = json.loads(message)['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise error.AlgodHTTPError(message, status)
+        if response_format == 'json':
+            try:
+                return json.loads(body)
+            except Exception as e:
+                raise error.AlgodResponseError('Failed to parse JSON response from algod') from e
+        return body
+
+    def _send(self, method, path, data, header):
+        connection, reused = self._connection()
+        try:
+            connection.request(method, path, body=data, headers=header)
+            response = connection.getresponse()
+            body = response.read()
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection, retry once on a fresh one
+            connection = self._connection_class(self._host, timeout=self._timeout)
+            try:
+                connection.request(method, path, body=data, headers=header)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response.status, body
+
+    def _observe_round(self, status):
+        with self._params_lock:
+            self._last_round = max(self._last_round, status['last-round'])
+        return status
+
+    def status(self, **kwargs):
+        return self._observe_round(super().status(**kwargs))
+
+    def status_after_block(self, block_num, **kwargs):
+        return self._observe_round(super().status_after_block(block_num, **kwargs))
+
+    def suggested_params(self, **kwargs):
+        """
+        Suggested params for the latest known round, fetched at most once per round.
+        Returns a copy, so callers may change fee or flat_fee freely.
+        """
+        with self._params_lock:
+            fresh = (
+                self._params is not None
+                and self._params_round >= self._last_round
+                and time.monotonic() - self._params_time < PARAMS_MAX_AGE
+            )
+            if fresh:
+                return copy.copy(self._params)
+        params = super().suggested_params(**kwargs)
+        with self._params_lock:
+            self._params = params
+            self._params_round = params.first
+            self._params_time = time.monotonic()
+            self._last_round = max(self._last_round, params.first)
+        return copy.copy(params)
+
+
+class AsyncAlgodClient:
+    """
+    asyncio interface over a PooledAlgodClient. Calls run on a thread pool sized
+    like the connection pool, so concurrent coroutines each get a kept-alive
+    connection.
+    """
+
+    def __init__(self, client, max_workers=None):
+        self.client = client
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or client.max_connections,
+            thread_name_prefix='algod'
+        )
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+
+    async def send_transactions(self, txns, **kwargs):
+        return await self._call(self.client.send_transactions, txns, **kwargs)
+
+    async def pending_transaction_info(self, transaction_id, **kwargs):
+        return await self._call(self.client.pending_transaction_info, transaction_id, **kwargs)
+
+    async def status(self, **kwargs):
+        return await self._call(self.client.status, **kwargs)
+
+    async def status_after_block(self, block_num, **kwargs):
+        return await self._call(self.client.status_after_block, block_num, **kwargs)
+
+    async def account_info(self, address, **kwargs):
+        return await self._call(self.client.account_info, address, **kwargs)
+
+    async def suggested_params(self, **kwargs):
+        return await self._call(self.client.suggested_params, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+def shared_algod_client(token, address, headers=None):
+    """
+    One PooledAlgodClient per (token, address, headers), shared by every caller
+    in the process.
+    """
+    key = (token, address, tuple(sorted((headers or {}).items())))
+    with _shared_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = PooledAlgodClient(token, address, headers)
+        return _shared_clients[key]
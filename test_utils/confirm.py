@@ -0,0 +1,264 @@
+import base64
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import msgpack
+from algosdk import encoding
+from algosdk.error import AlgodHTTPError
+
+
+class ConfirmationError(Exception):
+    """
+    Raised when some transactions were rejected or not confirmed in time.
+    results holds the Confirmation of every waited txid, failed or not.
+    """
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+@dataclass
+class Confirmation:
+    txid: str
+    confirmed_round: Optional[int] = None
+    # seconds between watch() and the block that confirmed the txn
+    latency: Optional[float] = None
+    pool_error: Optional[str] = None
+    # pending_transaction_info response, fetched once the txn is confirmed
+    info: Optional[dict] = None
+
+    @property
+    def confirmed(self):
+        return self.confirmed_round is not None
+
+
+def block_txids(block_msgpack):
+    """
+    Compute the ids of the transactions in a block fetched with format=msgpack.
+
+    Blocks strip the genesis hash/id from each transaction, they are put back
+    before hashing so the ids match the ones returned on submission.
+
+    Args:
+        block_msgpack (bytes): raw /v2/blocks/{round}?format=msgpack response
+    Returns:
+        list: transaction ids in block order
+    """
+    block = msgpack.unpackb(block_msgpack, raw=False, strict_map_key=False)['block']
+    txids = []
+    for stxn in block.get('txns', []):
+        txn = dict(stxn['txn'])
+        txn['gh'] = block['gh']
+        if stxn.get('hgi'):
+            txn['gen'] = block['gen']
+        # msgpack_encode gives the canonical encoding the txid is computed over
+        encoded = base64.b64decode(encoding.msgpack_encode(txn))
+        digest = encoding.checksum(b'TX' + encoded)
+        txids.append(base64.b32encode(digest).decode().strip('='))
+    return txids
+
+
+class ConfirmationService:
+    """
+    Confirms many transactions by watching blocks instead of polling each txid.
+
+    Every round costs one block fetch whatever the number of watched txids.
+    pending_transaction_info is called once per txid, to fetch the result of a
+    confirmed txn or to find out why one never made it into a block. Txids sent
+    before the watched rounds are looked up when watching starts instead, as they
+    may have confirmed in a block that is never fetched.
+
+    Use wait() to block on a set of txids, or watch() for futures and start() to
+    resolve them from a background thread.
+    """
+
+    def __init__(self, client, timeout=5, fetch_info=True):
+        """
+        Args:
+            client (AlgodClient): algod client
+            timeout (int): rounds after watch() before a txn is given up on
+            fetch_info (bool): attach pending_transaction_info to confirmations
+        """
+        self.client = client
+        self.timeout = timeout
+        self.fetch_info = fetch_info
+        self._lock = threading.Lock()
+        # txid -> (future, watch time, last round to look at)
+        self._watched: Dict[str, tuple] = {}
+        self._next_round = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def watch(self, txids, submitted_round=None):
+        """
+        Start watching txids.
+        Args:
+            txids (list): transaction ids
+            submitted_round (int, optional): a round at or before the last one the
+                node reported when the txids were sent, e.g. the first valid round
+                of their suggested params. None if they were just sent
+        Returns:
+            dict: txid -> Future resolving to a Confirmation
+        """
+        last_round = self.client.status()['last-round']
+        now = time.perf_counter()
+        settled = {}
+        # Blocks before last_round are never fetched, the first one a txn can land in is submitted_round + 1
+        if submitted_round is not None and submitted_round + 1 < last_round:
+            with self._lock:
+                new = [txid for txid in dict.fromkeys(txids) if txid not in self._watched]
+            settled = {txid: self._pending(txid, now) for txid in new}
+        futures = {}
+        with self._lock:
+            if self._next_round is None or self._next_round > last_round:
+                # The current block may already hold txns sent just before watching
+                self._next_round = last_round
+            for txid in txids:
+                if settled.get(txid) is not None:
+                    futures[txid] = Future()
+                    futures[txid].set_result(settled[txid])
+                    continue
+                if txid not in self._watched:
+                    self._watched[txid] = (Future(), now, last_round + self.timeout)
+                futures[txid] = self._watched[txid][0]
+        return futures
+
+    def wait(self, txids, raise_on_error=True, submitted_round=None):
+        """
+        Watch txids and drive rounds on the calling thread until all are settled.
+        Args:
+            txids (list): transaction ids
+            raise_on_error (bool): raise ConfirmationError if any txn failed
+            submitted_round (int, optional): see watch()
+        Returns:
+            dict: txid -> Confirmation
+        """
+        futures = self.watch(txids, submitted_round)
+        while not all(future.done() for future in futures.values()):
+            if self._thread is not None:
+                # A background thread is already stepping through rounds
+                for future in futures.values():
+                    future.exception()
+                break
+            self.step()
+        results = {txid: future.result() for txid, future in futures.items()}
+        failed = [c for c in results.values() if not c.confirmed]
+        if failed and raise_on_error:
+            raise ConfirmationError(
+                '{} of {} transactions failed: {}'.format(
+                    len(failed), len(results),
+                    ', '.join('{} ({})'.format(c.txid, c.pool_error or 'timeout') for c in failed)
+                ),
+                results
+            )
+        return results
+
+    def step(self):
+        """
+        Process the next round: wait for its block, resolve the txids in it and
+        settle the ones whose timeout ran out.
+        """
+        with self._lock:
+            current = self._next_round
+            if current is None or not self._watched:
+                return
+        if current > 0:
+            self.client.status_after_block(current - 1)
+        try:
+            txids = block_txids(self.client.block_info(current, response_format='msgpack'))
+        except AlgodHTTPError:
+            # Block isn't available yet, wait for it
+            self.client.status_after_block(current)
+            return
+        now = time.perf_counter()
+
+        resolved = []
+        expired = []
+        with self._lock:
+            for txid in txids:
+                if txid in self._watched:
+                    future, start, _ = self._watched.pop(txid)
+                    resolved.append((future, Confirmation(txid, current, now - start)))
+            for txid, (future, start, last_round) in list(self._watched.items()):
+                if current >= last_round:
+                    expired.append((txid, future, start))
+                    del self._watched[txid]
+            self._next_round = current + 1
+
+        for future, confirmation in resolved:
+            if self.fetch_info:
+                confirmation.info = self.client.pending_transaction_info(confirmation.txid)
+            future.set_result(confirmation)
+        for txid, future, start in expired:
+            future.set_result(self._settle(txid, start))
+
+    def _pending(self, txid, start):
+        # Confirmed or failed according to the node, None while the txn waits in the pool
+        confirmation = Confirmation(txid)
+        try:
+            info = self.client.pending_transaction_info(txid)
+        except AlgodHTTPError as e:
+            confirmation.pool_error = str(e)
+            return confirmation
+        if info.get('confirmed-round', 0) > 0:
+            confirmation.confirmed_round = info['confirmed-round']
+            confirmation.latency = time.perf_counter() - start
+            confirmation.info = info if self.fetch_info else None
+        elif info.get('pool-error'):
+            confirmation.pool_error = info['pool-error']
+        else:
+            return None
+        return confirmation
+
+    def _settle(self, txid, start):
+        # Not seen in any watched block: it may have confirmed in a skipped one or been dropped
+        confirmation = self._pending(txid, start)
+        if confirmation is None:
+            confirmation = Confirmation(txid, pool_error='not confirmed after {} rounds'.format(self.timeout))
+        return confirmation
+
+    def start(self):
+        """
+        Resolve watched futures from a background thread until stop().
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+
+        def run():
+            while not self._stopping.is_set():
+                if self._watched:
+                    self.step()
+                else:
+                    self._stopping.wait(0.05)
+
+        self._thread = threading.Thread(target=run, name='confirmation-service', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+
+def wait_for_txns_confirm(client, transaction_ids, timeout, submitted_round=None):
+    """
+    Wait until every transaction is confirmed or rejected, or until 'timeout'
+    number of rounds have passed, watching each block once for all of them.
+
+    Args:
+        transaction_ids (list): the transactions to wait for
+        timeout (int): maximum number of rounds to wait
+        submitted_round (int, optional): see ConfirmationService.watch
+    Returns:
+        dict: txid -> Confirmation, with the pending transaction information in info
+    Raises:
+        ConfirmationError: if any transaction was rejected or timed out
+    """
+    return ConfirmationService(client, timeout).wait(transaction_ids, submitted_round=submitted_round)
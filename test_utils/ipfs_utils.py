@@ -1,5 +1,44 @@
-import base58
-import binascii
+import base64
+from functools import lru_cache
+
+# sha2-256 multihash prefix: function code 0x12, digest length 0x20
+SHA2_256_PREFIX = b'\x12\x20'
+DIGEST_SIZE = 32
+CID_CACHE_SIZE = 1 << 16
+
+B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+B58_INDEX = {char: i for i, char in enumerate(B58_ALPHABET)}
+B58_CHUNK = 58 ** 9
+
+# Global state layout: each slot has a 1 byte key and holds up to 3 raw digests,
+# the most that fits the 128 byte key+value limit
+DIGESTS_PER_SLOT = 3
+SLOT_SIZE = DIGESTS_PER_SLOT * DIGEST_SIZE
+
+# Box storage layout: one box per 32 digests, so a box read fills exactly one
+# 1024 byte note, named by its 2 byte big endian index
+DIGESTS_PER_BOX = 32
+BOX_SIZE = DIGESTS_PER_BOX * DIGEST_SIZE
+BOX_NAME_SIZE = 2
+
+# Minimum balance an app account needs per box: 2500 + 400 * (name + value bytes)
+BOX_FLAT_MIN_BALANCE = 2500
+BOX_BYTE_MIN_BALANCE = 400
+
+# Marketplace layout: one box per listing, named by the 8 byte listing id, holding
+# seller (32) | buyer (32) | price (8) | num_files (8) | uploaded (8) followed by
+# the digests. Digests are delivered 32 to a note, as with box storage
+LISTING_NAME_SIZE = 8
+LISTING_HEADER_SIZE = 88
+MAX_LISTING_BOX_SIZE = 32768
+MAX_LISTING_FILES = (MAX_LISTING_BOX_SIZE - LISTING_HEADER_SIZE) // DIGEST_SIZE
+
+# Multicodecs a CIDv1 may wrap a sha2-256 file digest in
+CIDV1_CODECS = {0x70: 'dag-pb', 0x55: 'raw'}
+
+
+class CIDError(ValueError):
+    pass
 
 
 def ipfscidv0_to_byte32(cid):
@@ -12,9 +51,7 @@ def ipfscidv0_to_byte32(cid):
     """
     """bytes32 is converted back into Ipfs hash format."""
 
-    decoded = base58.b58decode(cid)
-    sliced_decoded = decoded[2:]
-    return binascii.b2a_hex(sliced_decoded).decode("utf-8")
+    return cid_to_digest(cid).hex()
 
 def byte32_to_ipfscidv0(hexstr):
     """
@@ -25,6 +62,257 @@ def byte32_to_ipfscidv0(hexstr):
         str: IPFS CID Version 0
     """
 
-    binary_str = binascii.a2b_hex(hexstr)
-    completed_binary_str = b'\x12 ' + binary_str
-    return base58.b58encode(completed_binary_str).decode("utf-8")
\ No newline at end of file
+    return digest_to_cidv0(bytes.fromhex(hexstr))
+
+@lru_cache(maxsize=CID_CACHE_SIZE)
+def cid_to_digest(cid):
+    """
+    Convert a CID to the raw sha2-256 digest it addresses.
+    Args:
+        cid (string): CIDv0 ("Qm...") or base32 CIDv1 ("b...")
+    Returns:
+        bytes: 32 byte digest
+    Raises:
+        CIDError: if the CID is malformed or not a sha2-256 multihash
+    """
+    if cid.startswith('b'):
+        return _cidv1_to_digest(cid)
+    if len(cid) != 46:
+        raise CIDError('CIDv0 must be 46 characters: {}'.format(cid))
+
+    # Accumulate 9 digits at a time on small ints before touching the big int
+    value = 0
+    try:
+        value = B58_INDEX[cid[0]]
+        for start in range(1, 46, 9):
+            chunk = 0
+            for char in cid[start:start + 9]:
+                chunk = chunk * 58 + B58_INDEX[char]
+            value = value * B58_CHUNK + chunk
+    except KeyError:
+        raise CIDError('invalid base58 character in {}'.format(cid))
+    if value >> (8 * (DIGEST_SIZE + 2)):
+        raise CIDError('CIDv0 is too long: {}'.format(cid))
+    multihash = value.to_bytes(DIGEST_SIZE + 2, 'big')
+    return _check_multihash(multihash, cid)
+
+@lru_cache(maxsize=CID_CACHE_SIZE)
+def digest_to_cidv0(digest):
+    """
+    Convert a raw sha2-256 digest to ipfscidv0.
+    Args:
+        digest (bytes): 32 byte digest
+    Returns:
+        str: IPFS CID Version 0
+    """
+    if len(digest) != DIGEST_SIZE:
+        raise CIDError('digest must be {} bytes, got {}'.format(DIGEST_SIZE, len(digest)))
+    value = int.from_bytes(SHA2_256_PREFIX + digest, 'big')
+    chars = []
+    # A 34 byte multihash starting with 0x12 always encodes to 46 characters;
+    # peel off 9 digits per big-int division and finish them on small ints
+    for _ in range(5):
+        value, chunk = divmod(value, B58_CHUNK)
+        for _ in range(9):
+            chunk, rem = divmod(chunk, 58)
+            chars.append(B58_ALPHABET[rem])
+    while value:
+        value, rem = divmod(value, 58)
+        chars.append(B58_ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+def cids_to_digests(cids, as_buffer=False):
+    """
+    Convert many CIDs at once.
+    Args:
+        cids (list): CIDv0 or base32 CIDv1 strings, may be mixed
+        as_buffer (bool): return one contiguous buffer instead of a list
+    Returns:
+        list | bytes: 32 byte digests, or their concatenation when as_buffer is set
+    """
+    digests = [cid_to_digest(cid) for cid in cids]
+    if as_buffer:
+        return b''.join(digests)
+    return digests
+
+def digests_to_cids(digests):
+    """
+    Convert many digests back to ipfscidv0.
+    Args:
+        digests (list | bytes | bytearray | memoryview): 32 byte digests, or a
+            contiguous buffer holding them back to back
+    Returns:
+        list: IPFS CID Version 0 strings
+    """
+    if isinstance(digests, (bytes, bytearray, memoryview)):
+        digests = split_digests(digests)
+    return [digest_to_cidv0(bytes(digest)) for digest in digests]
+
+def split_digests(buffer):
+    """
+    Split a contiguous buffer into 32 byte digests.
+    Args:
+        buffer (bytes | bytearray | memoryview): concatenated digests
+    Returns:
+        list: 32 byte digests
+    """
+    buffer = bytes(buffer)
+    if len(buffer) % DIGEST_SIZE:
+        raise CIDError('buffer length {} is not a multiple of {}'.format(len(buffer), DIGEST_SIZE))
+    return [buffer[i:i + DIGEST_SIZE] for i in range(0, len(buffer), DIGEST_SIZE)]
+
+def num_slots(num_files, per_slot=DIGESTS_PER_SLOT):
+    """
+    Number of state slots needed to store num_files digests.
+    """
+    return (num_files + per_slot - 1) // per_slot
+
+def slot_key(index):
+    """
+    Key of the state slot holding digests [index * 3, index * 3 + 3).
+    Args:
+        index (int): slot index, 0-255
+    Returns:
+        bytes: 1 byte key, the low byte of Itob(index)
+    """
+    return bytes([index])
+
+def pack_digests(cids, per_slot=DIGESTS_PER_SLOT):
+    """
+    Pack CIDs into the values stored in the contract's digest slots.
+    Args:
+        cids (list): CIDv0 or base32 CIDv1 strings
+        per_slot (int): digests per slot
+    Returns:
+        list: one bytes value per slot, the last one may be short
+    """
+    buffer = cids_to_digests(cids, as_buffer=True)
+    size = per_slot * DIGEST_SIZE
+    return [buffer[i:i + size] for i in range(0, len(buffer), size)]
+
+def unpack_digests(slots, num_files=None):
+    """
+    Rebuild the CID list from packed slot values.
+    Args:
+        slots (list): slot values in slot order, raw bytes or base64 strings as
+            returned by algod
+        num_files (int, optional): number of files to keep, defaults to all
+    Returns:
+        list: IPFS CID Version 0 strings
+    """
+    buffer = b''.join(base64.b64decode(slot) if isinstance(slot, str) else slot for slot in slots)
+    cids = digests_to_cids(buffer)
+    return cids if num_files is None else cids[:num_files]
+
+def num_boxes(num_files):
+    """
+    Number of boxes needed to store num_files digests.
+    """
+    return num_slots(num_files, DIGESTS_PER_BOX)
+
+def box_name(index):
+    """
+    Name of the box holding digests [index * 32, index * 32 + 32).
+    Args:
+        index (int): box index, 0-65535
+    Returns:
+        bytes: 2 byte name, the low bytes of Itob(index)
+    """
+    return index.to_bytes(BOX_NAME_SIZE, 'big')
+
+def pack_box_chunks(cids):
+    """
+    Pack CIDs into the box contents of the box storage contract.
+    Args:
+        cids (list): CIDv0 or base32 CIDv1 strings
+    Returns:
+        list: one bytes value per box, the last one may be short
+    """
+    return pack_digests(cids, DIGESTS_PER_BOX)
+
+def box_min_balance(num_files):
+    """
+    Minimum balance the app account needs to hold the boxes for num_files digests.
+    """
+    total = 0
+    for chunk in range(num_boxes(num_files)):
+        size = min(DIGESTS_PER_BOX, num_files - chunk * DIGESTS_PER_BOX) * DIGEST_SIZE
+        total += BOX_FLAT_MIN_BALANCE + BOX_BYTE_MIN_BALANCE * (BOX_NAME_SIZE + size)
+    return total
+
+def listing_box_name(listing_id):
+    """
+    Name of the box holding a marketplace listing.
+    Args:
+        listing_id (int): listing id, chosen by the seller
+    Returns:
+        bytes: the id as 8 big endian bytes
+    """
+    return listing_id.to_bytes(LISTING_NAME_SIZE, 'big')
+
+def listing_box_size(num_files):
+    if not 0 < num_files <= MAX_LISTING_FILES:
+        raise ValueError('a listing holds 1 to {} files, got {}'.format(MAX_LISTING_FILES, num_files))
+    return LISTING_HEADER_SIZE + num_files * DIGEST_SIZE
+
+def listing_min_balance(num_files):
+    """
+    Minimum balance a listing box adds to the marketplace account, refunded to
+    the seller when the listing is bought or cancelled.
+    """
+    return BOX_FLAT_MIN_BALANCE + BOX_BYTE_MIN_BALANCE * (LISTING_NAME_SIZE + listing_box_size(num_files))
+
+def delivered_file_keys(inner_txns):
+    """
+    Rebuild the CID list delivered by a purchase.
+    Args:
+        inner_txns (list): noop_response['inner-txns'] of the purchase call; key
+            deliveries carry one or more concatenated digests in their notes
+    Returns:
+        list: IPFS CID Version 0 strings in delivery order
+    """
+    notes = [
+        base64.b64decode(inner['txn']['txn']['note'])
+        for inner in inner_txns
+        if 'note' in inner['txn']['txn']
+    ]
+    return digests_to_cids(b''.join(notes))
+
+def cid_cache_info():
+    return {
+        'cid_to_digest': cid_to_digest.cache_info(),
+        'digest_to_cidv0': digest_to_cidv0.cache_info(),
+    }
+
+def _cidv1_to_digest(cid):
+    body = cid[1:].upper()
+    try:
+        raw = base64.b32decode(body + '=' * (-len(body) % 8))
+    except ValueError:
+        raise CIDError('invalid base32 CIDv1: {}'.format(cid))
+    version, offset = _read_varint(raw, 0)
+    if version != 1:
+        raise CIDError('unsupported CID version {}: {}'.format(version, cid))
+    codec, offset = _read_varint(raw, offset)
+    if codec not in CIDV1_CODECS:
+        raise CIDError('unsupported CIDv1 codec 0x{:x}: {}'.format(codec, cid))
+    return _check_multihash(raw[offset:], cid)
+
+def _check_multihash(multihash, cid):
+    if multihash[:2] != SHA2_256_PREFIX:
+        raise CIDError('not a sha2-256 multihash: {}'.format(cid))
+    if len(multihash) != DIGEST_SIZE + 2:
+        raise CIDError('wrong digest length in {}'.format(cid))
+    return multihash[2:]
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise CIDError('truncated varint')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
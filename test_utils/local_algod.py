@@ -0,0 +1,610 @@
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import msgpack
+from algosdk import account, encoding, mnemonic
+from pyteal_helpers.assembler import AssembleError, assemble, program_address
+from pyteal_helpers.interpreter import Ledger, TealError, app_address, txn_dict, txn_fields
+from .mirror import DELTA_DELETE, DELTA_SET_BYTES, DELTA_SET_UINT
+from .state import TEAL_BYTES, TEAL_UINT
+
+# In-memory stand-in for the algod endpoints this project calls, running the
+# contracts with pyteal_helpers.interpreter, so the suite and load tests run at
+# CPU speed without a sandbox:
+#
+#   python -m test_utils.local_algod --port 4001 --block-time 0
+#
+# funds the account of the fund_account_mnemonic environment variable, the one
+# the tests pay from, and listens where test_utils/test_config.json points.
+# Signatures are not checked.
+
+GENESIS_ID = 'local-v1'
+GENESIS_HASH = encoding.checksum(GENESIS_ID.encode())
+CONSENSUS_VERSION = 'future'
+GENESIS_FUNDS = 10 ** 15
+# status_after_block returns after this long even if no block came
+WAIT_FOR_BLOCK_TIMEOUT = 60.0
+
+# Keys of transaction fields holding addresses, shown base32 in JSON
+ADDRESS_KEYS = {'snd', 'rcv', 'close', 'rekey', 'asnd', 'arcv', 'aclose', 'fadd', 'sgnr', 'apat'}
+
+
+class LocalAlgodError(Exception):
+    """
+    Turned into an algod style {"message": ...} error response.
+    """
+
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.code = code
+
+
+def _txid(txn):
+    """
+    Args:
+        txn (dict): msgpack transaction as algod receives it
+    Returns:
+        str: transaction id
+    """
+    encoded = base64.b64decode(encoding.msgpack_encode(txn))
+    return base64.b32encode(encoding.checksum(b'TX' + encoded)).decode().strip('=')
+
+
+def _group_id(txns):
+    # Hashes the ids the transactions had before the group id was set
+    txids = [base64.b32decode(_txid({k: v for k, v in txn.items() if k != 'grp'}) + '====') for txn in txns]
+    return encoding.checksum(b'TG' + msgpack.packb({'txlist': txids}, use_bin_type=True))
+
+
+def _json_value(key, value):
+    """
+    JSON form algod gives a msgpack value: addresses in base32, bytes in base64.
+    """
+    if isinstance(value, dict):
+        return {k: _json_value(k, v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_json_value(key, v) for v in value]
+    if isinstance(value, bytes):
+        if key in ADDRESS_KEYS and len(value) == 32:
+            return encoding.encode_address(value)
+        return base64.b64encode(value).decode()
+    return value
+
+
+def _teal_value(value):
+    if isinstance(value, int):
+        return {'type': TEAL_UINT, 'uint': value, 'bytes': ''}
+    return {'type': TEAL_BYTES, 'uint': 0, 'bytes': base64.b64encode(value).decode()}
+
+
+def _key_values(state):
+    return [{'key': base64.b64encode(key).decode(), 'value': _teal_value(value)} for key, value in state.items()]
+
+
+def _state_delta(delta):
+    entries = []
+    for key, value in delta.items():
+        if value is None:
+            entry = {'action': DELTA_DELETE}
+        elif isinstance(value, int):
+            entry = {'action': DELTA_SET_UINT, 'uint': value}
+        else:
+            entry = {'action': DELTA_SET_BYTES, 'bytes': base64.b64encode(value).decode()}
+        entries.append({'key': base64.b64encode(key).decode(), 'value': entry})
+    return entries
+
+
+def _apply_data(result):
+    """
+    pending_transaction_info fields of an interpreter TxnResult.
+    """
+    data = {}
+    if result.created_app_id:
+        data['application-index'] = result.created_app_id
+    if result.global_delta:
+        data['global-state-delta'] = _state_delta(result.global_delta)
+    if result.local_deltas:
+        data['local-state-delta'] = [
+            {'address': encoding.encode_address(address), 'delta': _state_delta(delta)}
+            for address, delta in result.local_deltas.items()
+        ]
+    if result.logs:
+        data['logs'] = [base64.b64encode(log).decode() for log in result.logs]
+    if result.inner:
+        data['inner-txns'] = [
+            dict(_apply_data(inner), **{'pool-error': '', 'txn': {'txn': _json_value(None, txn_dict(inner.txn))}})
+            for inner in result.inner
+        ]
+    return data
+
+
+class LocalAlgod:
+    """
+    Serves algod's REST API from an in-memory ledger.
+
+    Groups are evaluated when submitted, against every group still pending, and
+    answered with a 400 like algod's transaction pool if they fail. Blocks then
+    apply the pending groups in order; state endpoints show the last block.
+
+    Args:
+        block_time (float): seconds between blocks. With 0 every submission is
+            committed in a block of its own before it returns, with None the
+            pending groups wait for a client to ask for the next round
+            (status_after_block) or for produce_block(); either way waiting for
+            a round that has not come yet produces it at once
+        genesis (dict): address -> microalgos to start with
+        host (str): interface to listen on
+        port (int): port, 0 picks a free one
+        token (str): API token required in X-Algo-API-Token, None takes any
+        min_fee (int): minimum fee per transaction
+    """
+
+    def __init__(self, block_time=0, genesis=None, host='127.0.0.1', port=0, token=None, min_fee=1000):
+        self.block_time = block_time
+        self.token = token
+        self.min_fee = min_fee
+        self.host = host
+        self.port = port
+        # pool evaluates submissions, chain holds what blocks committed
+        self.pool = Ledger(round_num=1, min_fee=min_fee)
+        self.chain = Ledger(round_num=1, min_fee=min_fee)
+        self._cond = threading.Condition()
+        for address, amount in (genesis or {}).items():
+            self.fund(address, amount)
+        self.blocks = [self._block(0, int(time.time()), [])]
+        self.last_round_time = time.monotonic()
+        # [(signed txns, field dicts, txids)] waiting for the next block
+        self.pending = []
+        # txid -> {'stxn', 'round', 'result'}
+        self.txns = {}
+        self._server = None
+        self._threads = []
+        self._stopping = threading.Event()
+
+    @property
+    def last_round(self):
+        return len(self.blocks) - 1
+
+    @property
+    def address(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def fund(self, address, amount):
+        """Credits an account outside of any block."""
+        raw = encoding.decode_address(address)
+        with self._cond:
+            self.pool.fund(raw, amount)
+            self.chain.fund(raw, amount)
+
+    def start(self):
+        """
+        Listen on a background thread, and produce blocks on another when block_time is set.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), _handler(self))
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._server.serve_forever, args=(0.05,), name='local-algod', daemon=True)]
+        if self.block_time:
+            self._threads.append(threading.Thread(target=self._produce_blocks, name='local-algod-blocks', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _produce_blocks(self):
+        while not self._stopping.wait(self.block_time):
+            self.produce_block()
+
+    # Blocks
+
+    def _block(self, round_num, timestamp, stxns):
+        txns = []
+        for stxn in stxns:
+            stxn = dict(stxn)
+            txn = dict(stxn['txn'])
+            # Blocks leave out the genesis hash and id, hgi says the id was there
+            txn.pop('gh', None)
+            if txn.pop('gen', None):
+                stxn['hgi'] = True
+            stxn['txn'] = txn
+            txns.append(stxn)
+        block = {'rnd': round_num, 'ts': timestamp, 'gh': GENESIS_HASH, 'gen': GENESIS_ID, 'txns': txns}
+        return {k: v for k, v in block.items() if v}
+
+    def produce_block(self):
+        """
+        Commit every pending group in a new block.
+        Returns:
+            int: the new round
+        """
+        with self._cond:
+            return self._produce_block()
+
+    def _produce_block(self):
+        round_num = self.last_round + 1
+        timestamp = max(int(time.time()), self.blocks[-1].get('ts', 0))
+        self.chain.round = round_num
+        stxns = []
+        for signed, fields, txids in self.pending:
+            try:
+                results = self.chain.execute(fields)
+            except TealError as e:
+                # Can't happen unless the pool and the chain diverged
+                for txid in txids:
+                    self.txns[txid]['pool_error'] = str(e)
+                continue
+            for txid, result in zip(txids, results):
+                self.txns[txid].update(round=round_num, result=result)
+            stxns.extend(signed)
+        self.pending = []
+        self.blocks.append(self._block(round_num, timestamp, stxns))
+        self.pool.round = self.chain.round = round_num + 1
+        self.pool.timestamp = self.chain.timestamp = timestamp
+        self.last_round_time = time.monotonic()
+        self._cond.notify_all()
+        return round_num
+
+    def wait_for_block_after(self, round_num):
+        with self._cond:
+            if not self.block_time and self.last_round <= round_num:
+                # Nothing else would produce it
+                self._produce_block()
+            deadline = time.monotonic() + WAIT_FOR_BLOCK_TIMEOUT
+            while self.last_round <= round_num and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.status()
+
+    # Transactions
+
+    def submit(self, data):
+        """
+        Takes concatenated msgpack signed transactions, as send_transactions posts them.
+        Returns:
+            str: id of the first transaction
+        """
+        unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(data)
+        stxns = list(unpacker)
+        if not stxns:
+            raise LocalAlgodError('empty transaction group')
+        # Consecutive transactions with the same group id form a group
+        groups = []
+        for stxn in stxns:
+            if 'txn' not in stxn:
+                raise LocalAlgodError('msgpack decode error: not a signed transaction')
+            group_id = stxn['txn'].get('grp')
+            if groups and group_id and groups[-1][0].get('txn', {}).get('grp') == group_id:
+                groups[-1].append(stxn)
+            else:
+                groups.append([stxn])
+        with self._cond:
+            for group in groups:
+                self._submit_group(group)
+            if self.block_time == 0:
+                self._produce_block()
+        return _txid(stxns[0]['txn'])
+
+    def _submit_group(self, group):
+        txns = [stxn['txn'] for stxn in group]
+        txids = [_txid(txn) for txn in txns]
+        next_round = self.last_round + 1
+        for txid, stxn in zip(txids, group):
+            txn = stxn['txn']
+            if not any(key in stxn for key in ('sig', 'msig', 'lsig')):
+                raise LocalAlgodError('transaction {} is not signed'.format(txid))
+            if txn.get('gh') != GENESIS_HASH:
+                raise LocalAlgodError('transaction {} is for another network'.format(txid))
+            if txid in self.txns:
+                raise LocalAlgodError('transaction already in ledger: {}'.format(txid))
+            if not txn.get('fv', 0) <= next_round <= txn.get('lv', 0):
+                raise LocalAlgodError('transaction {}: round {} outside [{}--{}]'.format(
+                    txid, next_round, txn.get('fv', 0), txn.get('lv', 0)))
+        if (len(txns) > 1 or txns[0].get('grp')) and txns[0].get('grp') != _group_id(txns):
+            raise LocalAlgodError('transaction group {} has an incomplete or wrong group id'.format(txids[0]))
+        fields = [txn_fields(txn) for txn in txns]
+        try:
+            self.pool.execute(fields)
+        except TealError as e:
+            raise LocalAlgodError('TransactionPool.Remember: transaction {}: {}'.format(
+                txids[e.txn_index or 0], e))
+        for txid, stxn in zip(txids, group):
+            self.txns[txid] = {'stxn': stxn, 'round': None, 'result': None, 'pool_error': ''}
+        self.pending.append((group, fields, txids))
+
+    # Responses
+
+    def status(self):
+        with self._cond:
+            return {
+                'last-round': self.last_round,
+                'last-version': CONSENSUS_VERSION,
+                'next-version': CONSENSUS_VERSION,
+                'next-version-round': self.last_round + 1,
+                'next-version-supported': True,
+                'time-since-last-round': int((time.monotonic() - self.last_round_time) * 1e9),
+                'catchup-time': 0,
+                'stopped-at-unsupported-round': False,
+            }
+
+    def suggested_params(self):
+        return {
+            'consensus-version': CONSENSUS_VERSION,
+            'fee': 0,
+            'genesis-hash': base64.b64encode(GENESIS_HASH).decode(),
+            'genesis-id': GENESIS_ID,
+            'last-round': self.last_round,
+            'min-fee': self.min_fee,
+        }
+
+    def pending_transaction_info(self, txid):
+        with self._cond:
+            record = self.txns.get(txid)
+            if record is None:
+                raise LocalAlgodError('txn does not exist', 404)
+            info = {'pool-error': record['pool_error'], 'txn': _json_value(None, record['stxn'])}
+            if record['round'] is not None:
+                info['confirmed-round'] = record['round']
+                info.update(_apply_data(record['result']))
+            return info
+
+    def block(self, round_num, response_format):
+        with self._cond:
+            if round_num > self.last_round:
+                raise LocalAlgodError('failed to retrieve information from the ledger', 404)
+            block = self.blocks[round_num]
+        if response_format == 'msgpack':
+            return msgpack.packb({'block': block}, use_bin_type=True)
+        return {'block': _json_value(None, block)}
+
+    def app_params(self, app):
+        params = {
+            'creator': encoding.encode_address(app.creator),
+            'approval-program': base64.b64encode(app.approval).decode(),
+            'clear-state-program': base64.b64encode(app.clear).decode(),
+            'global-state-schema': {'num-uint': app.global_schema[0], 'num-byte-slice': app.global_schema[1]},
+            'local-state-schema': {'num-uint': app.local_schema[0], 'num-byte-slice': app.local_schema[1]},
+        }
+        if app.extra_pages:
+            params['extra-program-pages'] = app.extra_pages
+        if app.global_state:
+            params['global-state'] = _key_values(app.global_state)
+        return params
+
+    def local_state(self, app, state):
+        local = {'id': app.id, 'schema': {'num-uint': app.local_schema[0], 'num-byte-slice': app.local_schema[1]}}
+        if state:
+            local['key-value'] = _key_values(state)
+        return local
+
+    def application_info(self, app_id):
+        with self._cond:
+            app = self.chain.apps.get(app_id)
+            if app is None:
+                raise LocalAlgodError('application does not exist', 404)
+            return {'id': app_id, 'params': self.app_params(app)}
+
+    def account_info(self, address):
+        raw = _address(address)
+        with self._cond:
+            chain = self.chain
+            created = [app for app in chain.apps.values() if app.creator == raw]
+            opted = [(chain.apps[app_id], state) for (owner, app_id), state in chain.local_states.items()
+                     if owner == raw and app_id in chain.apps]
+            boxes = [(name, value) for (app_id, name), value in chain.boxes.items() if app_address(app_id) == raw]
+            amount = chain.balance(raw)
+            info = {
+                'address': address,
+                'amount': amount,
+                'amount-without-pending-rewards': amount,
+                'min-balance': chain.min_balance(raw),
+                'pending-rewards': 0,
+                'rewards': 0,
+                'reward-base': 0,
+                'round': self.last_round,
+                'status': 'Offline',
+                'total-apps-opted-in': len(opted),
+                'total-created-apps': len(created),
+                'total-assets-opted-in': 0,
+                'total-created-assets': 0,
+                'total-boxes': len(boxes),
+                'total-box-bytes': sum(len(name) + len(value) for name, value in boxes),
+                'apps-total-schema': {
+                    'num-uint': sum(app.global_schema[0] for app in created) + sum(app.local_schema[0] for app, _ in opted),
+                    'num-byte-slice': sum(app.global_schema[1] for app in created) + sum(app.local_schema[1] for app, _ in opted),
+                },
+            }
+            if created:
+                info['created-apps'] = [{'id': app.id, 'params': self.app_params(app)} for app in created]
+            if opted:
+                info['apps-local-state'] = [self.local_state(app, state) for app, state in opted]
+            return info
+
+    def account_application_info(self, address, app_id):
+        raw = _address(address)
+        with self._cond:
+            app = self.chain.apps.get(app_id)
+            state = self.chain.local_states.get((raw, app_id))
+            info = {'round': self.last_round}
+            if app is not None and state is not None:
+                info['app-local-state'] = self.local_state(app, state)
+            if app is not None and app.creator == raw:
+                info['created-app'] = self.app_params(app)
+            if len(info) == 1:
+                raise LocalAlgodError('account application info not found', 404)
+            return info
+
+    def application_boxes(self, app_id):
+        with self._cond:
+            if app_id not in self.chain.apps:
+                raise LocalAlgodError('application does not exist', 404)
+            names = [name for owner, name in self.chain.boxes if owner == app_id]
+        return {'boxes': [{'name': base64.b64encode(name).decode()} for name in names]}
+
+    def application_box(self, app_id, name):
+        encoding_name, _, value = name.partition(':')
+        if encoding_name in ('b64', 'base64'):
+            name = base64.b64decode(value)
+        elif encoding_name == 'str':
+            name = value.encode()
+        else:
+            raise LocalAlgodError('box name must be b64: or str: prefixed')
+        with self._cond:
+            value = self.chain.boxes.get((app_id, name))
+            if value is None:
+                raise LocalAlgodError('box not found', 404)
+        return {'name': base64.b64encode(name).decode(), 'value': base64.b64encode(value).decode(),
+                'round': self.last_round}
+
+    def compile(self, source):
+        try:
+            program = assemble(source)
+        except AssembleError as e:
+            raise LocalAlgodError(str(e))
+        return {'hash': program_address(program.bytecode), 'result': base64.b64encode(program.bytecode).decode()}
+
+
+def _address(address):
+    try:
+        return encoding.decode_address(address)
+    except Exception:
+        raise LocalAlgodError('failed to parse the address', 400)
+
+
+def _handler(algod):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in two writes, don't let the body wait for an ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parts = [unquote(part) for part in url.path.strip('/').split('/')]
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if algod.token is not None and self.headers.get('X-Algo-API-Token') != algod.token:
+                return self.reply(401, {'message': 'Invalid API Token'})
+            try:
+                self.reply(200, self.route(method, parts, query, body))
+            except LocalAlgodError as e:
+                self.reply(e.code, {'message': str(e)})
+            except (ValueError, KeyError) as e:
+                self.reply(400, {'message': 'bad request: {}'.format(e)})
+
+        def route(self, method, parts, query, body):
+            if parts == ['health']:
+                return {}
+            if parts[:1] != ['v2']:
+                raise LocalAlgodError('not found', 404)
+            path = parts[1:]
+            if method == 'POST':
+                if path == ['transactions']:
+                    return {'txId': algod.submit(body)}
+                if path == ['teal', 'compile']:
+                    return algod.compile(body.decode())
+            elif path == ['status']:
+                return algod.status()
+            elif path[:2] == ['status', 'wait-for-block-after'] and len(path) == 3:
+                return algod.wait_for_block_after(int(path[2]))
+            elif path == ['transactions', 'params']:
+                return algod.suggested_params()
+            elif path[:2] == ['transactions', 'pending'] and len(path) == 3:
+                return algod.pending_transaction_info(path[2])
+            elif path[:1] == ['blocks'] and len(path) == 2:
+                return algod.block(int(path[1]), query.get('format', 'json'))
+            elif path[:1] == ['accounts'] and len(path) == 2:
+                return algod.account_info(path[1])
+            elif path[:1] == ['accounts'] and len(path) == 4 and path[2] == 'applications':
+                return algod.account_application_info(path[1], int(path[3]))
+            elif path[:1] == ['applications'] and len(path) == 2:
+                return algod.application_info(int(path[1]))
+            elif path[:1] == ['applications'] and len(path) == 3 and path[2] == 'boxes':
+                return algod.application_boxes(int(path[1]))
+            elif path[:1] == ['applications'] and len(path) == 3 and path[2] == 'box':
+                return algod.application_box(int(path[1]), query['name'])
+            raise LocalAlgodError('not found', 404)
+
+        def reply(self, code, body):
+            if isinstance(body, bytes):
+                content_type = 'application/msgpack'
+            else:
+                body = json.dumps(body).encode()
+                content_type = 'application/json'
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _block_time_arg(value):
+    return None if value in ('none', 'on-demand') else float(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fast in-memory stand-in for algod')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4001)
+    parser.add_argument('--token', default=None, help='API token to require, any by default')
+    parser.add_argument('--block-time', type=_block_time_arg, default=0,
+        help='seconds between blocks, 0 for a block per submission, "none" for a block when one is waited for')
+    parser.add_argument('--fund', nargs='*', default=[], help='ADDRESS[=MICROALGOS] accounts to fund at genesis')
+    args = parser.parse_args()
+
+    genesis = {}
+    for spec in args.fund:
+        address, _, amount = spec.partition('=')
+        genesis[address] = int(amount) if amount else GENESIS_FUNDS
+    funder = os.getenv('fund_account_mnemonic')
+    if funder:
+        genesis[account.address_from_private_key(mnemonic.to_private_key(funder))] = GENESIS_FUNDS
+    elif not genesis:
+        priv_key, address = account.generate_account()
+        genesis[address] = GENESIS_FUNDS
+        print('funded account mnemonic: ' + mnemonic.from_private_key(priv_key))
+
+    algod = LocalAlgod(args.block_time, genesis, args.host, args.port, args.token).start()
+    print('local algod on ' + algod.address)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        algod.stop()
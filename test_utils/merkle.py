@@ -0,0 +1,192 @@
+import base64
+import hashlib
+from .ipfs_utils import DIGEST_SIZE, cids_to_digests
+
+# Domain separation so a leaf can never be passed off as an internal node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+HASH_SIZE = 32
+
+
+def hash_leaf(digest):
+    return hashlib.sha256(LEAF_PREFIX + digest).digest()
+
+def hash_node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleTree:
+    """
+    Merkle tree over the sha2-256 digests of a listing's CIDs.
+
+    Leaves are sha256(0x00 || digest) and nodes sha256(0x01 || left || right); an
+    odd node at the end of a level is promoted unchanged. Each level is kept as one
+    contiguous buffer, so a 100k CID tree costs ~6.4MB rather than 200k objects.
+    """
+
+    def __init__(self, cids=None, digests=None):
+        """
+        Args:
+            cids (list, optional): CIDv0 or base32 CIDv1 strings
+            digests (bytes | list, optional): raw digests, contiguous or as a list
+        """
+        if digests is None:
+            digests = cids_to_digests(cids, as_buffer=True)
+        elif not isinstance(digests, (bytes, bytearray, memoryview)):
+            digests = b''.join(digests)
+        digests = bytes(digests)
+        if not digests or len(digests) % DIGEST_SIZE:
+            raise ValueError('a tree needs at least one 32 byte digest')
+
+        self.num_leaves = len(digests) // DIGEST_SIZE
+        sha256 = hashlib.sha256
+        level = b''.join(
+            sha256(LEAF_PREFIX + digests[i:i + DIGEST_SIZE]).digest()
+            for i in range(0, len(digests), DIGEST_SIZE)
+        )
+        self.levels = [level]
+        while len(level) > HASH_SIZE:
+            width = len(level) // HASH_SIZE
+            paired = width - width % 2
+            parent = b''.join(
+                sha256(NODE_PREFIX + level[i * HASH_SIZE:(i + 2) * HASH_SIZE]).digest()
+                for i in range(0, paired, 2)
+            )
+            if width % 2:
+                parent += level[-HASH_SIZE:]
+            level = parent
+            self.levels.append(level)
+
+    @property
+    def root(self):
+        return self.levels[-1]
+
+    def proof(self, index):
+        """
+        Sibling hashes from the leaf at index up to the root.
+        Args:
+            index (int): leaf index
+        Returns:
+            list: 32 byte sibling hashes, bottom up; promoted levels are skipped
+        """
+        if not 0 <= index < self.num_leaves:
+            raise IndexError(index)
+        siblings = []
+        for level in self.levels[:-1]:
+            width = len(level) // HASH_SIZE
+            sibling = index ^ 1
+            if sibling < width:
+                siblings.append(level[sibling * HASH_SIZE:(sibling + 1) * HASH_SIZE])
+            index //= 2
+        return siblings
+
+    def proofs(self, indices=None):
+        """
+        Proofs for many leaves at once, all leaves by default.
+        Returns:
+            list: proof lists in the order of indices
+        """
+        if indices is None:
+            indices = range(self.num_leaves)
+        return [self.proof(index) for index in indices]
+
+
+def merkle_root(cids):
+    """
+    Root committed on chain for a list of CIDs.
+    """
+    return MerkleTree(cids).root
+
+def verify_proof(root, num_leaves, index, digest, proof):
+    """
+    Check that digest is leaf index of the tree with the given root.
+    Args:
+        root (bytes): committed root
+        num_leaves (int): committed file count
+        index (int): leaf index
+        digest (bytes): raw sha2-256 digest of the CID
+        proof (list): sibling hashes from MerkleTree.proof
+    Returns:
+        bool: True if the proof is valid
+    """
+    return _climb(num_leaves, index, hash_leaf(digest), proof, {}) == root
+
+def verify_proofs(root, num_leaves, items):
+    """
+    Verify many proofs against one root, sharing work between them: once a path
+    reaches a node an earlier proof already authenticated it stops there.
+    Args:
+        root (bytes): committed root
+        num_leaves (int): committed file count
+        items (list): (index, digest, proof) tuples
+    Returns:
+        list: one bool per item
+    """
+    # (level, index) -> hash of nodes already proven to lead to root
+    verified = {}
+    results = []
+    for index, digest, proof in items:
+        visited = {}
+        top = _climb(num_leaves, index, hash_leaf(digest), proof, visited, verified)
+        valid = top is not None and (top == root or top is True)
+        if valid:
+            verified.update(visited)
+        results.append(valid)
+    return results
+
+def verify_list(root, cids):
+    """
+    Verify a complete off-chain delivered CID list against the committed root.
+    Rebuilding the tree is O(n) and needs no proofs.
+    """
+    return len(cids) > 0 and merkle_root(cids) == root
+
+def _climb(num_leaves, index, node, proof, visited, verified=None):
+    """
+    Hash a leaf up to the root, returns the root, True when the path joined an
+    already verified node, or None when the proof has the wrong shape.
+    """
+    if not 0 <= index < num_leaves:
+        return None
+    width = num_leaves
+    level = 0
+    siblings = iter(proof)
+    while width > 1:
+        if verified is not None:
+            known = verified.get((level, index))
+            if known is not None:
+                return True if known == node else None
+        visited[(level, index)] = node
+        sibling_index = index ^ 1
+        if sibling_index < width:
+            sibling = next(siblings, None)
+            if sibling is None:
+                return None
+            node = hash_node(sibling, node) if index & 1 else hash_node(node, sibling)
+        index //= 2
+        width = (width + 1) // 2
+        level += 1
+    if next(siblings, None) is not None:
+        return None
+    return node
+
+def commitment_note(root, num_files):
+    """
+    Note delivered by a merkle mode purchase: the root followed by Itob(num_files).
+    """
+    return root + num_files.to_bytes(8, 'big')
+
+def delivered_commitment(inner_txns):
+    """
+    Extract the committed root and file count from noop_response['inner-txns'].
+    Returns:
+        tuple: (root, num_files), or None if no commitment was delivered
+    """
+    for inner in inner_txns:
+        note = inner['txn']['txn'].get('note')
+        if note is None:
+            continue
+        note = base64.b64decode(note)
+        if len(note) == HASH_SIZE + 8:
+            return note[:HASH_SIZE], int.from_bytes(note[HASH_SIZE:], 'big')
+    return None
@@ -0,0 +1,216 @@
+import base64
+import threading
+
+from .state import AppStateReader
+
+# algod EvalDelta actions
+DELTA_SET_BYTES = 1
+DELTA_SET_UINT = 2
+DELTA_DELETE = 3
+
+
+class StateGap(Exception):
+    """
+    A delta can't be applied on top of the mirrored state, which has to be
+    read again in full.
+    """
+
+
+class AppState:
+    """
+    Mirrored state of one app: byte and uint values are kept in separate maps
+    keyed by raw bytes, local state in one such pair per account.
+    """
+    __slots__ = ('app_id', 'uints', 'byte_values', 'local', 'round', 'synced_round')
+
+    def __init__(self, app_id):
+        self.app_id = app_id
+        self.uints = {}
+        self.byte_values = {}
+        # address -> (uints, byte_values)
+        self.local = {}
+        # round of the last applied delta, and round of the last full read
+        self.round = 0
+        self.synced_round = 0
+
+    def load(self, state, round_num):
+        self.uints, self.byte_values = _split(state)
+        self.round = self.synced_round = round_num
+
+    def get(self, key, default=None):
+        if key in self.uints:
+            return self.uints[key]
+        return self.byte_values.get(key, default)
+
+    def as_dict(self):
+        state = dict(self.byte_values)
+        state.update(self.uints)
+        return state
+
+
+def _split(state):
+    uints = {}
+    byte_values = {}
+    for key, value in (state or {}).items():
+        if isinstance(value, int):
+            uints[key] = value
+        else:
+            byte_values[key] = value
+    return uints, byte_values
+
+def apply_delta(uints, byte_values, delta):
+    """
+    Apply an algod state delta to a (uints, byte_values) pair in place.
+    Args:
+        delta (list): [{'key': b64, 'value': {'action', 'bytes', 'uint'}}]
+    Raises:
+        StateGap: when a deleted key isn't in the mirror, so a change was missed
+    """
+    for entry in delta:
+        key = base64.b64decode(entry['key'])
+        value = entry['value']
+        action = value['action']
+        if action == DELTA_SET_BYTES:
+            uints.pop(key, None)
+            byte_values[key] = base64.b64decode(value.get('bytes', ''))
+        elif action == DELTA_SET_UINT:
+            byte_values.pop(key, None)
+            uints[key] = value.get('uint', 0)
+        elif action == DELTA_DELETE:
+            if uints.pop(key, None) is None and byte_values.pop(key, None) is None:
+                raise StateGap('delete of unknown key {!r}'.format(key))
+        else:
+            raise ValueError('unknown delta action {}'.format(action))
+
+
+class StateMirror:
+    """
+    In-memory copy of the state of the apps we care about, kept current from the
+    state deltas of confirmed transactions instead of re-reading the state.
+
+    An app is read in full once, when first tracked, and again whenever a delta
+    doesn't fit: one from an earlier round than already applied, or one deleting
+    a key the mirror doesn't have. Reads never go to the network.
+
+    Only deltas fed to apply() are seen: transactions on a tracked app sent by
+    someone else are missed until the next resync().
+    """
+
+    def __init__(self, client, reader=None):
+        """
+        Args:
+            client (AlgodClient): used for the full reads only
+            reader (AppStateReader, optional): reader to resync with
+        """
+        self.client = client
+        self.reader = reader or AppStateReader(client)
+        self.apps = {}
+        self.resyncs = 0
+        self._lock = threading.RLock()
+
+    def track(self, app_id, addresses=()):
+        """
+        Start mirroring an app, reading its global state and the local state of
+        addresses in full.
+        """
+        with self._lock:
+            if app_id not in self.apps:
+                self.apps[app_id] = AppState(app_id)
+                self.resync(app_id, addresses)
+            return self.apps[app_id]
+
+    def resync(self, app_id, addresses=None):
+        """
+        Replace the mirror of an app with a full read.
+        Args:
+            app_id (int): tracked app
+            addresses (list, optional): accounts whose local state to read, by
+                default the ones already mirrored
+        """
+        with self._lock:
+            app = self.apps.setdefault(app_id, AppState(app_id))
+            round_num, global_state = self.reader.latest_global_state(app_id)
+            app.load(global_state, round_num)
+            if addresses is None:
+                addresses = list(app.local)
+            app.local = {}
+            for address in addresses:
+                local_state = self.reader.local_state(address, app_id)
+                if local_state is not None:
+                    app.local[address] = _split(local_state)
+            self.resyncs += 1
+            return app
+
+    def apply(self, txn_info):
+        """
+        Apply the state changes of a confirmed transaction and its inner
+        transactions to the tracked apps.
+        Args:
+            txn_info (dict): pending_transaction_info response
+        Returns:
+            list: ids of the tracked apps that changed
+        """
+        round_num = txn_info.get('confirmed-round', 0)
+        if not round_num:
+            raise ValueError('transaction is not confirmed')
+        changed = []
+        with self._lock:
+            self._apply(txn_info, round_num, changed)
+        return changed
+
+    def apply_all(self, txn_infos):
+        """
+        apply() for many transactions, in confirmation order.
+        """
+        changed = []
+        for txn_info in sorted(txn_infos, key=lambda info: info.get('confirmed-round', 0)):
+            changed.extend(app_id for app_id in self.apply(txn_info) if app_id not in changed)
+        return changed
+
+    def _apply(self, txn_info, round_num, changed):
+        txn = txn_info['txn']['txn']
+        app_id = txn.get('apid') or txn_info.get('application-index')
+        app = self.apps.get(app_id) if app_id else None
+        has_delta = 'global-state-delta' in txn_info or 'local-state-delta' in txn_info
+        if app is not None and has_delta and round_num > app.synced_round:
+            try:
+                if round_num < app.round:
+                    raise StateGap('delta from round {} after round {}'.format(round_num, app.round))
+                apply_delta(app.uints, app.byte_values, txn_info.get('global-state-delta', []))
+                for local_delta in txn_info.get('local-state-delta', []):
+                    uints, byte_values = app.local.setdefault(local_delta['address'], ({}, {}))
+                    apply_delta(uints, byte_values, local_delta['delta'])
+                app.round = round_num
+            except StateGap:
+                self.resync(app_id)
+            if app_id not in changed:
+                changed.append(app_id)
+        # Inner transactions carry their own deltas, e.g. calls into other apps
+        for inner in txn_info.get('inner-txns', []):
+            self._apply(inner, round_num, changed)
+
+    def global_state(self, app_id):
+        """
+        Mirrored global state, bytes key -> bytes or int value.
+        """
+        return self.apps[app_id].as_dict()
+
+    def get(self, app_id, key, default=None):
+        """
+        One global value, key as bytes or str.
+        """
+        if isinstance(key, str):
+            key = key.encode()
+        return self.apps[app_id].get(key, default)
+
+    def local_state(self, app_id, address):
+        """
+        Mirrored local state of address, None if it isn't known to be opted in.
+        """
+        local = self.apps[app_id].local.get(address)
+        if local is None:
+            return None
+        uints, byte_values = local
+        state = dict(byte_values)
+        state.update(uints)
+        return state
@@ -0,0 +1,141 @@
+import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+
+import msgpack
+from algosdk import encoding
+from algosdk.future.transaction import SignedTransaction
+from nacl.signing import SigningKey
+
+# Below this many transactions the process pool costs more than it saves
+PROCESS_BATCH_SIZE = 2048
+SIGN_CHUNK_SIZE = 512
+
+
+@dataclass
+class SignedTxn:
+    txid: str
+    signed: SignedTransaction
+    # msgpack of the signed transaction, what algod receives
+    encoded: bytes
+
+
+@lru_cache(maxsize=4096)
+def signing_key(private_key):
+    """
+    Signing key and address of a base64 private key, derived once per key.
+    Returns:
+        tuple: (nacl SigningKey, address)
+    """
+    signing = SigningKey(base64.b64decode(private_key)[:32])
+    return signing, encoding.encode_address(signing.verify_key.encode())
+
+
+def _sign_encoded(txn_bytes, private_key, sender):
+    """
+    Sign a msgpack encoded transaction.
+    Returns:
+        tuple: (txid, signed transaction bytes, signature, authorizing address or None)
+    """
+    signing, address = signing_key(private_key)
+    to_sign = b'TX' + txn_bytes
+    txid = encoding._undo_padding(base64.b32encode(encoding.checksum(to_sign)).decode())
+    signature = signing.sign(to_sign).signature
+    # Keys in canonical order: sgnr, sig, txn; the encoded txn is reused as is
+    if address == sender:
+        encoded = b'\x82' + msgpack.packb('sig') + msgpack.packb(signature) + msgpack.packb('txn') + txn_bytes
+        return txid, encoded, signature, None
+    encoded = (b'\x83' + msgpack.packb('sgnr') + msgpack.packb(encoding.decode_address(address))
+               + msgpack.packb('sig') + msgpack.packb(signature) + msgpack.packb('txn') + txn_bytes)
+    return txid, encoded, signature, address
+
+
+def _sign_chunk(chunk):
+    # Runs in the pool: encode and sign, send back only bytes
+    results = []
+    for txn, private_key in chunk:
+        txn_bytes = base64.b64decode(encoding.msgpack_encode(txn))
+        results.append(_sign_encoded(txn_bytes, private_key, txn.sender))
+    return results
+
+
+class BatchSigner:
+    """
+    Signs many transactions at once. Every transaction is msgpack encoded once
+    for its signature, txid and the bytes to send, signing keys are derived once
+    per private key, and batches of at least min_batch transactions are spread
+    over a process pool.
+
+    The results are the same as sign_txn's: SignedTransaction objects, with the
+    authorizing address set when the key isn't the sender's.
+    """
+
+    def __init__(self, processes=None, min_batch=PROCESS_BATCH_SIZE, chunk_size=SIGN_CHUNK_SIZE):
+        """
+        Args:
+            processes (int, optional): worker processes, one per core if None; 1 never starts a pool
+            min_batch (int): smallest batch signed in the pool
+            chunk_size (int): transactions sent to a worker at a time
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.min_batch = min_batch
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def sign(self, txns, private_keys):
+        """
+        Args:
+            txns (list): unsigned transactions
+            private_keys (str | list): one key for every transaction, or a key per transaction
+        Returns:
+            list: SignedTxn per transaction, in order
+        """
+        if isinstance(private_keys, str):
+            private_keys = [private_keys] * len(txns)
+        if len(private_keys) != len(txns):
+            raise ValueError('got {} keys for {} transactions'.format(len(private_keys), len(txns)))
+        items = list(zip(txns, private_keys))
+        if self.processes > 1 and len(items) >= self.min_batch:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.processes)
+            chunks = [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+            results = [result for chunk in self._pool.map(_sign_chunk, chunks) for result in chunk]
+        else:
+            results = _sign_chunk(items)
+        return [
+            SignedTxn(txid, SignedTransaction(txn, base64.b64encode(signature).decode(), auth_address), encoded)
+            for txn, (txid, encoded, signature, auth_address) in zip(txns, results)
+        ]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sign_batch(txns, private_keys, processes=1):
+    """
+    Sign txns with a one-off BatchSigner, in process unless processes says otherwise.
+    Returns:
+        list: SignedTxn per transaction
+    """
+    with BatchSigner(processes) as signer:
+        return signer.sign(txns, private_keys)
+
+
+def send_signed(client, signed):
+    """
+    Send SignedTxns, e.g. an atomic group, without encoding them again.
+    Returns:
+        str: id of the first transaction
+    """
+    client.send_raw_transaction(base64.b64encode(b''.join(s.encoded for s in signed)))
+    return signed[0].txid
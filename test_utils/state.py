@@ -0,0 +1,181 @@
+import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk.error import AlgodHTTPError
+
+# algod TealValue types
+TEAL_BYTES = 1
+TEAL_UINT = 2
+
+
+def decode_state(key_values):
+    """
+    Decode an algod global-state / key-value list.
+
+    Keys stay raw bytes: the packed slot keys are Itob bytes and are not
+    guaranteed to be valid UTF-8.
+    Args:
+        key_values (list): [{'key': b64, 'value': {'type', 'bytes', 'uint'}}]
+    Returns:
+        dict: bytes key -> bytes or int value
+    """
+    state = {}
+    for key_value in key_values:
+        value = key_value['value']
+        if value['type'] == TEAL_BYTES:
+            decoded = base64.b64decode(value['bytes'])
+        else:
+            decoded = value['uint']
+        state[base64.b64decode(key_value['key'])] = decoded
+    return state
+
+
+class AppStateReader:
+    """
+    Reads application state from the application endpoints instead of the whole
+    account of its creator, and caches the decoded state per (app_id, round).
+
+    The application endpoint only serves the latest state, so a state is cached
+    under the round the node reported right before reading it. Calls with a
+    round return a state cached for that round without any request; a round
+    that is not cached has to be the current one, older rounds raise ValueError.
+    """
+
+    def __init__(self, client, max_entries=1024, max_workers=8):
+        """
+        Args:
+            client (AlgodClient): algod client, shared between threads by the bulk calls
+            max_entries (int): cached states kept, least recently used go first
+            max_workers (int): concurrent requests made by global_states
+        """
+        self.client = client
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return False, None
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+
+    def _store(self, key, state):
+        with self._lock:
+            self._cache[key] = state
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _latest_round(self, round_num=None):
+        last_round = self.client.status()['last-round']
+        if round_num is not None and round_num != last_round:
+            raise ValueError('state at round {} is not cached, algod serves round {} only'.format(round_num, last_round))
+        return last_round
+
+    def global_state(self, app_id, round_num=None):
+        """
+        Global state of an app.
+        Args:
+            app_id (int): application id
+            round_num (int, optional): round the state is wanted at, the current one if None
+        Returns:
+            dict: bytes key -> bytes or int value, None if the app doesn't exist
+        Raises:
+            ValueError: if round_num is neither cached nor the current round
+        """
+        if round_num is not None:
+            hit, state = self._cached(('global', app_id, round_num))
+            if hit:
+                return state
+        return self._global_state(app_id, self._latest_round(round_num))
+
+    def latest_global_state(self, app_id):
+        """
+        Global state of an app at the node's current round.
+        Returns:
+            tuple: (round, state as returned by global_state)
+        """
+        round_num = self._latest_round()
+        return round_num, self._global_state(app_id, round_num)
+
+    def _global_state(self, app_id, round_num):
+        key = ('global', app_id, round_num)
+        hit, state = self._cached(key)
+        if hit:
+            return state
+        try:
+            app = self.client.application_info(app_id)
+        except AlgodHTTPError as e:
+            if e.code != 404:
+                raise
+            state = None
+        else:
+            state = decode_state(app['params'].get('global-state', []))
+        self._store(key, state)
+        return state
+
+    def global_states(self, app_ids, round_num=None):
+        """
+        Global state of many apps at the same round, fetched concurrently.
+        Args:
+            app_ids (list): application ids
+            round_num (int, optional): round the state is wanted at, the current one if None
+        Returns:
+            dict: app_id -> state as returned by global_state
+        Raises:
+            ValueError: if round_num is neither cached for every app nor the current round
+        """
+        app_ids = list(dict.fromkeys(app_ids))
+        states = {}
+        if round_num is not None:
+            for app_id in app_ids:
+                hit, state = self._cached(('global', app_id, round_num))
+                if hit:
+                    states[app_id] = state
+        missing = [app_id for app_id in app_ids if app_id not in states]
+        if missing:
+            round_num = self._latest_round(round_num)
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                states.update(zip(missing, executor.map(lambda app_id: self._global_state(app_id, round_num), missing)))
+        return {app_id: states[app_id] for app_id in app_ids}
+
+    def local_state(self, address, app_id, round_num=None):
+        """
+        Local state of an account opted into an app. The account application
+        endpoint reports its round, so no status call is needed.
+        Args:
+            address (str): account address
+            app_id (int): application id
+            round_num (int, optional): return a cached state for this round if there is one
+        Returns:
+            dict: bytes key -> bytes or int value, None if the account isn't opted in
+        """
+        if round_num is not None:
+            hit, state = self._cached(('local', address, app_id, round_num))
+            if hit:
+                return state
+        try:
+            info = self.client.account_application_info(address, app_id)
+        except AlgodHTTPError as e:
+            if e.code != 404:
+                raise
+            return None
+        local_state = info.get('app-local-state')
+        state = None if local_state is None else decode_state(local_state.get('key-value', []))
+        self._store(('local', address, app_id, info['round']), state)
+        return state
+
+    def invalidate(self, app_id=None):
+        """
+        Drop cached states, of one app or of all of them.
+        """
+        with self._lock:
+            if app_id is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache if key[-2] == app_id]:
+                del self._cache[key]
@@ -2,9 +2,18 @@ import base64
 import json
 import os
 from algosdk import mnemonic, account
-from algosdk.v2client import algod
 from algosdk.future import transaction
-from joblib import dump, load
+from pyteal_helpers.artifact import Artifact
+from pyteal_helpers.assembler import ASSEMBLER_VERSION, assemble, cross_check
+from pyteal_helpers.cache import assembler_version
+from .client import shared_algod_client
+from .confirm import wait_for_txns_confirm
+from .ipfs_utils import num_slots, slot_key, unpack_digests
+from .signing import send_signed, sign_batch
+from .state import AppStateReader
+
+# Maximum number of transactions in an atomic group
+MAX_GROUP_SIZE = 16
 
 # Set environment variables
 
@@ -25,77 +34,155 @@ def clean_build():
         if not file.path.endswith('.gitkeep'):
             os.remove(file.path)
 
+# Writes TEAL to the build folder, teal_program is either the TEAL itself or a function returning it
 def dump_teal(file_path, teal_program):
     check_build_dir()
     with open('./build/' + file_path, 'w') as f:
-        teal = teal_program()
+        teal = teal_program() if callable(teal_program) else teal_program
         f.write(teal)
         
-def compile_teal(client, to_compile, file_path):
-    compile_response = client.compile(to_compile)
+def compile_teal(client, to_compile, file_path, cache=None, check_with_algod=False):
+    """
+    Assembles TEAL to bytecode offline, no algod node is needed
+    
+    Args:
+        client (AlgodClient): only used when check_with_algod is set, may be None otherwise
+        to_compile (str): TEAL source
+        file_path (str): file inside ./build to dump the bytecode to, or None to return it
+        cache (CompileCache, optional): serves unchanged programs without assembling
+        check_with_algod (bool): also compile on algod and fail if the bytecode differs
+    Returns:
+        bytes: the bytecode when file_path is None
+    """
+    if check_with_algod:
+        compiled = cross_check(client, to_compile).bytecode
+    elif cache is None:
+        compiled = assemble(to_compile).bytecode
+    else:
+        compiled = cache.bytecode(to_compile, lambda teal: assemble(teal).bytecode, assembler_version())
+
     if file_path == None:
-        return base64.b64decode(compile_response['result'])
+        return compiled
     else:
         check_build_dir()
-        dump(base64.b64decode(compile_response['result']), './build/' + file_path)
-            
+        with open('./build/' + file_path, 'wb') as f:
+            f.write(compiled)
+
 def load_compiled(file_path):
     try:
-        compiled = load('./build/' + file_path)
-    except:
-        print("Error reading source file...exiting")
-        exit(-1)
-    return compiled
-
-def write_schema(file_path, num_ints, num_bytes):
-    f = open('./build/' + file_path, "w")
-    json.dump({"num_ints": num_ints,
-               "num_bytes": num_bytes}, f)
-    f.close()
-
-def load_schema(file_path):
-    f = open('./build/' + file_path, 'r')
-    stateJSON = json.load(f)
-    return transaction.StateSchema(stateJSON['num_ints'], stateJSON['num_bytes'])
+        with open('./build/' + file_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError('./build/{} not found, compile the contract first'.format(file_path)) from None
+
+def compile_contract(client, approval_teal, clear_teal, file_path, global_schema, local_schema, cache=None, check_with_algod=False):
+    """
+    Assembles both programs of a contract and writes them with their schemas to
+    one artifact, see pyteal_helpers.artifact
+    
+    Args:
+        file_path (str): file inside ./build to write the artifact to
+        global_schema (tuple): (num_ints, num_bytes)
+        local_schema (tuple): (num_ints, num_bytes)
+    Returns:
+        Artifact: what was written
+    """
+    artifact = Artifact.build(
+        approval_teal,
+        clear_teal,
+        compile_teal(client, approval_teal, None, cache, check_with_algod),
+        compile_teal(client, clear_teal, None, cache, check_with_algod),
+        global_schema,
+        local_schema,
+        ASSEMBLER_VERSION
+    )
+    check_build_dir()
+    artifact.dump('./build/' + file_path)
+    return artifact
+
+def load_artifact(file_path):
+    """
+    Bytecode and schemas of a contract, from an artifact inside ./build
+    
+    Raises:
+        FileNotFoundError: when the contract wasn't compiled
+        ArtifactError: when the artifact is damaged or of another format
+    """
+    try:
+        return Artifact.load('./build/' + file_path)
+    except FileNotFoundError:
+        raise FileNotFoundError('./build/{} not found, compile the contract first'.format(file_path)) from None
+
+def state_reader(client):
+    """
+    The AppStateReader of a client, made on first use and kept on the client
+    object so that the helpers below share its cache
+    """
+    reader = getattr(client, '_state_reader', None)
+    if reader is None:
+        reader = client._state_reader = AppStateReader(client)
+    return reader
 
 def get_global_state(client, address, app_id):
-    account_info = client.account_info(address)
-    output = {}
-    created_apps = account_info['created-apps']
-    for app in created_apps:
-        if app['id'] == app_id and 'global-state' in app['params']:
-            print(app)
-            for key_value in app['params']['global-state']:
-                if key_value['value']['type'] == 1:
-                    value = key_value['value']['bytes']
-                else:
-                    value = key_value['value']['uint']
-                output[base64.b64decode(key_value['key']).decode()] = value
-            return output
-        else:
-            return None
+    """
+    Global state of an app, read from the application endpoint. address, the
+    creator, is no longer needed and only kept for existing callers.
+    
+    Keys are decoded to str when they are valid UTF-8, byte values are returned
+    base64 encoded as algod sends them. Use state_reader(client) for raw keys and
+    values and bulk reads.
+    Returns:
+        dict: key -> value, or None if the app has no global state
+    """
+    return _legacy_state(state_reader(client).global_state(app_id))
+
+def get_file_keys(client, address, app_id):
+    """
+    Reads back the IPFS keys a sale app holds in its packed digest slots
+    
+    Args:
+        client (AlgodClient): algod client
+        address (str): creator of the app, unused
+        app_id (int): sale app
+    Returns:
+        list: IPFS CID Version 0 strings, or None if no sale is set up
+    """
+    global_state = state_reader(client).global_state(app_id)
+    if not global_state or b'num_files' not in global_state:
+        return None
+    num_files = global_state[b'num_files']
+    slots = [global_state[slot_key(i)] for i in range(num_slots(num_files))]
+    return unpack_digests(slots, num_files)
 
 def get_local_state(client, address, app_id):
-    account_info = client.account_info(address)
+    """
+    Local state of address in an app, or None if it isn't opted in. Same key and
+    value format as get_global_state.
+    """
+    return _legacy_state(state_reader(client).local_state(address, app_id))
+
+def _legacy_state(state):
+    if not state:
+        return None
     output = {}
-    for app in account_info['apps-local-state']:
-        if app['id'] == app_id:
-            for key_value in app['key-value']:
-                if key_value['value']['type'] == 1:
-                    value = key_value['value']['bytes']
-                else:
-                    value = key_value['value']['uint']
-                output[base64.b64decode(key_value['key']).decode()] = value
-            return output
+    for key, value in state.items():
+        try:
+            key = key.decode()
+        except UnicodeDecodeError:
+            pass
+        if isinstance(value, bytes):
+            value = base64.b64encode(value).decode()
+        output[key] = value
+    return output
             
 # Creates a new account and returns             
 def generate_new_account():
     private_key, address = account.generate_account()
     return mnemonic.from_private_key(private_key), private_key, address
 
-#gets the algod client from the alosdk            
+#gets the shared, connection pooling algod client for this node
 def get_algod_client(token, address):
-    return algod.AlgodClient(token, address)
+    return shared_algod_client(token, address)
 
 #signs the unsigned transaction using the private key and returns a signed txn
 def sign_txn(unsigned_txn, private_key):
@@ -183,27 +270,10 @@ def wait_for_txn_confirm(client, transaction_id, timeout):
         transaction_id (str): the transaction to wait for
         timeout (int): maximum number of rounds to wait
     Returns:
-        dict: pending transaction information, or throws an error if the transaction
-            is not confirmed or rejected in the next timeout rounds
+        dict: pending transaction information, or throws a ConfirmationError if the
+            transaction is rejected or not confirmed in the next timeout rounds
     """
-    start_round = client.status()["last-round"] + 1
-    current_round = start_round
-
-    while current_round < start_round + timeout:
-        try:
-            pending_txn = client.pending_transaction_info(transaction_id)
-        except Exception:
-            return
-        if pending_txn.get("confirmed-round", 0) > 0:
-            return pending_txn
-        elif pending_txn["pool-error"]:
-            raise Exception(
-                'pool error: {}'.format(pending_txn["pool-error"])
-            )
-        client.status_after_block(current_round)
-        current_round += 1
-    raise Exception(
-        'pending tx not found in timeout rounds, timeout value = : {}'.format(timeout))
+    return wait_for_txns_confirm(client, [transaction_id], timeout)[transaction_id].info
             
 def fund_account(receiver_address, sender_mnemonic, init_fund=1000000):
     """
@@ -214,17 +284,58 @@ def fund_account(receiver_address, sender_mnemonic, init_fund=1000000):
         sender_mnemonic (str): the mnemonic secret for the sender account
         init_fund (int, optional): amount to send. Defaults to 1000000.
     """
-    test_config = load_config()
+    fund_accounts([receiver_address], sender_mnemonic, init_fund)
+
+def fund_accounts(receiver_addresses, sender_mnemonic, init_fund=1000000, client=None, timeout=5):
+    """
+    Funds many test accounts at once: the payments share one client and one
+    suggested params fetch, go out in atomic groups of up to 16, and every group
+    is submitted before waiting once for all of them.
+    
+    Args:
+        receiver_addresses (list): account addresses to fund
+        sender_mnemonic (str): the mnemonic secret for the sender account
+        init_fund (int | list, optional): amount for every account, or one amount
+            per account. Defaults to 1000000.
+        client (AlgodClient, optional): client to use, built from the test config if None
+        timeout (int, optional): rounds to wait for the payments
+    Returns:
+        list: ids of the funding payments, in receiver order
+    """
+    if isinstance(init_fund, int):
+        init_fund = [init_fund] * len(receiver_addresses)
+    if len(init_fund) != len(receiver_addresses):
+        raise ValueError('got {} amounts for {} accounts'.format(len(init_fund), len(receiver_addresses)))
+    if client is None:
+        test_config = load_config()
+        client = get_algod_client(test_config['algod_token'], test_config['algod_address'])
     priv_key = mnemonic.to_private_key(sender_mnemonic)
     sender_address = account.address_from_private_key(priv_key)
-    client = get_algod_client(test_config['algod_token'], test_config['algod_address'])
-    txn, txn_id = payment_signed_txn(
-        priv_key,
-        sender_address,
-        receiver_address,
-        init_fund,
-        client.suggested_params(),
-    )
-    client.send_transaction(txn)
-    wait_for_txn_confirm(client, txn_id, 5)
+    params = client.suggested_params()
+
+    groups = []
+    for start in range(0, len(receiver_addresses), MAX_GROUP_SIZE):
+        group = [
+            transaction.PaymentTxn(sender_address, params, receiver, amount)
+            for receiver, amount in zip(
+                receiver_addresses[start:start + MAX_GROUP_SIZE],
+                init_fund[start:start + MAX_GROUP_SIZE]
+            )
+        ]
+        if len(group) > 1:
+            transaction.assign_group_id(group)
+        groups.append(group)
+
+    # Every payment is signed in one batch and encoded once
+    signed = sign_batch([txn for group in groups for txn in group], priv_key)
+    txn_ids = [s.txid for s in signed]
+    last_ids = []
+    start = 0
+    for group in groups:
+        send_signed(client, signed[start:start + len(group)])
+        start += len(group)
+        last_ids.append(txn_ids[start - 1])
 
+    # A group confirms atomically, so waiting on its last payment is enough
+    wait_for_txns_confirm(client, last_ids, timeout, params.first)
+    return txn_ids
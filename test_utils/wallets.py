@@ -0,0 +1,187 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from algosdk import account, mnemonic
+
+from .client import shared_algod_client
+
+DEFAULT_POOL_DIR = os.getenv("IPFS_SC_WALLET_POOL", "./.wallet_pool")
+# A lease this old belongs to a run that died without releasing it
+DEFAULT_LEASE_TIMEOUT = 3600
+
+
+class WalletPool:
+    """
+    Funded test accounts that are kept between runs and leased to one test,
+    thread or pytest worker at a time, so that parallel runs neither race on
+    the funding account nor wait for fresh accounts to be funded every time.
+
+    Every wallet is a file holding its mnemonic under `path`; a wallet is leased
+    by creating its .lease file exclusively, which works across threads and
+    processes without a lock on the whole pool. These are test accounts: the
+    mnemonics are stored in plain text.
+
+    Leased wallets are topped up from the funder in grouped payments whenever
+    their spendable balance dropped under `balance`.
+    """
+
+    def __init__(self, client=None, funder_mnemonic=None, path=DEFAULT_POOL_DIR, balance=1000000,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT, max_workers=8):
+        """
+        Args:
+            client (AlgodClient, optional): algod client, built from the test config if None
+            funder_mnemonic (str, optional): account paying for top ups, the
+                fund_account_mnemonic environment variable if None
+            path (str): directory of the pool, shared by every worker
+            balance (int): spendable microalgos, above the minimum balance, of a leased wallet
+            lease_timeout (int): seconds after which a lease is considered abandoned
+            max_workers (int): concurrent balance lookups
+        """
+        if client is None:
+            from .test_utils import load_config
+            test_config = load_config()
+            client = shared_algod_client(test_config['algod_token'], test_config['algod_address'])
+        self.client = client
+        self.funder_mnemonic = funder_mnemonic or os.getenv('fund_account_mnemonic')
+        self.path = path
+        self.balance = balance
+        self.lease_timeout = lease_timeout
+        self.max_workers = max_workers
+
+    def wallets(self):
+        """
+        Returns:
+            list: every wallet of the pool, leased or not
+        """
+        return [self._read(address) for address in self._addresses()]
+
+    def lease(self, count=1, top_up=True):
+        """
+        Lease count wallets, creating the pool's missing ones.
+        Args:
+            count (int): number of wallets
+            top_up (bool): fund the leased wallets that are short of balance
+        Returns:
+            list: {'mnemonic', 'priv_key', 'address'} dicts, as generate_new_account builds them
+        """
+        leased = []
+        for address in self._addresses():
+            if len(leased) == count:
+                break
+            if self._acquire(address):
+                leased.append(self._read(address))
+        while len(leased) < count:
+            leased.append(self._create())
+        if top_up:
+            try:
+                self.top_up(leased)
+            except Exception:
+                self.release(leased)
+                raise
+        return leased
+
+    def release(self, wallets):
+        """Return leased wallets to the pool."""
+        for wallet in wallets:
+            try:
+                os.remove(self._lease_path(wallet['address']))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def leased(self, count=1, top_up=True):
+        wallets = self.lease(count, top_up)
+        try:
+            yield wallets
+        finally:
+            self.release(wallets)
+
+    def fill(self, size):
+        """
+        Make sure the pool holds at least size free funded wallets, funding all of
+        them in bulk, e.g. once before starting parallel workers.
+        Returns:
+            list: addresses of the wallets
+        """
+        with self.leased(size) as wallets:
+            return [wallet['address'] for wallet in wallets]
+
+    def top_up(self, wallets):
+        """
+        Fund the wallets whose spendable balance is under the pool's balance,
+        with one group of payments per 16 wallets.
+        Returns:
+            list: ids of the top up payments
+        """
+        from .test_utils import fund_accounts
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            infos = list(pool.map(lambda wallet: self.client.account_info(wallet['address']), wallets))
+        # Spendable balance is what the account holds above its minimum balance
+        short = [
+            (wallet['address'], self.balance - (info['amount'] - info['min-balance']))
+            for wallet, info in zip(wallets, infos)
+            if info['amount'] - info['min-balance'] < self.balance
+        ]
+        if not short:
+            return []
+        if self.funder_mnemonic is None:
+            raise ValueError('{} wallets need funds and no funder mnemonic is set'.format(len(short)))
+        return fund_accounts(
+            [address for address, _ in short],
+            self.funder_mnemonic,
+            [amount for _, amount in short],
+            client=self.client
+        )
+
+    def _create(self):
+        private_key, address = account.generate_account()
+        wallet = {'mnemonic': mnemonic.from_private_key(private_key), 'priv_key': private_key, 'address': address}
+        os.makedirs(self.path, exist_ok=True)
+        # Leased before it is visible to other workers
+        self._acquire(address)
+        file_path = os.path.join(self.path, address + '.json')
+        tmp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump({'mnemonic': wallet['mnemonic']}, f)
+        os.replace(tmp_path, file_path)
+        return wallet
+
+    def _addresses(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(self.path) if name.endswith('.json'))
+
+    def _read(self, address):
+        with open(os.path.join(self.path, address + '.json')) as f:
+            words = json.load(f)['mnemonic']
+        private_key = mnemonic.to_private_key(words)
+        return {'mnemonic': words, 'priv_key': private_key, 'address': account.address_from_private_key(private_key)}
+
+    def _lease_path(self, address):
+        return os.path.join(self.path, address + '.lease')
+
+    def _acquire(self, address):
+        lease_path = self._lease_path(address)
+        try:
+            os.close(os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        # Take over an abandoned lease: only one worker can rename it away
+        try:
+            if time.time() - os.path.getmtime(lease_path) < self.lease_timeout:
+                return False
+            stale_path = '{}.{}.stale'.format(lease_path, uuid.uuid4().hex)
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return self._acquire(address)
+        if time.time() - os.path.getmtime(stale_path) < self.lease_timeout:
+            # Renewed by someone else between the check and the rename
+            os.replace(stale_path, lease_path)
+            return False
+        os.remove(stale_path)
+        return self._acquire(address)